@@ -365,6 +365,11 @@ void _detectExpirationDate() {
     // 賞味期限の読み取りに成功
     beepOK();
   } else {
+    // 賞味期限の読み取りに失敗した原因を画面上に表示
+    if (JSON.typeof(responseJSON["reason"]) == "string") {
+      refreshLcdScreen(String("[Retry]\n") + (const char*)responseJSON["reason"], true);
+    }
+
     // 賞味期限の読み取りに失敗
     beepFailure();
   }
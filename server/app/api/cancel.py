@@ -5,12 +5,11 @@ import os
 import json
 from typing import Any, Dict, List
 from configparser import ConfigParser
-from sqlalchemy.orm.exc import NoResultFound
 
 # 独自モジュール読み込み
 import app.common as common
 import app.log as log
-from model.temporary_products import TemporaryProduct
+import app.temporary_sessions as temporary_sessions
 from model.products import Product
 logger = log.get_logger("cancel")
 
@@ -45,25 +44,14 @@ def execute(request) -> Dict[str, Any]:
     session_id = request.json["session_id"]
     logger.info(f"仮登録セッションID: [{session_id}]")
 
-    with common.create_session() as session:
-        # 仮登録テーブルの該当レコードを取得
-        try:
-            target_temporary_product = session \
-                .query(TemporaryProduct) \
-                .filter(TemporaryProduct.session_id == session_id) \
-                .one()
-        except NoResultFound:
-            response = {
-                "success": False,
-                "message": f"指定されたセッションIDから仮登録テーブル上の該当するレコードを特定できませんでした: {session_id}"
-            }
-            logger.info(f"API Exit: {response}")
-            return response
-
-        # 仮登録テーブルから該当レコードを削除
-        session.delete(target_temporary_product)
-
-        session.commit()
+    # 該当する仮登録セッションを削除
+    if temporary_sessions.get_store().pop(session_id) is None:
+        response = {
+            "success": False,
+            "message": f"指定されたセッションIDから仮登録テーブル上の該当するレコードを特定できませんでした: {session_id}"
+        }
+        logger.info(f"API Exit: {response}")
+        return response
 
     response = {
         "success": True,
@@ -0,0 +1,172 @@
+##############################################################################
+#    画像から賞味期限を読み取り、同じ画像を商品イメージとして一度に本登録を行うAPI
+##############################################################################
+import uuid
+from datetime import datetime as dt
+from typing import Any, Dict, List, Optional
+from configparser import ConfigParser
+
+# 独自モジュール読み込み
+import app.log as log
+import app.common as common
+import app.api.detect as detect
+import app.background as background
+import app.image_store as image_store
+import app.thumbnails as thumbnails
+from app.kvstore import TTLStore
+from model.products import Product
+logger = log.get_logger("capture")
+
+# 設定ファイル読み込み
+config = ConfigParser()
+config.read("settings.conf", encoding="utf-8")
+
+##### 設定読み込み ####################
+# 本登録後に取り消しを受け付ける秒数 (0 で取り消し不可)
+CANCEL_WINDOW_SECONDS = config.getint("capture", "cancel_window_seconds", fallback=30)
+# 取り消し用トークンの保存先となるSQLiteファイルパス
+CANCEL_TOKEN_STORE_PATH = config.get("capture", "cancel_token_store_path", fallback="db/capture_cancel_tokens.db")
+
+# 全プロセスで共有する、取り消し用トークンから本登録IDへの対応 (取り消しを受け付ける秒数で期限切れになる)
+_cancel_tokens = TTLStore(CANCEL_TOKEN_STORE_PATH, "capture_cancel_tokens", CANCEL_WINDOW_SECONDS)
+
+
+def execute(request) -> Dict[str, Any]:
+    """JPEG形式の画像をもとに賞味期限を抽出し、同じ画像を商品イメージとして本登録します。
+    /detect と /register を1回のアップロードで済ませるためのAPIです。
+    本登録後 cancel_window_seconds 秒以内であれば、レスポンスの cancel_token を /capture/cancel に渡して取り消すことができます。
+
+    Arguments:
+        request -- POST リクエスト
+            /detect と同じ形式でJPEG画像を受け付けます
+
+    Returns:
+        Dict[str, Any] -- 処理結果
+            {
+                // 本登録に成功したかどうか
+                "success": False or True,
+
+                // 賞味期限として抽出された年月日
+                "expiration_date": { "year": yyyy, "month": mm, "day": dd },
+
+                // 本登録テーブルに追加したレコードのID
+                "product_id": xxx,
+
+                // 本登録の取り消しを受け付ける秒数
+                "cancel_window_seconds": xxx,
+
+                // /capture/cancel に渡す取り消し用トークン (取り消し不可の場合は null)
+                "cancel_token": "xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx",
+
+                // 本登録に失敗した原因を表すメッセージ
+                "message": "...",
+
+                // 本登録に失敗した原因を表すコード (/detect と同じ)
+                "reason": "..."
+            }
+    """
+    logger.info(f"API Called.")
+
+    # リクエストパラメーター取り出し
+    try:
+        image = common.JpegImage(common.read_request_image(request))
+    except ValueError as e:
+        response = _create_failure_response(f"JPEG画像として読み取れませんでした: {e}", detect.REASON_INVALID_IMAGE)
+        logger.info(f"API Exit: {response}")
+        return response
+
+    # 画像から賞味期限を解析
+    expiration_date, message, reason = detect.detect_expiration_date(image)
+    if expiration_date is None:
+        response = _create_failure_response(message, reason)
+        logger.info(f"API Exit: {response}")
+        return response
+
+    # 商品画像の保管と本登録テーブルへの追加をひとまとまりで行う
+    image_path = image_store.save(image)
+    try:
+        with common.create_session() as session:
+            product = Product(
+                image_path=image_path,
+                expiration_date=detect.to_datetime(expiration_date),
+                consumed=False,
+                added_shopping_list=False,
+                created_time=dt.now()
+            )
+            session.add(product)
+            session.flush()
+            product_id = product.id
+            session.commit()
+    except Exception:
+        # 本登録に失敗した場合はどの商品からも参照されない画像を残さない
+        image_store.release([image_path])
+        raise
+
+    # コミットまでの間に同じ内容の画像が削除されていた場合に備える
+    image_store.ensure(image, image_path)
+
+    # 表示先に合わせた縮小版はレスポンスを待たせないようにバックグラウンドで生成する
+    background.submit(thumbnails.generate, image_path)
+
+    response = {
+        "success": True,
+        "expiration_date": expiration_date,
+        "product_id": product_id,
+        "cancel_window_seconds": CANCEL_WINDOW_SECONDS,
+        "cancel_token": _issue_cancel_token(product_id),
+        "message": None,
+        "reason": None,
+    }
+    logger.info(f"API Exit: {response}")
+    return response
+
+
+def _create_failure_response(message: str, reason: str) -> Dict[str, Any]:
+    """本登録に失敗したときのレスポンスを生成します。
+
+    Arguments:
+        message {str} -- 失敗した原因を表すメッセージ
+        reason {str} -- 失敗した原因を表すコード
+
+    Returns:
+        Dict[str, Any] -- 処理結果
+    """
+    return {
+        "success": False,
+        "expiration_date": None,
+        "product_id": None,
+        "cancel_window_seconds": None,
+        "cancel_token": None,
+        "message": message,
+        "reason": reason,
+    }
+
+
+def pop_cancel_token(cancel_token: str) -> Optional[int]:
+    """取り消し用トークンに対応する本登録IDを取り出し、トークンを無効にします。
+
+    Arguments:
+        cancel_token {str} -- /capture のレスポンスに含まれる取り消し用トークン
+
+    Returns:
+        Optional[int] -- 本登録ID、存在しないか取り消しを受け付ける期間を過ぎている場合は None
+    """
+    product_id = _cancel_tokens.pop(cancel_token)
+    return None if product_id is None else int(product_id)
+
+
+def _issue_cancel_token(product_id: int) -> Optional[str]:
+    """本登録した商品の取り消し用トークンを発行します。
+    本登録IDは連番で推測できるため、取り消しには推測できないトークンを必要とします。
+
+    Arguments:
+        product_id {int} -- 本登録ID
+
+    Returns:
+        Optional[str] -- 取り消し用トークン、取り消しを受け付けない設定の場合は None
+    """
+    if CANCEL_WINDOW_SECONDS <= 0:
+        return None
+    cancel_token = str(uuid.uuid4()).replace("-", "")
+    _cancel_tokens.set(cancel_token, str(product_id))
+    return cancel_token
@@ -0,0 +1,86 @@
+##############################################################################
+#    /capture で本登録した直後の商品を取り消すAPI
+##############################################################################
+from typing import Any, Dict, List
+from sqlalchemy.orm.exc import NoResultFound
+
+# 独自モジュール読み込み
+import app.log as log
+import app.common as common
+import app.image_store as image_store
+import app.api.capture as capture
+from model.products import Product
+logger = log.get_logger("capture_cancel")
+
+
+def execute(request) -> Dict[str, Any]:
+    """/capture で本登録してから一定時間内の商品を、商品イメージ画像と合わせて削除します。
+    対象の商品は /capture が発行した取り消し用トークンで指定し、推測できる本登録IDでは受け付けません。
+
+    Arguments:
+        request -- POST リクエスト
+            {
+                // /capture のレスポンスに含まれる取り消し用トークン
+                "cancel_token": "xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx"
+            }
+
+    Returns:
+        Dict[str, Any] -- 処理結果
+            {
+                // 本登録の取り消しに成功したかどうか
+                "success": False or True,
+
+                // 本登録の取り消しに失敗した原因を表すメッセージ
+                "message": "..."
+            }
+    """
+    logger.info(f"API Called.")
+
+    # リクエストパラメーター取り出し
+    cancel_token = (request.get_json(silent=True) or {}).get("cancel_token")
+    if not isinstance(cancel_token, str) or cancel_token == "":
+        response = {
+            "success": False,
+            "message": f"取り消し用トークンが指定されていません",
+        }
+        logger.info(f"API Exit: {response}")
+        return response
+
+    # トークンは一度きりで、取り消しを受け付ける期間を過ぎると無効になる
+    product_id = capture.pop_cancel_token(cancel_token)
+    if product_id is None:
+        response = {
+            "success": False,
+            "message": f"取り消し用トークンが無効か、本登録の取り消しを受け付ける期間を過ぎています",
+        }
+        logger.info(f"API Exit: {response}")
+        return response
+    logger.info(f"本登録ID: [{product_id}]")
+
+    with common.create_session() as session:
+        try:
+            product = session \
+                .query(Product) \
+                .filter(Product.id == product_id) \
+                .one()
+        except NoResultFound:
+            response = {
+                "success": False,
+                "message": f"指定された本登録IDに該当するレコードを特定できませんでした: {product_id}",
+            }
+            logger.info(f"API Exit: {response}")
+            return response
+
+        image_path = product.image_path
+        session.delete(product)
+        session.commit()
+
+    # トランザクション確定後に、どの商品からも参照されなくなった商品イメージ画像を削除
+    image_store.release([image_path])
+
+    response = {
+        "success": True,
+        "message": None,
+    }
+    logger.info(f"API Exit: {response}")
+    return response
@@ -1,17 +1,18 @@
 ##############################################################################
 #    古くなった不要データをクリーンアップするAPI
 ##############################################################################
-import os
+import time
 import datetime
-import traceback
 from datetime import datetime as dt
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
 from configparser import ConfigParser
-from sqlalchemy import func
+from sqlalchemy import literal, tuple_
 
 # 独自モジュール読み込み
 import app.log as log
 import app.common as common
+import app.background as background
+import app.image_store as image_store
 from model.temporary_products import TemporaryProduct
 from model.products import Product
 logger = log.get_logger("cleanup")
@@ -23,13 +24,32 @@ config.read("settings.conf", encoding="utf-8")
 ##### 設定読み込み ####################
 # クリーンアップ対象とする現在の日にちを起点とした経過日数
 THRESHOLD_DAYS = int(config.get("cleanup", "threshold_days"))
+# 1回のトランザクションで削除するレコードの最大数
+CHUNK_SIZE = config.getint("cleanup", "chunk_size", fallback=500)
+# 1回の呼出で削除するレコードの最大数
+MAX_ROWS = config.getint("cleanup", "max_rows", fallback=20000)
+# 1回の呼出で削除に費やす最大秒数
+MAX_SECONDS = config.getfloat("cleanup", "max_seconds", fallback=5.0)
+
+##### 定数定義 ####################
+# 削除する順序に並べた対象テーブル (テーブル名, モデル, 削除条件とする日時の列)
+TARGETS = [
+    ("temporary_products", TemporaryProduct, TemporaryProduct.created_time),
+    ("products", Product, Product.expiration_date),
+]
+# 再開位置を表す文字列の区切り文字
+CURSOR_SEPARATOR = ","
 
 
 def execute(request) -> Dict[str, Any]:
     """古くなった不要データのクリーンアップを行います。
+    対象のレコードは一定件数ごとの短いトランザクションで削除し、1回の呼出で削除する件数と時間には上限を設けます。
+    上限に達した場合は next_cursor を cursor パラメーターに指定して呼び出すと続きから再開します。
+    本登録データの商品イメージ画像ファイルは、レコードの削除を確定した後に、どの商品からも参照されなくなったものをバックグラウンドで削除します。
 
     Arguments:
         request -- GET リクエスト
+            cursor: 前回の呼出で返された再開位置 (省略時は先頭から)
 
     Returns:
         Dict[str, Any] -- 処理結果
@@ -38,40 +58,141 @@ def execute(request) -> Dict[str, Any]:
                 "success": False or True,
 
                 // クリーンアップしたレコードの総数
-                "count": xxx
+                "count": xxx,
+
+                // 対象のレコードをすべて削除し終えたかどうか
+                "completed": False or True,
+
+                // 続きから再開するための位置 (completed が True の場合は null)
+                "next_cursor": "..."
             }
     """
     logger.info(f"API Called.")
 
-    with common.create_session() as session:
-        count = 0
-        target_date = dt.combine(dt.now(), datetime.time()) - datetime.timedelta(days=THRESHOLD_DAYS-1)
+    try:
+        cursor = parse_cursor(request.args.get("cursor"))
+    except ValueError as e:
+        response = {
+            "success": False,
+            "message": f"再開位置の指定が不正です: {e}",
+        }
+        logger.info(f"API Exit: {response}")
+        return response
 
-        temporary_products = session \
-            .query(TemporaryProduct) \
-            .filter(TemporaryProduct.created_time < target_date) \
-            .all()
-        count += len(temporary_products)
-        for temporary_product in temporary_products:
-            session.delete(temporary_product)
-
-        # 本登録データは商品イメージ画像ファイルと合わせて削除
-        products = session \
-            .query(Product) \
-            .filter(Product.expiration_date < target_date) \
-            .all()
-        count += len(products)
-        for product in products:
-            logger.debug(f"Deleting: {os.path.basename(product.image_path)}")
-            os.remove(product.image_path)
-            session.delete(product)
+    target_date = dt.combine(dt.now(), datetime.time()) - datetime.timedelta(days=THRESHOLD_DAYS-1)
+    deadline = time.monotonic() + MAX_SECONDS
+    count = 0
+    next_cursor = None
 
-        # トランザクション確定
-        session.commit()
+    for table_index, (_, model, column) in enumerate(TARGETS):
+        if cursor is not None and table_index < cursor[0]:
+            continue
+        position = cursor[1:] if cursor is not None and table_index == cursor[0] and cursor[1] is not None else None
+
+        while True:
+            if MAX_ROWS <= count or deadline <= time.monotonic():
+                next_cursor = (table_index,) + (position if position is not None else (None, None))
+                break
+            limit = min(CHUNK_SIZE, MAX_ROWS - count)
+            deleted, position = delete_chunk(model, column, target_date, position, limit)
+            count += deleted
+            if deleted < limit:
+                # このテーブルの対象レコードはすべて削除し終えた
+                break
+        if next_cursor is not None:
+            break
 
     response = {
         "success": True,
         "count": count,
+        "completed": next_cursor is None,
+        "next_cursor": format_cursor(next_cursor),
     }
     logger.info(f"API Exit: {response}")
     return response
+
+
+def delete_chunk(model, column, target_date: dt, position: Optional[Tuple[dt, int]], limit: int) -> Tuple[int, Optional[Tuple[dt, int]]]:
+    """日時の列とIDの順で、再開位置より後ろにある対象レコードを最大 limit 件まとめて削除します。
+    削除したレコードに商品イメージ画像ファイルがある場合は、トランザクションを確定した後にバックグラウンドで削除します。
+
+    Arguments:
+        model -- 削除対象のモデル
+        column -- 削除条件とする日時の列
+        target_date {dt} -- この日時より古いレコードを削除する
+        position {Optional[Tuple[dt, int]]} -- 再開位置 (日時, ID)、先頭から削除する場合は None
+        limit {int} -- 削除するレコードの最大数
+
+    Returns:
+        Tuple[int, Optional[Tuple[dt, int]]] -- (削除した件数, 最後に削除したレコードの位置)
+    """
+    with common.create_session() as session:
+        # 日時の列のインデックスの順に読み出し、続きを (日時, ID) の組で指定する
+        query = session \
+            .query(model) \
+            .filter(column < target_date)
+        if position is not None:
+            query = query.filter(tuple_(column, model.id) > tuple_(literal(position[0], column.type), literal(position[1], model.id.type)))
+        entities = [model.id, column] + ([model.image_path] if model is Product else [])
+        rows = query \
+            .with_entities(*entities) \
+            .order_by(column, model.id) \
+            .limit(limit) \
+            .all()
+        if len(rows) == 0:
+            return 0, position
+
+        session \
+            .query(model) \
+            .filter(model.id.in_([row[0] for row in rows])) \
+            .delete(synchronize_session=False)
+
+        # トランザクション確定
+        session.commit()
+
+    # 本登録データは参照されなくなった商品イメージ画像ファイルとその縮小版も削除
+    if model is Product:
+        background.submit(image_store.release, [row[2] for row in rows])
+
+    logger.debug(f"{model.__tablename__}: {len(rows)} 件削除しました")
+    return len(rows), (rows[-1][1], rows[-1][0])
+
+
+def parse_cursor(cursor: Optional[str]) -> Optional[Tuple[int, Optional[dt], Optional[int]]]:
+    """再開位置を表す文字列を解釈します。
+
+    Arguments:
+        cursor {Optional[str]} -- 再開位置を表す文字列 (テーブル名,日時,ID)
+
+    Raises:
+        ValueError: 解釈できない文字列が指定された場合
+
+    Returns:
+        Optional[Tuple[int, Optional[dt], Optional[int]]] -- (対象テーブルの順番, 日時, ID)、指定がない場合は None
+    """
+    if cursor is None or cursor == "":
+        return None
+
+    parts = cursor.split(CURSOR_SEPARATOR)
+    table_names = [target[0] for target in TARGETS]
+    if len(parts) not in (1, 3) or parts[0] not in table_names:
+        raise ValueError(cursor)
+    if len(parts) == 1:
+        return table_names.index(parts[0]), None, None
+    return table_names.index(parts[0]), dt.fromisoformat(parts[1]), int(parts[2])
+
+
+def format_cursor(cursor: Optional[Tuple[int, Optional[dt], Optional[int]]]) -> Optional[str]:
+    """再開位置を文字列に変換します。
+
+    Arguments:
+        cursor {Optional[Tuple[int, Optional[dt], Optional[int]]]} -- (対象テーブルの順番, 日時, ID)
+
+    Returns:
+        Optional[str] -- 再開位置を表す文字列
+    """
+    if cursor is None:
+        return None
+    if cursor[1] is None:
+        return TARGETS[cursor[0]][0]
+    return CURSOR_SEPARATOR.join([TARGETS[cursor[0]][0], cursor[1].isoformat(), str(cursor[2])])
@@ -7,7 +7,6 @@ import requests
 import traceback
 import re
 import json
-from requests.exceptions import HTTPError
 from datetime import datetime as dt
 from typing import Any, Dict, List
 from configparser import ConfigParser
@@ -16,6 +15,8 @@ from sqlalchemy.orm.exc import NoResultFound
 # 独自モジュール読み込み
 import app.log as log
 import app.common as common
+import app.outbox as outbox
+import app.image_store as image_store
 from model.products import Product
 logger = log.get_logger("command")
 
@@ -24,15 +25,9 @@ config = ConfigParser()
 config.read("settings.conf", encoding="utf-8")
 
 ##### 設定読み込み ####################
-# Slack API トークン
-SLACK_TOKEN = config.get("slack", "token")
 # Slack 買い物リストチャンネル
 SLACK_SHOPPINGLIST_CHANNEL = config.get("command", "shoppinglist_channel")
 
-##### 定数定義 ####################
-# ファイルアップロードを行うための Slack API エンドポイント
-SLACK_FILE_UPLOAD_URL = "https://slack.com/api/files.upload"
-
 
 def execute(request) -> Dict[str, Any]:
     """本登録済みの商品に対して任意のアクションを行います。
@@ -102,16 +97,10 @@ def execute(request) -> Dict[str, Any]:
             # 特に何もしない
             pass
         elif action == "shoppinglist":
-            # 買い物リストチャンネルに投稿して以後通知の対象としない
-            try:
-                _add_shopping_list(product.image_path)
-            except HTTPError as e:
-                response = f"買い物リストチャンネルへの投稿に失敗しました"
-                logger.exception(response, e)
-                logger.info(f"API Exit: {response}")
-                return response
-
+            # 買い物リストチャンネルへの投稿を予約して以後通知の対象としない
+            # 投稿はこのトランザクションの確定後に送信待ち行列から行い、失敗しても再送する
             product.added_shopping_list = 1
+            _add_shopping_list(session, product)
         else:
             response = f"無効な操作名が指定されました: {action}"
             logger.info(f"API Exit: {response}")
@@ -120,7 +109,11 @@ def execute(request) -> Dict[str, Any]:
         session.commit()
 
     # コマンドの元となったメッセージのうち今回処理したデータを抜いて返す
-    del original_message["attachments"][attachment_index]
+    # 日数ごとの見出しを持つ添付を抜く場合は、同じ見出しの次の添付に見出しを引き継ぐ
+    attachments = original_message["attachments"]
+    removed_attachment = attachments.pop(attachment_index)
+    if "pretext" in removed_attachment and attachment_index < len(attachments) and "pretext" not in attachments[attachment_index]:
+        attachments[attachment_index]["pretext"] = removed_attachment["pretext"]
     if len(original_message["attachments"]) > 0:
         # まだ他のリマインドが残っていたら元のメッセージを置き換える
         response = {
@@ -138,30 +131,17 @@ def execute(request) -> Dict[str, Any]:
     return response
 
 
-def _add_shopping_list(product_image_path: str):
-    """Slackの買い物リストチャンネルに追記します。
+def _add_shopping_list(session, product: Product):
+    """Slackの買い物リストチャンネルへの追記を、送信待ち行列に追加します。
+    同じ商品に対する追記がまだ送信されていなければ、1件にまとめます。
 
     Arguments:
-        product_image_path {str} -- 追記する商品イメージ画像のパス
-
-    Raises:
-        HTTPError - Slack API の呼出に失敗
+        session -- DB接続セッション
+        product {Product} -- 追記する商品
     """
-    # POST リクエストパラメーターを生成
-    target_files = {"file": open(product_image_path, "rb")}
     parameters = {
-        "token": SLACK_TOKEN,
+        "image_path": product.image_path,
         "channels": SLACK_SHOPPINGLIST_CHANNEL,
-        "filename": os.path.basename(product_image_path)
+        "filename": image_store.get_name(product.image_path),
     }
-
-    # Slack API に POST する
-    response = requests.post(
-        url=SLACK_FILE_UPLOAD_URL,
-        params=parameters,
-        files=target_files
-    )
-    logger.debug(f"Slack API Response: {response.status_code}\n{response.text}")
-
-    # ステータスコードが 200 以外であれば例外を投げる
-    response.raise_for_status()
+    outbox.enqueue(session, outbox.DESTINATION_SLACK_FILE_UPLOAD, parameters, f"shoppinglist:{product.id}")
@@ -0,0 +1,47 @@
+##############################################################################
+#    /listup で生成した商品の一覧画像をバイナリーデータとして返すAPI
+##############################################################################
+import os
+import re
+from flask import Response
+
+# 独自モジュール読み込み
+import app.log as log
+import app.contact_sheets as contact_sheets
+import app.api.image as image
+logger = log.get_logger("contact_sheet")
+
+
+def execute(file_name: str, request) -> Response:
+    """指定したファイル名に合致する一覧画像のバイナリーを返します。
+    一覧画像のファイル名は並べた商品から求めたキーであり、内容が変わらないため長期間キャッシュさせます。
+
+    Arguments:
+        file_name {str} -- ファイル名
+        request -- GET リクエスト
+
+    Returns:
+        Response -- 画像データ
+            存在しないファイル名が指定された場合はステータスコード 404 として無効なレスポンスを返す
+            ファイル名の中にディレクトリーをまたぐような記述が見られた場合はステータスコード 400 として無効なレスポンスを返す
+            キャッシュが有効な場合はステータスコード 304 として本文のないレスポンスを返す
+    """
+    logger.info(f"API Called.")
+
+    # ディレクトリートラバーサル判定
+    if re.match(r"\.\.|\\|\/", file_name) is not None:
+        return Response(
+            response="Includes Forbidden Characters",
+            status=400
+        )
+
+    # ファイル存在チェック
+    sheet_path = contact_sheets.get_path(file_name)
+    if not os.path.isfile(sheet_path):
+        return Response(
+            response="Not Found",
+            status=404
+        )
+
+    # ファイルを読み取って返す
+    return image.send_image(sheet_path, request, True)
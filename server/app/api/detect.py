@@ -3,19 +3,23 @@
 ##############################################################################
 import cv2
 import numpy as np
-import requests
 import json
 import re
-import uuid
 import datetime
 from datetime import datetime as dt
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
 from configparser import ConfigParser
 
 # 独自モジュール読み込み
 import app.log as log
 import app.common as common
-from model.temporary_products import TemporaryProduct
+import app.jobs as jobs
+import app.ocr as ocr
+import app.ocr_cache as ocr_cache
+import app.ocr.preprocess as preprocess
+import app.ocr.quality as quality
+from app.date_extractor import DateExtractor
+import app.temporary_sessions as temporary_sessions
 logger = log.get_logger("detect")
 
 # 設定ファイル読み込み
@@ -29,21 +33,43 @@ DATE_FORMAT_PATTERNS = json.loads(config.get("detect", "date_format_patterns"))
 OLD_LIMIT_DAYS = int(config.get("detect", "old_limit_days"))
 # 現在の日付よりも新しい期限を許可する日数差分
 NEW_LIMIT_DAYS = int(config.get("detect", "new_limit_days"))
-# OCRに使用するAPIキー
-API_KEY = config.get("detect", "api_key")
+# 非同期ジョブを実行するワーカースレッド数
+ASYNC_WORKERS = config.getint("detect", "async_workers", fallback=4)
+# 実行中と待機中を合わせた非同期ジョブ数の上限
+ASYNC_MAX_QUEUE = config.getint("detect", "async_max_queue", fallback=32)
+# 非同期ジョブの結果を保持する秒数
+ASYNC_JOB_TTL_SECONDS = config.getint("detect", "async_job_ttl_seconds", fallback=300)
+# 非同期ジョブの状態の保存先 (全プロセスで共有するSQLiteファイル)
+ASYNC_JOB_STORE_PATH = config.get("detect", "async_job_store_path", fallback="db/jobs.db")
 
 ##### 定数定義 ####################
-# 賞味期限フォーマットに従って分解したときの格納順序と格納先のキー名を表したリスト
-EXPIRATION_DATE_KEYS = ["year" , "month", "day"]
-# OCRに使用するAPIのURL
-OCR_API_URL = f"https://vision.googleapis.com/v1/images:annotate?key={API_KEY}"
+# 失敗した原因を表すコード (フレーム品質判定による棄却は quality.REASON_* のいずれか)
+REASON_INVALID_IMAGE = "invalid_image"
+REASON_QUEUE_FULL = "queue_full"
+REASON_OCR_EMPTY = "ocr_empty"
+REASON_NO_DATE = "no_date"
+
+# 賞味期限フォーマットをまとめてコンパイルした抽出器
+DATE_EXTRACTOR = DateExtractor(DATE_FORMAT_PATTERNS, OLD_LIMIT_DAYS, NEW_LIMIT_DAYS)
+
+# 非同期ジョブの待ち行列
+JOBS = jobs.JobQueue("detect", ASYNC_JOB_STORE_PATH, ASYNC_WORKERS, ASYNC_MAX_QUEUE, ASYNC_JOB_TTL_SECONDS)
 
 
 def execute(request) -> Dict[str, Any]:
-    """JPEG形式の画像を整数の配列で表したデータをもとに賞味期限を抽出し、仮登録テーブルに保存します。
+    """JPEG形式の画像をもとに賞味期限を抽出し、仮登録テーブルに保存します。
+
+    クエリー文字列に async=1 を指定した場合は解析をジョブとして受け付けてすぐに応答し、
+    結果は GET /detect/<job_id> で取得します。
 
     Arguments:
         request -- POST リクエスト
+            request.args.get("async"): {str} 1 の場合は非同期ジョブとして受け付ける
+            Content-Type: image/jpeg または application/octet-stream の場合
+                リクエストボディにJPEG画像のバイナリーをそのまま格納
+            Content-Type: multipart/form-data の場合
+                image フィールドにJPEG画像を添付
+            Content-Type: application/json の場合 (従来形式)
             {
                 // JPEG圧縮した画像を uint8 配列で並べたデータ
                 "image": [uint8, uint8, ...]
@@ -62,16 +88,115 @@ def execute(request) -> Dict[str, Any]:
                 "session_id": "xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx",
 
                 // 解析に失敗した原因を表すメッセージ
-                "message": "..."
+                "message": "...",
+
+                // 解析に失敗した原因を表すコード (端末での表示用)
+                // invalid_image, queue_full, too_dark, too_bright, no_text, blurry, ocr_empty, no_date
+                "reason": "..."
+            }
+            非同期ジョブとして受け付けた場合
+            {
+                // ジョブID
+                "job_id": "xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx",
+
+                // ジョブの状態 (pending)
+                "status": "pending"
             }
     """
     logger.info(f"API Called.")
 
     # リクエストパラメーター取り出し
-    image = common.convert_request_image_to_ndarray(request.json["image"])
+    # 画素データが必要になるまでデコードせずにJPEGのバイト列のまま扱う
+    try:
+        image = common.JpegImage(common.read_request_image(request))
+    except ValueError as e:
+        response = {
+            "success": False,
+            "expiration_date": None,
+            "session_id": None,
+            "message": f"JPEG画像として読み取れませんでした: {e}",
+            "reason": REASON_INVALID_IMAGE,
+        }
+        logger.info(f"API Exit: {response}")
+        return response
+    logger.debug(f"リクエスト画像サイズ: {image.width}x{image.height}")
 
     # [デバッグ用] リクエスト画像をファイルに書き出し
-    # cv2.imwrite("./target.jpg", image)
+    # image.save("./target.jpg")
+
+    if request.args.get("async") == "1":
+        # ワーカースレッドで解析し、結果は別のリクエストで取得させる
+        try:
+            job_id = JOBS.submit(_detect_and_save, image)
+        except jobs.QueueFullError as e:
+            response = {
+                "success": False,
+                "expiration_date": None,
+                "session_id": None,
+                "message": str(e),
+                "reason": REASON_QUEUE_FULL,
+            }
+            logger.info(f"API Exit: {response}")
+            return response
+
+        response = {
+            "job_id": job_id,
+            "status": jobs.STATUS_PENDING,
+        }
+        logger.info(f"API Exit: {response}")
+        return response
+
+    response = _detect_and_save(image)
+    logger.info(f"API Exit: {response}")
+    return response
+
+
+def _detect_and_save(image: common.JpegImage) -> Dict[str, Any]:
+    """画像から賞味期限を抽出し、成功した場合は仮登録テーブルに保存します。
+
+    Arguments:
+        image {common.JpegImage} -- 解析対象の画像
+
+    Returns:
+        Dict[str, Any] -- 処理結果 (execute と同じ形式)
+    """
+    # 画像から賞味期限を解析
+    expiration_date, message, reason = detect_expiration_date(image)
+    is_success = expiration_date is not None
+    session_id = None
+
+    if is_success:
+        # 仮登録セッションとして賞味期限を保存し、セッションIDを発行
+        session_id = temporary_sessions.get_store().create(to_datetime(expiration_date))
+
+    return {
+        "success": is_success,
+        "expiration_date": expiration_date,
+        "session_id": session_id,
+        "message": message,
+        "reason": reason,
+    }
+
+
+def detect_expiration_date(image: common.JpegImage) -> Tuple[Optional[Dict[str, int]], Optional[str], Optional[str]]:
+    """画像をOCRにかけて賞味期限に相当する年月日を抽出します。
+    フレーム品質判定が有効な場合、読み取れる見込みがないとされた画像はOCRにかけずに失敗とします。
+
+    Arguments:
+        image {common.JpegImage} -- 解析対象の画像
+
+    Returns:
+        Tuple[Optional[Dict[str, int]], Optional[str], Optional[str]] -- (賞味期限の年月日, 失敗した原因を表すメッセージ, 失敗した原因を表すコード)
+            抽出に成功した場合はメッセージとコードが None、失敗した場合は年月日が None となる
+    """
+    # ブレ・露出・テキストらしさを判定し、見込みのないフレームでは OCR API を呼ばない
+    # ヘッダーだけが正しく本体が壊れた画像は、ここで初めてデコードに失敗する
+    try:
+        reason = quality.check(image)
+    except ValueError as e:
+        return None, f"JPEG画像として読み取れませんでした: {e}", REASON_INVALID_IMAGE
+    if reason is not None:
+        return None, quality.MESSAGES[reason], reason
 
     # 画像からテキストを解析
     response_json = _call_ocr(image)
@@ -84,84 +209,44 @@ def execute(request) -> Dict[str, Any]:
     found_text = _extract_text_from_ocr_result(response_json)
     logger.debug(f"OCRから得られたテキスト: [{found_text}]")
     if found_text == "":
-        response = {
-            "success": False,
-            "expiration_date": None,
-            "session_id": None,
-            "message": f"画像内にテキストが含まれていませんでした",
-        }
-        logger.info(f"API Exit: {response}")
-        return response
+        return None, "画像内にテキストが含まれていませんでした", REASON_OCR_EMPTY
 
     # 得られた文字列から賞味期限に相当する箇所を解析
     expiration_date = _find_expiration_date(found_text)
-    is_success = expiration_date is not None
-    session_id = None
-    message = None
+    if expiration_date is None:
+        return None, "OCRによって得られたテキストから賞味期限を抽出できませんでした", REASON_NO_DATE
 
-    if is_success:
-        # 仮登録テーブルにセッションIDと賞味期限のペアを格納
-        session_id = str(uuid.uuid4()).replace("-", "")
-
-        with common.create_session() as session:
-            session.add(TemporaryProduct(
-                session_id=session_id,
-                expiration_date=dt.strptime(f"{expiration_date['year']}-{expiration_date['month']:02}-{expiration_date['day']:02}", "%Y-%m-%d"),
-                created_time=dt.now()
-            ))
-            session.commit()
-        message = "賞味期限の取り出しに成功しました"
-    else:
-        message = "OCRによって得られたテキストから賞味期限を抽出できませんでした"
-
-    response = {
-        "success": is_success,
-        "expiration_date": expiration_date,
-        "session_id": session_id,
-        "message": None if is_success else message,
-    }
-    logger.info(f"API Exit: {response}")
-    return response
+    return expiration_date, None, None
 
 
-def _call_ocr(image: np.ndarray) -> Dict[str, Any]:
-    """OCRエンジン (Google Cloud Vision API) に投げて結果を辞書にして返します。
+def to_datetime(expiration_date: Dict[str, int]) -> dt:
+    """年月日を表す辞書を日時型に変換します。
 
     Arguments:
-        image {np.ndarray} -- 解析対象の画像
+        expiration_date {Dict[str, int]} -- {"year": yyyy, "month": mm, "day": dd}
 
     Returns:
-        Dict[str, Any] -- Google Cloud Vision API の読み取り結果
+        dt -- 賞味期限の日時
     """
-    image_base64 = common.image_to_base64(image)
-
-    response = requests.post(
-        OCR_API_URL,
-        data=json.dumps({
-            "requests": [
-                {
-                    "image": {
-                        "content": image_base64
-                    },
-                    "features": [
-                        {
-                            "type": "TEXT_DETECTION"
-                        }
-                    ],
-                    "imageContext": {
-                        "languageHints": ["en"]
-                    }
-                }
-            ]
-        })
-    )
+    return dt(expiration_date["year"], expiration_date["month"], expiration_date["day"])
 
-    response_json = response.json()
 
-    response_str = json.dumps(response_json, ensure_ascii=False, indent=4)
-    logger.debug(f"Vision API のレスポンス: {response_str}")
+def _call_ocr(image: common.JpegImage) -> Dict[str, Any]:
+    """設定ファイルで指定された前処理を適用した上で、選択されたOCRエンジンに投げて結果を辞書にして返します。
+    同じ内容の画像を直前に解析していた場合は、前処理もOCRエンジンの呼出も行わずにキャッシュした結果を返します。
 
-    return response_json
+    Arguments:
+        image {common.JpegImage} -- 解析対象の画像
+
+    Returns:
+        Dict[str, Any] -- Google Cloud Vision API 形式の読み取り結果
+    """
+    backend = ocr.get_backend()
+    return ocr_cache.get_or_call(
+        image.data,
+        lambda: backend.recognize(preprocess.apply(image)),
+        namespace=f"{backend.name}:{preprocess.SIGNATURE}"
+    )
 
 
 def _extract_text_from_ocr_result(response_json: Dict[str, Any]) -> str:
@@ -182,86 +267,13 @@ def _extract_text_from_ocr_result(response_json: Dict[str, Any]) -> str:
         .replace("\n", " ")
 
 
-def _find_expiration_date(found_text: str) -> Dict[str, int]:
+def _find_expiration_date(found_text: str) -> Optional[Dict[str, int]]:
     """与えられたテキストから賞味期限に相当する年月日を抽出します。
 
     Arguments:
         found_text {str} -- 抽出対象のテキスト
 
     Returns:
-        Dict[str, int] -- {"year": yyyy, "month": mm, "day": dd}
+        Optional[Dict[str, int]] -- {"year": yyyy, "month": mm, "day": dd}、抽出できなかった場合は None
     """
-    expiration_date = None
-
-    for date_format_pattern in DATE_FORMAT_PATTERNS:
-        # 正規表現で表されるパターンで抜き出す
-        logger.debug(f"正規表現パターン: {date_format_pattern}")
-        result = re.match(date_format_pattern, found_text)
-        if not result:
-            logger.debug(f"現在の判定パターンでは賞味期限を抽出できませんでした: {date_format_pattern}")
-            continue
-
-        # 年月日に分解し、日が省略されている場合は None として埋める
-        date_parts = list(result.groups())
-        try:
-            expiration_date = {
-                key: int(date_parts[index]) if index < len(date_parts) else None
-                for index, key in enumerate(EXPIRATION_DATE_KEYS)
-            }
-        except ValueError:
-            logger.debug(f"年月日のいずれかに整数ではない文字が含まれているため無効とみなします: {date_parts}")
-            expiration_date = None
-            continue
-
-        if expiration_date["year"] < 100:
-            # 年を4桁表記に直す
-            upper = int(dt.now().year / 100)
-            lower = dt.now().year % 100
-            if expiration_date["year"] < lower:
-                # Y2K問題対策: 年の下二桁が現在よりも小さいときは上二桁に繰り上がりが起きている
-                upper += 1
-            expiration_date["year"] = int(f"{upper:02}{expiration_date['year']:02}")
-            logger.debug(f"年を4桁表記に補完: {expiration_date['year']}")
-
-        # 存在する年月日かどうか検証
-        try:
-            if expiration_date["day"] is None:
-                logger.debug(f"抽出した年月: {expiration_date}")
-                date = dt.strptime(f"{expiration_date['year']}-{expiration_date['month']:02}", "%Y-%m")
-
-                # 翌月の初日から差し引いて月末の日にちを割り出す
-                temp_year = expiration_date["year"]
-                temp_month = expiration_date["month"] + 1
-                if temp_month > 12:
-                    temp_year += 1
-                    temp_month %= 12
-                next_month_date = dt.strptime(f"{temp_year}-{temp_month:02}", "%Y-%m")
-                expiration_date["day"] = (next_month_date - date).days
-                logger.debug(f"省略表記されていた日を月末の日付で補完します: {expiration_date}")
-            else:
-                logger.debug(f"抽出した年月日: {expiration_date}")
-                date = dt.strptime(f"{expiration_date['year']}-{expiration_date['month']:02}-{expiration_date['day']:02}", "%Y-%m-%d")
-        except ValueError:
-            # 無効な日付を読み取ってしまった場合はやり直し
-            logger.debug(f"存在しない日付を抽出したため無効とみなします: {expiration_date}")
-            expiration_date = None
-            continue
-
-        # 現在の日付を起点に見て古すぎないか検証
-        now = dt.now()
-        if date < now and (now - date).days > OLD_LIMIT_DAYS:
-            logger.debug(f"抽出した日付が設定下限値よりも古いため無効とみなします: {expiration_date}")
-            expiration_date = None
-            continue
-
-        # 現在の日付を起点に見て未来すぎないか検証
-        if now <= date and (date - now).days > NEW_LIMIT_DAYS:
-            logger.debug(f"抽出した日付が設定上限値よりも未来の日付であるため無効とみなします: {expiration_date}")
-            expiration_date = None
-            continue
-
-        logger.debug(f"賞味期限の抽出に成功しました: {expiration_date}")
-        return expiration_date
-
-    logger.debug(f"賞味期限を抽出できませんでした")
-    return None
+    return DATE_EXTRACTOR.extract(found_text)
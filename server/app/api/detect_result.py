@@ -0,0 +1,91 @@
+##############################################################################
+#    非同期ジョブとして受け付けた賞味期限の読み取り結果を返すAPI
+##############################################################################
+import math
+from typing import Any, Dict, List
+from configparser import ConfigParser
+
+# 独自モジュール読み込み
+import app.log as log
+import app.jobs as jobs
+from app.api.detect import JOBS
+logger = log.get_logger("detect_result")
+
+# 設定ファイル読み込み
+config = ConfigParser()
+config.read("settings.conf", encoding="utf-8")
+
+##### 設定読み込み ####################
+# ロングポーリングで完了を待つ最大秒数
+MAX_WAIT_SECONDS = config.getfloat("detect", "async_max_wait_seconds", fallback=25.0)
+
+
+def execute(request, job_id: str) -> Dict[str, Any]:
+    """非同期ジョブの状態を返します。完了している場合は POST /detect と同じ形式の処理結果を返します。
+
+    Arguments:
+        request -- GET リクエスト
+            request.args.get("wait"): {float} ジョブが完了するまで待つ最大秒数 (省略時は待たずに応答、async_max_wait_seconds までに切り詰める)
+        job_id {str} -- POST /detect?async=1 で受け付けたジョブID
+
+    Returns:
+        Dict[str, Any] -- 処理結果
+            {
+                // ジョブID
+                "job_id": "xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx",
+
+                // ジョブの状態 (pending: 処理中, done: 完了, failed: 失敗, not_found: 存在しないか有効期限切れ, bad_request: wait の指定が不正)
+                "status": "...",
+
+                // 以下は完了した場合のみ、POST /detect と同じ内容
+                "success": False or True,
+                "expiration_date": { "year": yyyy, "month": mm, "day": dd },
+                "session_id": "xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx",
+                "message": "..."
+            }
+    """
+    logger.info(f"API Called.")
+
+    # クエリー文字列取り出し
+    try:
+        wait_seconds = float(request.args.get("wait", 0))
+        if not math.isfinite(wait_seconds):
+            raise ValueError(f"有限の値ではありません: {wait_seconds}")
+    except ValueError as e:
+        response = {
+            "job_id": job_id,
+            "status": "bad_request",
+            "success": False,
+            "message": f"待ち時間の指定が不正です: {e}",
+        }
+        logger.info(f"API Exit: {response}")
+        return response
+    wait_seconds = max(0.0, min(wait_seconds, MAX_WAIT_SECONDS))
+
+    job = JOBS.get(job_id, wait_seconds)
+    if job is None:
+        response = {
+            "job_id": job_id,
+            "status": "not_found",
+            "success": False,
+            "message": f"指定されたジョブIDに該当するジョブが存在しないか、有効期限が切れています: {job_id}",
+        }
+    elif job["status"] == jobs.STATUS_DONE:
+        response = dict(job_id=job_id, status=job["status"], **job["result"])
+    elif job["status"] == jobs.STATUS_FAILED:
+        response = {
+            "job_id": job_id,
+            "status": job["status"],
+            "success": False,
+            "expiration_date": None,
+            "session_id": None,
+            "message": f"賞味期限の読み取り中にエラーが発生しました: {job['message']}",
+        }
+    else:
+        response = {
+            "job_id": job_id,
+            "status": job["status"],
+        }
+
+    logger.info(f"API Exit: {response}")
+    return response
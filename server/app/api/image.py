@@ -7,15 +7,19 @@ import requests
 import traceback
 import re
 import json
+from stat import S_ISREG
 from requests.exceptions import HTTPError
 from datetime import datetime as dt
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 from configparser import ConfigParser
 from sqlalchemy.orm.exc import NoResultFound
-from flask import Response, send_from_directory
+from flask import Response
+from werkzeug.wsgi import wrap_file
 
 # 独自モジュール読み込み
 import app.log as log
+import app.thumbnails as thumbnails
+import app.image_store as image_store
 from model.products import Product
 logger = log.get_logger("image")
 
@@ -24,20 +28,40 @@ config = ConfigParser()
 config.read("settings.conf", encoding="utf-8")
 
 ##### 設定読み込み ####################
-# 画像保管先を表すディレクトリーパス
-DESTINATION_DIRECTORY_PATH = config.get("register", "destination_directory_path")
+# バージョンを指定しないURLに対して、再検証せずにキャッシュを使ってよい秒数
+CACHE_MAX_AGE = config.getint("image", "cache_max_age", fallback=3600)
+# バージョンを指定したURLに対して、キャッシュを使ってよい秒数 (内容が変わらないため変更しないものとして扱わせる)
+IMMUTABLE_MAX_AGE = config.getint("image", "immutable_max_age", fallback=31536000)
+# 画像の送信を Apache (mod_xsendfile) に任せるかどうか
+X_SENDFILE_ENABLED = config.getboolean("image", "x_sendfile_enabled", fallback=False)
 
+##### 定数定義 ####################
+# ファイル名の拡張子ごとの Content-Type
+MIMETYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".webp": "image/webp",
+}
 
-def execute(file_name: str) -> Response:
+
+def execute(file_name: str, request) -> Response:
     """指定したファイル名に合致する本登録済み商品イメージ画像のバイナリーを返します。
+    size を指定した場合は長辺がそのピクセル数の縮小版を返し、まだ生成されていなければその場で生成します。
+    ETag / Last-Modified による条件付きリクエストと Range リクエストに対応し、
+    v に get_version() の値を指定したURLは変更されないものとして長期間キャッシュさせます。
 
     Arguments:
         file_name {str} -- ファイル名
+        request -- GET リクエスト
+            request.args.get("size"): {int} 縮小版の長辺のピクセル数 (省略時は元の画像)
+            request.args.get("format"): {str} 縮小版の形式 (jpeg / webp、省略時は jpeg)
+            request.args.get("v"): {str} 元の画像のバージョン (省略可)
 
     Returns:
         Response -- 画像データ
             存在しないファイル名が指定された場合はステータスコード 404 として無効なレスポンスを返す
             ファイル名の中にディレクトリーをまたぐような記述が見られた場合はステータスコード 400 として無効なレスポンスを返す
+            キャッシュが有効な場合はステータスコード 304 として本文のないレスポンスを返す
     """
     logger.info(f"API Called.")
 
@@ -49,11 +73,85 @@ def execute(file_name: str) -> Response:
         )
 
     # ファイル存在チェック
-    if not os.path.exists(os.path.join(DESTINATION_DIRECTORY_PATH, file_name)):
+    image_path = image_store.get_path(file_name)
+    version = get_version(image_path)
+    if version is None:
         return Response(
             response="Not Found",
             status=404
         )
 
+    # 縮小版が要求された場合は縮小版を返す
+    size = request.args.get("size")
+    if size is not None:
+        try:
+            image_path = thumbnails.get_or_create(image_path, int(size), request.args.get("format", "jpeg"))
+        except ValueError as e:
+            return Response(
+                response=f"Invalid Size: {e}",
+                status=400
+            )
+
     # ファイルを読み取って返す
-    return send_from_directory(DESTINATION_DIRECTORY_PATH, file_name)
+    return send_image(image_path, request, request.args.get("v") == version)
+
+
+def get_version(image_path: str) -> Optional[str]:
+    """元の画像のバージョンを返します。画像を置き換えると値が変わるため、URLに含めてキャッシュを区別できます。
+    縮小版は元の画像から生成されるため、元の画像と同じバージョンを使います。
+
+    Arguments:
+        image_path {str} -- 元の画像のファイルパス
+
+    Returns:
+        Optional[str] -- バージョン、画像が存在しないかディレクトリーなど通常のファイルでない場合は None
+    """
+    try:
+        stat = os.stat(image_path)
+    except FileNotFoundError:
+        return None
+    if not S_ISREG(stat.st_mode):
+        return None
+    return f"{stat.st_mtime_ns:x}{stat.st_size:x}"
+
+
+def send_image(image_path: str, request, immutable: bool) -> Response:
+    """画像ファイルをキャッシュの検証用ヘッダー付きで返します。
+    X-Sendfile が有効な場合はファイルの中身を読まずに、送信を Apache に任せます。
+
+    Arguments:
+        image_path {str} -- 画像ファイルのパス
+        request -- GET リクエスト
+        immutable {bool} -- 内容が変わらないURLとして長期間キャッシュさせるかどうか
+
+    Returns:
+        Response -- 画像データ
+    """
+    stat = os.stat(image_path)
+    mimetype = MIMETYPES.get(os.path.splitext(image_path)[1].lower(), "application/octet-stream")
+
+    if X_SENDFILE_ENABLED:
+        # 本文と Range リクエストの処理は Apache が行う
+        response = Response(mimetype=mimetype)
+        response.headers["X-Sendfile"] = os.path.abspath(image_path)
+    else:
+        response = Response(wrap_file(request.environ, open(image_path, "rb")), mimetype=mimetype, direct_passthrough=True)
+        response.content_length = stat.st_size
+        response.headers["Accept-Ranges"] = "bytes"
+
+    # 画像は書き出した後に変更されないため、更新日時とサイズから検証用のタグを作る
+    response.set_etag(f"{stat.st_mtime_ns:x}-{stat.st_size:x}")
+    response.last_modified = stat.st_mtime
+    if immutable:
+        response.headers["Cache-Control"] = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    else:
+        response.headers["Cache-Control"] = f"public, max-age={CACHE_MAX_AGE}"
+
+    # If-None-Match / If-Modified-Since に一致すれば 304 を、Range が指定されていれば 206 を返す
+    if not X_SENDFILE_ENABLED:
+        return response.make_conditional(request, accept_ranges=True, complete_length=stat.st_size)
+    response = response.make_conditional(request)
+    if response.status_code == 304:
+        # キャッシュが有効な場合は Apache にも本文を送らせない
+        del response.headers["X-Sendfile"]
+    return response
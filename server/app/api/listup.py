@@ -6,15 +6,21 @@ import datetime
 import requests
 import traceback
 import json
-import subprocess
 from requests.exceptions import HTTPError
 from datetime import datetime as dt
 from typing import Any, Dict, List
 from configparser import ConfigParser
+from sqlalchemy import literal_column
 
 # 独自モジュール読み込み
 import app.log as log
 import app.common as common
+import app.thumbnails as thumbnails
+import app.image_store as image_store
+import app.contact_sheets as contact_sheets
+import app.background as background
+import app.api.listup_async as listup_async
+import app.api.image as image
 from model.products import Product
 logger = log.get_logger("listup")
 
@@ -25,20 +31,30 @@ config.read("settings.conf", encoding="utf-8")
 ##### 設定読み込み ####################
 # このサーバーの外から見たときのURLのベース
 URL_NAME_BASE = config.get("slack", "url_name_base")
+# メッセージに添付する商品イメージ画像に必要な長辺のピクセル数
+SLACK_IMAGE_SIZE = config.getint("slack", "image_size", fallback=360)
+# コマンドに引数がない場合に、商品ごとではなく1枚の一覧画像にまとめて通知するかどうか
+CONTACT_SHEET_ENABLED = config.getboolean("listup", "contact_sheet_enabled", fallback=False)
 
 ##### 定数定義 ####################
 # 本登録済みの商品イメージ画像を取得するためのURL
 GET_IMAGE_URL = f"https://{URL_NAME_BASE}/images/"
-# 非同期的にSlackに商品イメージ画像と賞味期限を送信するためのURL
-LISTUP_ASYNC_URL = f"http://localhost/listup/async"
+# 商品の一覧画像を取得するためのURL
+GET_CONTACT_SHEET_URL = f"https://{URL_NAME_BASE}/contact_sheets/"
+# 一覧画像にまとめて通知させるコマンドの引数
+CONTACT_SHEET_ARGUMENT = "sheet"
+# 商品ごとに通知させるコマンドの引数
+ITEMS_ARGUMENT = "list"
 
 
 def execute(request) -> Dict[str, Any]:
     """本登録済みの商品のうち、期限前で未アクションの商品イメージ画像と賞味期限をすべてSlack通知します。
-    Slackコマンドへの応答速度を優先するため、実際の通知は非同期的に行います。
+    Slackコマンドへの応答速度を優先するため、実際の通知はレスポンスを返した後にバックグラウンドで行います。
+    コマンドの引数に sheet を指定すると、商品ごとの画像ではなく賞味期限を添えて格子状に並べた1枚の一覧画像で通知します。
 
     Arguments:
         request -- POST リクエスト
+            text: コマンドの引数 (sheet: 一覧画像で通知, list: 商品ごとに通知, 省略時は設定ファイルに従う)
 
     Returns:
         Dict[str, Any] -- 処理結果
@@ -49,20 +65,28 @@ def execute(request) -> Dict[str, Any]:
     """
     logger.info(f"API Called.")
 
+    # リクエストパラメーター取り出し
+    argument = (request.form.get("text") or "").strip()
+    use_contact_sheet = CONTACT_SHEET_ENABLED if argument not in (CONTACT_SHEET_ARGUMENT, ITEMS_ARGUMENT) else argument == CONTACT_SHEET_ARGUMENT
+
     with common.create_session() as session:
         # 期限前で未アクションの商品をすべて抽出
+        # 未アクションの条件は部分インデックスを使わせるため、バインド変数ではなくリテラルの 0 と比較する
         target_date = dt.combine(dt.now(), datetime.time())
         products = session \
             .query(Product) \
             .filter(Product.expiration_date >= target_date) \
-            .filter(Product.added_shopping_list == 0) \
-            .filter(Product.consumed == 0) \
+            .filter(Product.consumed == literal_column("0")) \
+            .filter(Product.added_shopping_list == literal_column("0")) \
             .order_by(Product.expiration_date) \
             .order_by(Product.created_time) \
             .all()
 
-        # 非同期的にSlackに情報を送信
-        _send_products_async(products)
+        # レスポンスを返した後のバックグラウンド処理でも読み込み済みの属性を参照できるように、セッションから切り離す
+        session.expunge_all()
+
+        # レスポンスを返した後に、バックグラウンドでSlackに情報を送信
+        background.submit_after_response(_send_contact_sheet if use_contact_sheet else _send_products, products)
 
         if len(products) > 0:
             message = f"現在、{len(products)}件の商品が管理されています。"
@@ -77,18 +101,15 @@ def execute(request) -> Dict[str, Any]:
     return response
 
 
-def _send_products_async(products: List[Product]):
-    """非同期的にSlackの通知用リストチャンネルに商品情報を投稿します。
+def _send_products(products: List[Product]):
+    """Slackの通知用リストチャンネルへの商品情報の投稿を、送信待ち行列に追加します。
 
     Arguments:
         products {List[Product]} -- 商品リスト
-
-    Raises:
-        HTTPError - Slack API の呼出に失敗
     """
-    # 公開用画像URLのリストに変換
+    # 公開用画像URLのリストに変換 (Slack での表示に十分な大きさの縮小版を、長期間キャッシュさせるURLで使う)
     image_urls = [
-        f"{GET_IMAGE_URL}{os.path.basename(product.image_path)}"
+        thumbnails.get_url(f"{GET_IMAGE_URL}{image_store.get_name(product.image_path)}", SLACK_IMAGE_SIZE, image.get_version(product.image_path))
         for product in products
     ]
 
@@ -107,11 +128,33 @@ def _send_products_async(products: List[Product]):
             for i, product in enumerate(products)
         ],
     }
-    logger.debug(f"Slack API Request Parameters:\n{json.dumps(parameters, indent=4)}")
+    listup_async.send(parameters)
+
+
+def _send_contact_sheet(products: List[Product]):
+    """Slackの通知用リストチャンネルへの、商品を並べた1枚の一覧画像の投稿を、送信待ち行列に追加します。
+    一覧画像は並べる商品が前回と同じであれば生成し直さず、同じURLを使います。
+
+    Arguments:
+        products {List[Product]} -- 商品リスト
+    """
+    attachments = []
+    if len(products) > 0:
+        shown = products[:contact_sheets.MAX_PRODUCTS]
+        name = contact_sheets.get_or_create(shown)
+        attachments.append({
+            "text": "",
+            "image_url": f"{GET_CONTACT_SHEET_URL}{name}",
+            "fallback": "These foods have not expired yet.",
+            "attachment_type": "default",
+            "pretext": f"期限日が近い順：{len(products)}件 ({dt.strftime(shown[0].expiration_date, '%Y-%m-%d')} ～ {dt.strftime(shown[-1].expiration_date, '%Y-%m-%d')})"
+                + (f" ※先頭の{len(shown)}件のみ表示" if len(shown) < len(products) else ""),
+        })
+
+    # POST リクエストパラメーターを生成
+    parameters = {
+        "text": "",
+        "attachments": attachments,
+    }
+    listup_async.send(parameters)
 
-    # 非同期的にメッセージを送信する
-    command = [
-      "curl", "-X", "POST", "-H", "Content-Type: application/json",
-      "-d", json.dumps(parameters), LISTUP_ASYNC_URL
-    ]
-    subprocess.Popen(command)
@@ -7,28 +7,25 @@ import datetime
 import requests
 import traceback
 import json
-import time
 from requests.exceptions import HTTPError
 from datetime import datetime as dt
 from typing import Any, Dict, List
-from configparser import ConfigParser
 
 # 独自モジュール読み込み
 import app.log as log
+import app.outbox as outbox
 from model.products import Product
 logger = log.get_logger("listup_async")
 
-# 設定ファイル読み込み
-config = ConfigParser()
-config.read("settings.conf", encoding="utf-8")
+##### 定数定義 ####################
+# 送信待ちの一覧をまとめるためのキー (送信前に次の一覧が追加されたら新しい方だけを送る)
+DEDUPE_KEY = "listup"
 
-##### 設定読み込み ####################
-# メッセージを送信するための Slack Incoming Webhook URL
-SLACK_INCOMING_WEBHOOK_URL = config.get("slack", "incoming_webhook_url")
 
-
-def execute(request):
+def execute(request) -> Dict[str, Any]:
     """与えられた商品イメージ画像と賞味期限の情報をすべてSlackへ書き出します。
+    /listup からはこのAPIを経由せず、バックグラウンドで send() を直接呼び出します。
+    実際の送信は送信待ち行列を経由して行い、失敗した場合は間隔を空けて再送します。
 
     Arguments:
         request -- POST リクエスト
@@ -36,27 +33,38 @@ def execute(request):
                 // JSON形式で与えられたパラメーターをそのままSlackに渡します
                 ...
             }
+
+    Returns:
+        Dict[str, Any] -- 処理結果
+            {
+                // 送信待ち行列への追加に成功したかどうか
+                "success": False or True,
+
+                // 送信待ち行列上のメッセージのID
+                "message_id": xxx
+            }
     """
     logger.info(f"API Called.")
 
     # リクエストパラメーター取り出し
-    parameters = json.dumps(request.json)
-    logger.debug(f"Parameters={parameters}")
-
-    # 一定時間待機して呼出元のリクエストが完了するのを待つ
-    logger.debug(f"Waiting for source request...")
-    time.sleep(1.0)
-
-    # Slack API に POST する
-    response = requests.post(
-        url=SLACK_INCOMING_WEBHOOK_URL,
-        data=parameters,
-        headers={"Content-Type": "application/json"}
-    )
-    logger.debug(f"Slack API Response: {response.status_code}\n{response.text}")
-
-    # ステータスコードが 200 以外であれば例外を投げる
-    response.raise_for_status()
-
-    logger.info(f"API Exit: {response.text}")
-    return response.text
+    parameters = request.json
+
+    response = {
+        "success": True,
+        "message_id": send(parameters),
+    }
+    logger.info(f"API Exit: {response}")
+    return response
+
+
+def send(parameters: Dict[str, Any]) -> int:
+    """与えられたパラメーターをそのまま、Slackの通知用リストチャンネルへの送信待ち行列に追加します。
+
+    Arguments:
+        parameters {Dict[str, Any]} -- Slack に渡すパラメーター
+
+    Returns:
+        int -- 送信待ち行列上のメッセージのID
+    """
+    logger.debug(f"Parameters={json.dumps(parameters)}")
+    return outbox.post(outbox.DESTINATION_SLACK_WEBHOOK, parameters, DEDUPE_KEY)
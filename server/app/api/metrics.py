@@ -0,0 +1,101 @@
+##############################################################################
+#    チューニング用の統計情報を返すAPI
+##############################################################################
+from typing import Any, Dict, List
+
+# 独自モジュール読み込み
+import app.log as log
+import app.http_client as http_client
+import app.ocr as ocr
+import app.api.detect as detect
+import app.ocr_cache as ocr_cache
+import app.ocr.preprocess as preprocess
+import app.ocr.quality as quality
+import app.background as background
+import app.outbox as outbox
+import app.temporary_sessions as temporary_sessions
+logger = log.get_logger("metrics")
+
+
+def execute(request) -> Dict[str, Any]:
+    """各機能の統計情報をまとめて返します。
+
+    Arguments:
+        request -- GET リクエスト
+
+    Returns:
+        Dict[str, Any] -- 統計情報
+            {
+                // OCRの読み取り結果のキャッシュ
+                "ocr_cache": {
+                    "hits": xxx,
+                    "misses": xxx,
+                    ...
+                },
+
+                // OCRエンジン固有の統計 (このプロセスでの集計)
+                "ocr_backend": {
+                    "name": "vision",
+                    ...
+                },
+
+                // OCR前の前処理ごとの所要時間 (このプロセスでの集計)
+                "preprocess": {
+                    "stages": [...],
+                    "timings": { "xxx": { "count": xxx, "average_ms": xxx }, ... }
+                },
+
+                // OCR前のフレーム品質判定の判定結果ごとの件数と平均採点結果 (このプロセスでの集計)
+                "quality": {
+                    "enabled": True,
+                    "decisions": { "ok": { "count": xxx, "average_ms": xxx, "sharpness": xxx, ... }, ... }
+                },
+
+                // 賞味期限の読み取りの非同期ジョブ (このプロセスでの集計)
+                "detect_jobs": {
+                    "queue_depth": xxx,
+                    ...
+                },
+
+                // 仮登録セッションの保存先と保持している件数
+                "temporary_sessions": {
+                    "store": "database",
+                    "count": xxx
+                },
+
+                // レスポンス後・コミット後に実行するバックグラウンド処理 (このプロセスでの集計)
+                "background": {
+                    "submitted": xxx,
+                    ...
+                },
+
+                // Slack への送信待ち行列 (件数はすべてのプロセスの合計、送信結果はこのプロセスでの集計)
+                "outbox": {
+                    "pending": xxx,
+                    "sent": xxx,
+                    ...
+                },
+
+                // 外部APIの接続先ホストごとの所要時間 (このプロセスでの集計)
+                "http": {
+                    "vision.googleapis.com": { "count": xxx, "errors": xxx, "average_ms": xxx, "max_ms": xxx },
+                    ...
+                }
+            }
+    """
+    logger.info(f"API Called.")
+
+    response = {
+        "ocr_cache": ocr_cache.get_stats(),
+        "ocr_backend": dict(name=ocr.get_backend().name, **ocr.get_backend().get_stats()),
+        "preprocess": preprocess.get_stats(),
+        "quality": quality.get_stats(),
+        "detect_jobs": detect.JOBS.get_stats(),
+        "temporary_sessions": temporary_sessions.get_stats(),
+        "background": background.get_stats(),
+        "outbox": outbox.get_stats(),
+        "http": http_client.get_stats(),
+    }
+
+    logger.info(f"API Exit: {response}")
+    return response
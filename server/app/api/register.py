@@ -1,7 +1,6 @@
 ##############################################################################
 #    商品イメージと仮登録セッションIDを紐づけて本登録を行うAPI
 ##############################################################################
-import os
 import cv2
 import numpy as np
 import json
@@ -9,12 +8,14 @@ import datetime
 from datetime import datetime as dt
 from typing import Any, Dict, List
 from configparser import ConfigParser
-from sqlalchemy.orm.exc import NoResultFound
 
 # 独自モジュール読み込み
 import app.log as log
 import app.common as common
-from model.temporary_products import TemporaryProduct
+import app.temporary_sessions as temporary_sessions
+import app.background as background
+import app.image_store as image_store
+import app.thumbnails as thumbnails
 from model.products import Product
 logger = log.get_logger("register")
 
@@ -22,16 +23,17 @@ logger = log.get_logger("register")
 config = ConfigParser()
 config.read("settings.conf", encoding="utf-8")
 
-##### 設定読み込み ####################
-# 画像保管先を表すディレクトリーパス
-DESTINATION_DIRECTORY_PATH = config.get("register", "destination_directory_path")
-
 
 def execute(request) -> Dict[str, Any]:
-    """JPEG形式の画像を整数の配列で表したデータとセッションIDを紐づけて本登録を行います。
+    """JPEG形式の画像とセッションIDを紐づけて本登録を行います。
 
     Arguments:
         request -- POST リクエスト
+            Content-Type: image/jpeg または application/octet-stream の場合
+                リクエストボディにJPEG画像のバイナリーをそのまま格納し、クエリー文字列 session_id にセッションIDを指定
+            Content-Type: multipart/form-data の場合
+                image フィールドにJPEG画像を添付し、session_id フィールドにセッションIDを指定
+            Content-Type: application/json の場合 (従来形式)
             {
                 // 仮登録テーブルに紐づけられたセッションID
                 "session_id": "xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx",
@@ -53,44 +55,54 @@ def execute(request) -> Dict[str, Any]:
     logger.info(f"API Called.")
 
     # リクエストパラメーター取り出し
-    session_id = request.json["session_id"]
-    image = common.convert_request_image_to_ndarray(request.json["image"])
+    session_id = common.get_request_value(request, "session_id")
     logger.info(f"仮登録セッションID: [{session_id}]")
-
-    # セッションIDのファイル名でサーバーに商品画像を保管する
-    if not os.path.exists(DESTINATION_DIRECTORY_PATH):
-        os.makedirs(DESTINATION_DIRECTORY_PATH, exist_ok=True)
-    image_path = os.path.join(DESTINATION_DIRECTORY_PATH, f"{session_id}.jpg")
-    cv2.imwrite(image_path, image)
+    try:
+        image = common.JpegImage(common.read_request_image(request))
+        # 本体が壊れた画像を保管しないように、保管する前にデコードできることを確かめる
+        image.pixels
+    except ValueError as e:
+        response = {
+            "success": False,
+            "message": f"JPEG画像として読み取れませんでした: {e}",
+        }
+        logger.info(f"API Exit: {response}")
+        return response
+
+    # 内容のハッシュ値のファイル名でサーバーに商品画像を保管する (同じ内容の画像は共有する)
+    image_path = image_store.save(image)
 
     with common.create_session() as session:
-        # 仮登録テーブルの該当レコードを取得
-        try:
-            target_temporary_product = session \
-                .query(TemporaryProduct) \
-                .filter(TemporaryProduct.session_id == session_id) \
-                .one()
-        except NoResultFound:
-            response = {
-                "success": False,
-                "message": f"指定されたセッションIDから仮登録テーブル上の該当するレコードを特定できませんでした: {session_id}",
-            }
-            logger.info(f"API Exit: {response}")
-            return response
-
-        # 本登録テーブルに追加
-        session.add(Product(
-            image_path=image_path,
-            expiration_date=target_temporary_product.expiration_date,
-            consumed=False,
-            added_shopping_list=False,
-            created_time=dt.now()
-        ))
-
-        # 仮登録テーブルから該当レコードを削除
-        session.delete(target_temporary_product)
-
-        session.commit()
+        # 該当する仮登録セッションを取り出して削除 (仮登録テーブルの場合は本登録と同じトランザクションで削除)
+        expiration_date = temporary_sessions.get_store().pop(session_id, session)
+        if expiration_date is None:
+            session.rollback()
+        else:
+            # 本登録テーブルに追加
+            session.add(Product(
+                image_path=image_path,
+                expiration_date=expiration_date,
+                consumed=False,
+                added_shopping_list=False,
+                created_time=dt.now()
+            ))
+            session.commit()
+
+    if expiration_date is None:
+        # どの商品からも参照されない画像を残さない (参照の確認は独立したトランザクションで行う)
+        image_store.release([image_path])
+        response = {
+            "success": False,
+            "message": f"指定されたセッションIDから仮登録テーブル上の該当するレコードを特定できませんでした: {session_id}",
+        }
+        logger.info(f"API Exit: {response}")
+        return response
+
+    # コミットまでの間に同じ内容の画像が削除されていた場合に備える
+    image_store.ensure(image, image_path)
+
+    # 表示先に合わせた縮小版はレスポンスを待たせないようにバックグラウンドで生成する
+    background.submit(thumbnails.generate, image_path)
 
     response = {
         "success": True,
@@ -98,3 +110,4 @@ def execute(request) -> Dict[str, Any]:
     }
     logger.info(f"API Exit: {response}")
     return response
+
@@ -8,12 +8,17 @@ import traceback
 import json
 from requests.exceptions import HTTPError
 from datetime import datetime as dt
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 from configparser import ConfigParser
+from sqlalchemy import literal_column
 
 # 独自モジュール読み込み
 import app.log as log
 import app.common as common
+import app.thumbnails as thumbnails
+import app.image_store as image_store
+import app.outbox as outbox
+import app.api.image as image
 from model.products import Product
 logger = log.get_logger("remind")
 
@@ -22,24 +27,35 @@ config = ConfigParser()
 config.read("settings.conf", encoding="utf-8")
 
 ##### 設定読み込み ####################
-# メッセージを送信するための Slack Incoming Webhook URL
-SLACK_INCOMING_WEBHOOK_URL = config.get("slack", "incoming_webhook_url")
 # このサーバーの外から見たときのURLのベース
 URL_NAME_BASE = config.get("slack", "url_name_base")
+# メッセージに添付する商品イメージ画像に必要な長辺のピクセル数
+SLACK_IMAGE_SIZE = config.getint("slack", "image_size", fallback=360)
 
 ##### 定数定義 ####################
 # 本登録済みの商品イメージ画像を取得するためのURL
 GET_IMAGE_URL = f"https://{URL_NAME_BASE}/images/"
+# 複数の日数を区切る文字
+DAYS_SEPARATOR = ","
+# 日数の範囲の始点と終点を区切る文字
+DAYS_RANGE_SEPARATOR = ".."
+# 一度に指定できる日数の最大数
+MAX_HORIZONS = 366
+# 指定できる日数の絶対値の上限 (日付の計算が溢れないように約100年とする)
+MAX_ABS_DAYS = 36500
 
 
 def execute(request) -> Dict[str, Any]:
     """呼び出された時点の日付を起点に数えて {days} 日後に賞味期限が切れるものをピックアップしてSlack通知します。
     ただし、呼び出された時点の日付から {days} 日後までの間に期限切れとなるものについては対象外となります。
     たとえば、days=3 のとき 1日後、2日後に期限が切れるものは取得できず、3日後に期限が切れるものだけが抽出されます。
+    days=0,1,3,7 のように複数の日数や、days=0..7 のように範囲を指定すると、
+    対象の商品を1回のクエリーでまとめて抽出し、日数ごとの見出しを付けた1件のメッセージでSlack通知します。
 
     Arguments:
         request -- GET リクエスト
-            request.args.get("days"): {int} ピックアップ対象とする呼出時点の日付を起点とした日数 (+で未来、0で当日、-で過去)
+            request.args.get("days"): {str} ピックアップ対象とする呼出時点の日付を起点とした日数 (+で未来、0で当日、-で過去)
+                                            カンマ区切りで複数指定、from..to で範囲指定が可能
 
     Returns:
         Dict[str, Any] -- 処理結果
@@ -48,109 +64,207 @@ def execute(request) -> Dict[str, Any]:
                 "success": False or True,
 
                 // 抽出した本登録レコードのIDリスト
-                "targets": [...]
+                "targets": [...],
+
+                // 日数ごとの本登録レコードのIDリスト
+                "groups": { "0": [...], "3": [...], ... }
             }
     """
     logger.info(f"API Called.")
 
     # クエリー文字列取り出し
-    days = int(request.args.get("days"))
+    try:
+        horizons = parse_days(request.args.get("days"))
+    except ValueError as e:
+        response = {
+            "success": False,
+            "message": f"日数の指定が不正です: {e}",
+        }
+        logger.info(f"API Exit: {response}")
+        return response
 
     with common.create_session() as session:
-        # 指定された日数後に期限が切れるものを抽出
-        target_date = dt.combine(dt.now(), datetime.time()) + datetime.timedelta(days=days)
+        # 指定された日数後に期限が切れるものを、最も近い日から最も遠い日までの範囲でまとめて抽出
+        # 未アクションの条件は部分インデックスを使わせるため、バインド変数ではなくリテラルの 0 と比較する
+        today = dt.combine(dt.now(), datetime.time())
         target_products = session \
             .query(Product) \
-            .filter(Product.expiration_date == target_date) \
-            .filter(Product.added_shopping_list == 0) \
-            .filter(Product.consumed == 0) \
-            .order_by(Product.created_time) \
+            .filter(Product.expiration_date >= today + datetime.timedelta(days=horizons[0])) \
+            .filter(Product.expiration_date <= today + datetime.timedelta(days=horizons[-1])) \
+            .filter(Product.consumed == literal_column("0")) \
+            .filter(Product.added_shopping_list == literal_column("0")) \
+            .order_by(Product.expiration_date, Product.created_time) \
             .all()
 
-        # Slackにリマインド通知を送信
-        _push_remind_to_slack(target_products, days)
+        # 残り日数ごとにまとめ、指定されていない日数のものは除く
+        groups = {days: [] for days in horizons}
+        for product in target_products:
+            days = (product.expiration_date - today).days
+            if days in groups:
+                groups[days].append(product)
+
+        # Slackへのリマインド通知を送信待ち行列に追加 (同じ日に同じ日数で呼び出された場合は1件にまとめる)
+        _push_remind_to_slack(session, groups, f"remind:{today.strftime('%Y-%m-%d')}:{DAYS_SEPARATOR.join([str(days) for days in horizons])}")
+        session.commit()
 
         response = {
             "success": True,
-            "targets": [product.id for product in target_products],
+            "targets": [product.id for days in horizons for product in groups[days]],
+            "groups": {str(days): [product.id for product in groups[days]] for days in horizons},
         }
 
     logger.info(f"API Exit: {response}")
     return response
 
 
-def _push_remind_to_slack(products: List[Product], days: int):
-    """Slackの通知用チャンネルにコマンドボタン付きリマインドを送信します。
+def parse_days(value: Optional[str]) -> List[int]:
+    """日数の指定を解釈します。
 
     Arguments:
-        products {List[Product]} -- リマインド対象の本登録商品リスト
-        days {int} -- あと何日で期限切れになるかを表す日数
+        value {Optional[str]} -- 日数の指定 (例: "3", "0,1,3,7", "0..7", "-3..-1,7")
 
     Raises:
-        HTTPError - Slack API の呼出に失敗
+        ValueError: 解釈できない値が指定された場合
+
+    Returns:
+        List[int] -- 重複を除いて昇順に並べた日数
     """
-    if len(products) == 0:
-        # 1件も無い場合は何もしない
-        logger.info(f"リマインド対象の商品がありません")
-        return
+    if value is None or value.strip() == "":
+        raise ValueError("days が指定されていません")
 
-    # 公開用画像URLのリストに変換
-    image_urls = [
-        f"{GET_IMAGE_URL}{os.path.basename(product.image_path)}"
-        for product in products
-    ]
+    horizons = set()
+    for part in value.split(DAYS_SEPARATOR):
+        if DAYS_RANGE_SEPARATOR in part:
+            first, last = [_parse_day(day) for day in part.split(DAYS_RANGE_SEPARATOR)]
+            if last < first:
+                raise ValueError(part)
+            # 範囲を展開する前に個数を確かめ、巨大な範囲でメモリーを使い果たさないようにする
+            if MAX_HORIZONS < last - first + 1:
+                raise ValueError(f"一度に指定できる日数は {MAX_HORIZONS} 個までです")
+            horizons.update(range(first, last + 1))
+        else:
+            horizons.add(_parse_day(part))
+        if MAX_HORIZONS < len(horizons):
+            raise ValueError(f"一度に指定できる日数は {MAX_HORIZONS} 個までです")
+    return sorted(horizons)
+
+
+def _parse_day(value: str) -> int:
+    """1つの日数を解釈します。
+
+    Arguments:
+        value {str} -- 日数
+
+    Raises:
+        ValueError: 整数でないか、絶対値が大きすぎる値が指定された場合
+
+    Returns:
+        int -- 日数
+    """
+    day = int(value)
+    if MAX_ABS_DAYS < abs(day):
+        raise ValueError(f"日数は ±{MAX_ABS_DAYS} の範囲で指定してください: {day}")
+    return day
+
+
+def _get_remind_message(days: int) -> str:
+    """あと何日で期限切れになるかを表すメッセージを返します。
+
+    Arguments:
+        days {int} -- あと何日で期限切れになるかを表す日数
 
+    Returns:
+        str -- メッセージ
+    """
     if days == 0:
-        message = f"本日、期限が切れます。"
+        return f"本日、期限が切れます。"
     elif days > 0:
-        message = f"あと{days}日で期限が切れます。"
+        return f"あと{days}日で期限が切れます。"
+    else:
+        return f"{days}日前に期限が切れています。"
+
+
+def _push_remind_to_slack(session, groups: Dict[int, List[Product]], dedupe_key: str):
+    """Slackの通知用チャンネルへのコマンドボタン付きリマインドを、呼出元のトランザクションで送信待ち行列に追加します。
+    複数の日数にまたがる場合は、日数ごとの先頭の添付に見出しを付けた1件のメッセージにまとめます。
+
+    Arguments:
+        session -- DB接続セッション
+        groups {Dict[int, List[Product]]} -- あと何日で期限切れになるかを表す日数ごとの、リマインド対象の本登録商品リスト
+        dedupe_key {str} -- 送信待ちのメッセージをまとめるためのキー
+    """
+    groups = {days: products for days, products in groups.items() if len(products) > 0}
+    if len(groups) == 0:
+        # 1件も無い場合は何もしない
+        logger.info(f"リマインド対象の商品がありません")
+        return
+
+    if len(groups) == 1:
+        message = _get_remind_message(list(groups.keys())[0])
     else:
-        message = f"{days}日前に期限が切れています。"
+        message = f"期限が近い商品が {sum([len(products) for products in groups.values()])} 件あります。"
+
+    attachments = []
+    for days, products in groups.items():
+        section = _create_attachments(products)
+        if len(groups) > 1:
+            section[0]["pretext"] = _get_remind_message(days)
+        attachments += section
 
     # POST リクエストパラメーターを生成
     parameters = {
         "text": message,
-        "attachments": [
-            {
-                "text": f"{dt.strftime(product.created_time, '登録日：%Y-%m-%d')}",
-                "image_url": image_urls[i],
-                "fallback": "This food has expired.",
-                "callback_id": f"command_{product.id}",
-                "color": "warning",
-                "attachment_type": "default",
-                "actions": [
-                    {
-                        "name": "action",
-                        "type": "button",
-                        "value": "used",
-                        "text": "消費済み",
-                    },
-                    {
-                        "name": "action",
-                        "type": "button",
-                        "value": "shoppinglist",
-                        "text": "買い物リストに追加",
-                    },
-                    {
-                        "name": "action",
-                        "type": "button",
-                        "value": "remind",
-                        "text": "無視",
-                    },
-                ],
-            }
-            for i, product in enumerate(products)
-        ],
+        "attachments": attachments,
     }
     logger.debug(f"Slack API Request Parameters:\n{json.dumps(parameters, indent=4)}")
 
-    # Slack API に POST する
-    response = requests.post(
-        url=SLACK_INCOMING_WEBHOOK_URL,
-        data=json.dumps(parameters),
-        headers={"Content-Type": "application/json"}
-    )
-    logger.debug(f"Slack API Response: {response.status_code}\n{response.text}")
+    # 送信は送信スレッドが行い、失敗した場合は間隔を空けて再送する
+    outbox.enqueue(session, outbox.DESTINATION_SLACK_WEBHOOK, parameters, dedupe_key)
+
+
+def _create_attachments(products: List[Product]) -> List[Dict[str, Any]]:
+    """本登録商品ごとにコマンドボタン付きの添付を生成します。
+
+    Arguments:
+        products {List[Product]} -- リマインド対象の本登録商品リスト
+
+    Returns:
+        List[Dict[str, Any]] -- Slack メッセージの添付リスト
+    """
+    # 公開用画像URLのリストに変換 (Slack での表示に十分な大きさの縮小版を、長期間キャッシュさせるURLで使う)
+    image_urls = [
+        thumbnails.get_url(f"{GET_IMAGE_URL}{image_store.get_name(product.image_path)}", SLACK_IMAGE_SIZE, image.get_version(product.image_path))
+        for product in products
+    ]
 
-    # ステータスコードが 200 以外であれば例外を投げる
-    response.raise_for_status()
+    return [
+        {
+            "text": f"{dt.strftime(product.created_time, '登録日：%Y-%m-%d')}",
+            "image_url": image_urls[i],
+            "fallback": "This food has expired.",
+            "callback_id": f"command_{product.id}",
+            "color": "warning",
+            "attachment_type": "default",
+            "actions": [
+                {
+                    "name": "action",
+                    "type": "button",
+                    "value": "used",
+                    "text": "消費済み",
+                },
+                {
+                    "name": "action",
+                    "type": "button",
+                    "value": "shoppinglist",
+                    "text": "買い物リストに追加",
+                },
+                {
+                    "name": "action",
+                    "type": "button",
+                    "value": "remind",
+                    "text": "無視",
+                },
+            ],
+        }
+        for i, product in enumerate(products)
+    ]
@@ -0,0 +1,209 @@
+###############################################################################
+#    レスポンスを返した後やトランザクションを確定した後に行えばよい処理を、
+#    リクエストの処理とは別のスレッドで実行する仕組み
+#    待ち行列には上限を設け、溢れた処理は呼出元のスレッドでそのまま実行します (処理を取りこぼさない)。
+#    プロセスの終了時には、待ち行列に残っている処理の完了を一定時間待ってから終了します。
+###############################################################################
+import os
+import sys
+import time
+import queue
+import atexit
+import threading
+from datetime import datetime as dt
+from typing import Any, Callable, Dict
+from configparser import ConfigParser
+sys.path.insert(0, ".")
+
+# 独自モジュール読み込み
+import app.log as log
+import app.common as common
+logger = log.get_logger("background")
+
+# 設定ファイル読み込み
+config = ConfigParser()
+config.read("settings.conf", encoding="utf-8")
+
+##### 設定読み込み ####################
+# バックグラウンド処理を実行するワーカースレッド数
+MAX_WORKERS = config.getint("background", "max_workers", fallback=2)
+# 実行を待つ処理の最大数 (超えた分は呼出元のスレッドで実行する)
+MAX_QUEUE_SIZE = config.getint("background", "max_queue_size", fallback=100)
+# プロセスの終了時に、残っている処理の完了を待つ最大秒数
+SHUTDOWN_TIMEOUT_SECONDS = config.getfloat("background", "shutdown_timeout_seconds", fallback=10.0)
+
+# プロセス内で共有する待ち行列とワーカースレッド
+_queue = None
+_workers = []
+_workers_pid = None
+_workers_lock = threading.Lock()
+# 終了処理を始めたかどうか
+_closed = False
+
+# 処理の実行結果の統計
+_stats = {"submitted": 0, "ran_inline": 0, "done": 0, "failed": 0, "abandoned": 0}
+_last_error = None
+_stats_lock = threading.Lock()
+
+
+def submit(function: Callable[..., Any], *args, **kwargs):
+    """処理をバックグラウンドで実行します。
+    処理の中で発生した例外は呼出元には伝わらず、ログと統計に記録されます。
+    待ち行列が上限に達しているか、プロセスの終了処理を始めている場合は、呼出元のスレッドでそのまま実行します。
+
+    Arguments:
+        function {Callable[..., Any]} -- 実行する処理
+    """
+    with _stats_lock:
+        _stats["submitted"] += 1
+
+    task_queue = _get_queue()
+    if not _closed:
+        try:
+            task_queue.put_nowait((function, args, kwargs))
+            return
+        except queue.Full:
+            logger.warning(f"バックグラウンド処理の待ち行列が上限に達しているため、呼出元で実行します: {_get_name(function)}")
+
+    with _stats_lock:
+        _stats["ran_inline"] += 1
+    _run(function, *args, **kwargs)
+
+
+def submit_after_response(function: Callable[..., Any], *args, **kwargs):
+    """クライアントへのレスポンスの送信を終えた後に、処理をバックグラウンドで実行します。
+    リクエストの処理中でなければ、すぐに submit() します。
+
+    Arguments:
+        function {Callable[..., Any]} -- 実行する処理
+    """
+    from flask import after_this_request, has_request_context
+    if not has_request_context():
+        submit(function, *args, **kwargs)
+        return
+
+    @after_this_request
+    def _submit_on_close(response):
+        response.call_on_close(lambda: submit(function, *args, **kwargs))
+        return response
+
+
+def shutdown(timeout_seconds: float = SHUTDOWN_TIMEOUT_SECONDS) -> int:
+    """新しい処理の受付を止め、待ち行列に残っている処理の完了を一定時間待ちます。
+    プロセスの終了時に自動的に呼び出されます。
+
+    Keyword Arguments:
+        timeout_seconds {float} -- 完了を待つ最大秒数 (default: {SHUTDOWN_TIMEOUT_SECONDS})
+
+    Returns:
+        int -- 時間内に完了しなかった処理の数
+    """
+    global _closed
+    with _workers_lock:
+        if _queue is None or _closed or _workers_pid != os.getpid():
+            return 0
+        _closed = True
+        task_queue, workers = _queue, list(_workers)
+
+    # 待ち行列の末尾に終了の合図を並べ、各ワーカースレッドがそこまでの処理を終えるのを待つ
+    deadline = time.monotonic() + timeout_seconds
+    for _ in workers:
+        try:
+            task_queue.put(None, timeout=max(0.0, deadline - time.monotonic()))
+        except queue.Full:
+            break
+    for worker in workers:
+        worker.join(max(0.0, deadline - time.monotonic()))
+
+    # 時間内に取り出されなかった処理と、実行中のまま終わらなかった処理を数える
+    remaining = len([worker for worker in workers if worker.is_alive()])
+    while True:
+        try:
+            if task_queue.get_nowait() is not None:
+                remaining += 1
+        except queue.Empty:
+            break
+
+    if remaining > 0:
+        logger.error(f"終了までに完了しなかったバックグラウンド処理があります: {remaining} 件")
+        with _stats_lock:
+            _stats["abandoned"] += remaining
+    return remaining
+
+
+def get_stats() -> Dict[str, Any]:
+    """このプロセスでのバックグラウンド処理の件数と、最後に失敗した処理の内容を返します。
+
+    Returns:
+        Dict[str, Any] -- {"submitted": xxx, "ran_inline": xxx, "done": xxx, "failed": xxx, "abandoned": xxx, "queue_depth": xxx, "max_queue_size": xxx, "last_error": {...}}
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+        stats["last_error"] = _last_error
+    stats["queue_depth"] = _queue.qsize() if _queue is not None and _workers_pid == os.getpid() else 0
+    stats["max_queue_size"] = MAX_QUEUE_SIZE
+    return stats
+
+
+def _get_queue() -> queue.Queue:
+    """プロセス内で共有する待ち行列を返します。
+    ワーカースレッドは最初に呼び出された時点で起動し、fork 後は起動し直します。
+    """
+    global _queue, _workers, _workers_pid, _closed
+    with _workers_lock:
+        if _queue is None or _workers_pid != os.getpid():
+            _queue = queue.Queue(maxsize=MAX_QUEUE_SIZE)
+            _workers = [
+                threading.Thread(target=_work, args=(_queue,), name=f"background-{i}", daemon=True)
+                for i in range(MAX_WORKERS)
+            ]
+            for worker in _workers:
+                worker.start()
+            _workers_pid = os.getpid()
+            _closed = False
+        return _queue
+
+
+def _work(task_queue: queue.Queue):
+    """待ち行列から処理を取り出して実行します。終了の合図 (None) を受け取ると終了します。
+    """
+    while True:
+        task = task_queue.get()
+        if task is None:
+            return
+        function, args, kwargs = task
+        try:
+            _run(function, *args, **kwargs)
+        finally:
+            # ワーカースレッドに紐づいたDB接続セッションを次の処理に持ち越さない
+            common.remove_session()
+
+
+def _run(function: Callable[..., Any], *args, **kwargs) -> Any:
+    """処理を実行し、結果を統計に記録します。
+    """
+    global _last_error
+    try:
+        result = function(*args, **kwargs)
+        with _stats_lock:
+            _stats["done"] += 1
+        return result
+    except Exception as e:
+        logger.exception(f"バックグラウンド処理に失敗しました: {_get_name(function)}")
+        with _stats_lock:
+            _stats["failed"] += 1
+            _last_error = {
+                "function": _get_name(function),
+                "message": f"{type(e).__name__}: {e}",
+                "time": dt.now().isoformat(),
+            }
+
+
+def _get_name(function: Callable[..., Any]) -> str:
+    """ログに記録するための処理の名前を返します。
+    """
+    return f"{getattr(function, '__module__', '')}.{getattr(function, '__qualname__', function)}"
+
+
+# プロセスの終了時に、待ち行列に残っている処理を完了させる
+atexit.register(shutdown)
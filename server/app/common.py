@@ -1,17 +1,22 @@
 ###############################################################################
 #    汎用処理群
 ###############################################################################
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.orm.session import Session
-from sqlalchemy.pool import SingletonThreadPool
-from typing import Any, Dict, List
+from sqlalchemy.pool import QueuePool
+from typing import Any, Dict, List, Optional, Tuple
+from werkzeug.exceptions import RequestEntityTooLarge
+import os
 import sys
+import threading
 import cv2
 import numpy as np
 import base64
 import json
+import re
 import urllib.parse
 sys.path.insert(0, ".")
 
@@ -24,70 +29,461 @@ config.read("./alembic.ini", "UTF-8")
 DB_PATH = config.get("alembic", "sqlalchemy.url")
 print(DB_PATH)
 
+# 設定ファイル読み込み
+settings = configparser.ConfigParser()
+settings.read("settings.conf", "UTF-8")
 
-class SessionFactory(object):
-    """DB接続セッションを生成するファクトリークラスです。
-    """
+# リクエストボディの最大サイズ (バイト)
+MAX_REQUEST_BODY_BYTES = settings.getint("server", "max_request_body_bytes", fallback=2097152)
+# 発行したSQLをすべてログに出力するかどうか
+DB_ECHO = settings.getboolean("database", "echo", fallback=False)
+# プロセスごとに常時保持するDB接続の数
+DB_POOL_SIZE = settings.getint("database", "pool_size", fallback=5)
+# DB接続が足りないときに一時的に追加で開く接続の最大数
+DB_MAX_OVERFLOW = settings.getint("database", "max_overflow", fallback=15)
+# DB接続が空くのを待つ最大秒数
+DB_POOL_TIMEOUT = settings.getfloat("database", "pool_timeout", fallback=30.0)
+# 新しいDB接続ごとに適用するSQLiteのチューニングプロファイル名 (none で適用しない)
+DB_SQLITE_PROFILE = settings.get("database", "sqlite_profile", fallback="safe")
+
+##### 定数定義 ####################
+# リクエストボディがJPEG画像そのものであることを表す Content-Type
+BINARY_IMAGE_MIMETYPES = ["image/jpeg", "application/octet-stream"]
+# セグメント長を持たないJPEGマーカー (SOI, TEM, RST0～RST7)
+JPEG_STANDALONE_MARKERS = [0xD8, 0x01] + list(range(0xD0, 0xD8))
+# 画像サイズを保持するJPEGマーカー (SOF0～SOF15 のうち DHT, JPG, DAC を除く)
+JPEG_SOF_MARKERS = [m for m in range(0xC0, 0xD0) if m not in (0xC4, 0xC8, 0xCC)]
+# 従来形式のリクエストボディで画像の配列が始まる箇所
+LEGACY_IMAGE_KEY_PATTERN = re.compile(rb'"image"\s*:\s*\[')
+# SQLiteのチューニングプロファイルを定義するセクション名の接頭辞
+SQLITE_PROFILE_SECTION_PREFIX = "sqlite_profile:"
+# プロファイルで設定できるプラグマ (適用順)
+# ロック待ちの間に journal_mode の切替えが失敗しないように busy_timeout を最初に適用する
+SQLITE_PRAGMAS = ["busy_timeout", "journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store"]
+# プラグマの値として許可する書式
+SQLITE_PRAGMA_VALUE_PATTERN = re.compile(r"^-?\w+$")
 
-    def __init__(self, echo=False):
-        self.engine = create_engine(DB_PATH, echo=echo, poolclass=SingletonThreadPool)
 
-    def create(self) -> Session:
-        Session = sessionmaker(bind=self.engine, autocommit=False)
-        return Session()
+# プロセス内で共有するDBエンジンとセッションのレジストリー
+_engine = None
+_engine_pid = None
+_session_registry = None
+_engine_lock = threading.Lock()
 
 
 class SessionContext(object):
     """with構文 に対応させたDB接続セッション管理クラスです。
+    同じスレッドの中では同じセッションを共有するため、入れ子になった with構文 では
+    最も外側の with構文 を抜けるときにだけコミット (例外の場合はロールバック) とクローズを行います。
     """
+    # 入れ子の深さを記録するための Session.info のキー
+    DEPTH_KEY = "session_context_depth"
 
     def __init__(self, session):
         self.session = session
+        self.outermost = False
 
     def __enter__(self) -> Session:
+        depth = self.session.info.get(self.DEPTH_KEY, 0)
+        self.session.info[self.DEPTH_KEY] = depth + 1
+        self.outermost = depth == 0
         return self.session
 
     def __exit__(self, exc_type, exc_value, traceback):
+        self.session.info[self.DEPTH_KEY] -= 1
+        if not self.outermost:
+            # 内側の with構文 では呼出元のトランザクションを確定・破棄しない
+            # 例外はそのまま呼出元に伝わり、最も外側の with構文 でロールバックされる
+            return
+
         # with構文 を抜けるタイミングで自動的にコミット&クローズ
-        self.session.flush()
-        self.session.commit()
-        self.session.close()
+        # 例外で抜けた場合は途中までの変更を破棄する
+        try:
+            if exc_type is None:
+                self.session.flush()
+                self.session.commit()
+            else:
+                self.session.rollback()
+        finally:
+            self.session.close()
+
+
+def get_engine() -> Engine:
+    """プロセス内で共有するDBエンジンを返します。初回の呼出時にだけ生成します。
+    fork によって別のプロセスになった場合は、親プロセスの接続を引き継がないように生成し直します。
+
+    Returns:
+        Engine -- DBエンジン
+    """
+    global _engine, _engine_pid, _session_registry
+    if _engine is not None and _engine_pid == os.getpid():
+        return _engine
+
+    with _engine_lock:
+        if _engine is None or _engine_pid != os.getpid():
+            _engine = create_engine(
+                DB_PATH,
+                echo=DB_ECHO,
+                poolclass=QueuePool,
+                pool_size=DB_POOL_SIZE,
+                max_overflow=DB_MAX_OVERFLOW,
+                pool_timeout=DB_POOL_TIMEOUT,
+                # プールした接続は別のスレッドからも使われる
+                connect_args={"check_same_thread": False}
+            )
+            pragmas = load_sqlite_pragmas(DB_SQLITE_PROFILE)
+            event.listen(_engine, "connect", lambda dbapi_connection, connection_record: apply_sqlite_pragmas(dbapi_connection, pragmas))
+            _session_registry = scoped_session(sessionmaker(bind=_engine, autocommit=False))
+            _engine_pid = os.getpid()
+    return _engine
 
 
-class SessionContextFactory(object):
-    """with構文 に対応したDB接続セッションを生成するファクトリークラスです。
+def load_sqlite_pragmas(profile: str) -> List[Tuple[str, str]]:
+    """SQLiteのチューニングプロファイルを読み込みます。
+    プロファイルは alembic.ini の [sqlite_profile:<名前>] セクションに定義し、
+    settings.conf に同名のセクションがあればそちらの値を優先します。
+
+    Arguments:
+        profile {str} -- プロファイル名 (none で何も適用しない)
+
+    Raises:
+        ValueError: 存在しないプロファイル名や、許可されていないプラグマの値を指定した場合
+
+    Returns:
+        List[Tuple[str, str]] -- 適用順に並べた (プラグマ名, 値) のリスト
     """
+    if profile == "none":
+        return []
 
-    def __init__(self, echo=False):
-        self.session_factory = SessionFactory(echo=echo)
+    section = f"{SQLITE_PROFILE_SECTION_PREFIX}{profile}"
+    if not config.has_section(section) and not settings.has_section(section):
+        raise ValueError(f"SQLiteのチューニングプロファイルが定義されていません: {profile}")
 
-    def create(self) -> SessionContext:
-        return SessionContext(self.session_factory.create())
+    pragmas = []
+    for name in SQLITE_PRAGMAS:
+        value = settings.get(section, name, fallback=config.get(section, name, fallback=None))
+        if value is None:
+            continue
+        if not SQLITE_PRAGMA_VALUE_PATTERN.match(value):
+            raise ValueError(f"SQLiteのプラグマの値が不正です: {profile}.{name}={value}")
+        pragmas.append((name, value))
+    return pragmas
+
+
+def apply_sqlite_pragmas(dbapi_connection, pragmas: List[Tuple[str, str]]):
+    """新しく開いたSQLiteの接続にプラグマを適用します。
+
+    Arguments:
+        dbapi_connection {sqlite3.Connection} -- 開いたばかりの接続
+        pragmas {List[Tuple[str, str]]} -- 適用順に並べた (プラグマ名, 値) のリスト
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas:
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
 
 
 def create_session() -> SessionContext:
     """DB接続セッションを作成します。
+    同じスレッドの中では同じセッションを返し、リクエストの終了時に remove_session() で破棄されます。
     この関数の戻り値を受け取る呼出元変数は with構文 を用いて自動クローズの対象とすることを推奨します。
+    with構文 の中から呼び出した処理がさらに with構文 を使った場合は、呼出元と同じトランザクションに加わります。
+    ただし内側で session.commit() を明示的に呼び出すと呼出元の変更もコミットされるため、
+    独立したトランザクションが必要な処理は呼出元の with構文 を抜けてから呼び出してください。
 
     Returns:
         Session -- DB接続セッション
     """
-    return SessionContextFactory(echo=True).create()
+    get_engine()
+    return SessionContext(_session_registry())
+
+
+def remove_session():
+    """現在のスレッドに紐づいたDB接続セッションを破棄し、接続をプールに返します。
+    Flask のリクエスト終了時や、ワーカースレッドでの処理の終了時に呼び出します。
+    """
+    if _session_registry is not None and _engine_pid == os.getpid():
+        _session_registry.remove()
+
+
+class JpegImage(object):
+    """JPEG画像のバイト列をデコードせずに保持するクラスです。
+    画素データが必要になった時点で初めてデコードします。
+    """
+
+    def __init__(self, data: np.ndarray):
+        self.data = data
+        self.width, self.height = parse_jpeg_size(data)
+        self._pixels = None
+
+    @classmethod
+    def from_pixels(cls, pixels: np.ndarray, quality: int = 95) -> "JpegImage":
+        """OpenCVで扱える形式の画像をJPEGにエンコードして生成します。
 
+        Arguments:
+            pixels {np.ndarray} -- OpenCVで扱える形式の画像
 
-def convert_request_image_to_ndarray(request_image: List[int]) -> np.ndarray:
-    """M5Stackからのリクエスト形式で表される画像データをOpenCVで扱える形式に変換します。
+        Keyword Arguments:
+            quality {int} -- JPEGの画質 (default: {95})
+
+        Returns:
+            JpegImage -- JPEG画像
+        """
+        _, data = cv2.imencode(".jpg", pixels, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        image = cls(data.reshape(-1))
+        image._pixels = pixels
+        return image
+
+    @property
+    def pixels(self) -> np.ndarray:
+        """OpenCVで扱える形式にデコードした画像を返します。
+
+        Raises:
+            ValueError -- ヘッダーは正しいが、本体が途切れているか壊れていてデコードできない
+        """
+        if self._pixels is None:
+            pixels = decode_image(self.data)
+            if pixels is None:
+                raise ValueError(f"JPEG画像をデコードできませんでした ({self.width}x{self.height}, {len(self.data)} bytes)")
+            self._pixels = pixels
+        return self._pixels
+
+    def to_base64(self) -> str:
+        """元のバイト列のままBase64形式にエンコードします。
+
+        Returns:
+            str -- Base64形式の画像
+        """
+        return base64.b64encode(self.data).decode(encoding="utf-8")
+
+    def save(self, path: str):
+        """元のバイト列のままファイルに書き出します。
+
+        Arguments:
+            path {str} -- 書き出し先のファイルパス
+        """
+        with open(path, "wb") as f:
+            f.write(self.data)
+
+
+def read_request_image(request) -> np.ndarray:
+    """リクエストに含まれるJPEG画像をバイト列のNumPy配列として取り出します。
+    リクエストの Content-Type に応じて以下の形式を受け付けます。
+        image/jpeg, application/octet-stream -- リクエストボディそのものがJPEG画像
+        multipart/form-data -- image フィールドに添付されたJPEG画像
+        application/json -- M5Stackの従来形式 {"image": [uint8, uint8, ...]}
+
+    Arguments:
+        request -- POST リクエスト
+
+    Raises:
+        ValueError -- 画像データが含まれていない
+        RequestEntityTooLarge -- リクエストボディが最大サイズを超えている
+
+    Returns:
+        np.ndarray -- JPEG画像のバイト列を表す uint8 の一次元配列
+    """
+    if request.mimetype in BINARY_IMAGE_MIMETYPES:
+        # ボディをそのまま読み取り、コピーせずに配列として参照する
+        return np.frombuffer(_read_request_body(request), np.uint8)
+
+    if request.mimetype == "multipart/form-data":
+        _check_request_body_size(request)
+        image_file = request.files.get("image")
+        if image_file is None:
+            raise ValueError("multipart/form-data の image フィールドに画像が添付されていません")
+        return np.frombuffer(image_file.read(), np.uint8)
+
+    # 従来形式はJSONとして解釈せず、ボディから画像の配列部分だけを直接数値に変換する
+    return parse_legacy_image_array(_read_request_body(request))
+
+
+def get_request_value(request, key: str) -> Any:
+    """リクエストの形式を問わず、画像以外のパラメーターを取り出します。
+    従来のJSON形式の場合はボディから、それ以外の場合はクエリー文字列またはフォームから取り出します。
 
     Arguments:
-        request_image {List[int]} -- M5Stackからのリクエスト形式で表される画像データ
+        request -- POST リクエスト
+        key {str} -- パラメーター名
+
+    Returns:
+        Any -- パラメーターの値、存在しない場合は None
+    """
+    if request.mimetype in BINARY_IMAGE_MIMETYPES or request.mimetype == "multipart/form-data":
+        return request.values.get(key)
+
+    # 画像の配列部分を取り除いた残りだけをJSONとして解釈する
+    body = _read_request_body(request)
+    span = find_legacy_image_array(body)
+    if span is not None:
+        body = body[:span[0]] + b"null" + body[span[1]:]
+    return json.loads(body).get(key)
+
+
+def find_legacy_image_array(body: bytes) -> Optional[Tuple[int, int]]:
+    """従来形式のリクエストボディから "image" キーに対応する配列の位置を探します。
+
+    Arguments:
+        body {bytes} -- リクエストボディ
+
+    Returns:
+        Optional[Tuple[int, int]] -- 配列の開始位置 ([ の位置) と終了位置 (] の次の位置)、見つからない場合は None
+    """
+    match = LEGACY_IMAGE_KEY_PATTERN.search(body)
+    if match is None:
+        return None
+    end = body.find(b"]", match.end())
+    if end < 0:
+        return None
+    return match.end() - 1, end + 1
+
+
+def parse_legacy_image_array(body: bytes) -> np.ndarray:
+    """従来形式のリクエストボディに含まれる整数の配列を一括でJPEG画像のバイト列に変換します。
+    数値ごとにPythonのオブジェクトを生成せず、文字列全体をNumPyのベクトル演算で一度に処理します。
+
+    Arguments:
+        body {bytes} -- リクエストボディ {"image": [uint8, uint8, ...], ...}
+
+    Raises:
+        ValueError -- 画像の配列が見つからない、または uint8 の配列として解釈できない
+
+    Returns:
+        np.ndarray -- JPEG画像のバイト列を表す uint8 の一次元配列
+    """
+    span = find_legacy_image_array(body)
+    if span is None:
+        raise ValueError("リクエストに画像データが含まれていません")
+    chars = np.frombuffer(body, np.uint8, count=span[1] - span[0] - 2, offset=span[0] + 1)
+
+    # 空白を含む場合のみ取り除く (M5Stackのファームウェアは空白を含めない)
+    is_space = (chars == 0x20) | (chars == 0x09) | (chars == 0x0A) | (chars == 0x0D)
+    if np.any(is_space):
+        kept_positions = np.flatnonzero(~is_space)
+        chars = chars[kept_positions]
+        # 数字と数字の間に空白を挟んでいる場合は不正とみなす
+        is_digit = (chars >= 0x30) & (chars <= 0x39)
+        if np.any(is_digit[1:] & is_digit[:-1] & (np.diff(kept_positions) > 1)):
+            raise ValueError("画像データの配列に不正な数値が含まれています")
+    if len(chars) == 0:
+        raise ValueError("画像データの配列が空です")
+
+    # 数字以外の文字がすべてカンマであることを検証
+    comma_positions = np.flatnonzero(chars == 0x2C)
+    if np.count_nonzero((chars < 0x30) | (chars > 0x39)) != len(comma_positions):
+        raise ValueError("画像データの配列に数値以外の要素が含まれています")
+
+    # カンマ区切りの各要素の末尾位置と桁数を求める
+    element_ends = np.append(comma_positions, len(chars))
+    element_lengths = np.diff(element_ends, prepend=-1) - 1
+    if element_lengths.min() < 1 or element_lengths.max() > 3:
+        raise ValueError("画像データの配列に空の要素または4桁以上の数値が含まれています")
+
+    # 先頭に桁埋めを加えた上で、各要素の一の位・十の位・百の位をまとめて取り出して合計する
+    digits = np.zeros(len(chars) + 2, dtype=np.int16)
+    digits[2:] = chars
+    digits[2:] -= 0x30
+    digits[comma_positions + 2] = 0
+    values = digits[element_ends + 1] \
+        + digits[element_ends] * 10 \
+        + digits[element_ends - 1] * 100 * (element_lengths == 3)
+    if values.max() > 0xFF:
+        raise ValueError("画像データの配列に uint8 の範囲外の数値が含まれています")
+
+    return values.astype(np.uint8)
+
+
+def _read_request_body(request) -> bytes:
+    """リクエストボディの最大サイズを検証した上でボディを読み取ります。
+
+    Arguments:
+        request -- POST リクエスト
+
+    Raises:
+        RequestEntityTooLarge -- リクエストボディが最大サイズを超えている
+
+    Returns:
+        bytes -- リクエストボディ
+    """
+    _check_request_body_size(request)
+    return request.get_data()
+
+
+def _check_request_body_size(request):
+    """リクエストボディが最大サイズを超えていないか検証します。
+
+    Arguments:
+        request -- POST リクエスト
+
+    Raises:
+        RequestEntityTooLarge -- リクエストボディが最大サイズを超えている
+    """
+    if request.content_length is not None and request.content_length > MAX_REQUEST_BODY_BYTES:
+        raise RequestEntityTooLarge(f"リクエストボディが最大サイズ {MAX_REQUEST_BODY_BYTES} バイトを超えています")
+
+
+def decode_image(image_bytearray: np.ndarray) -> np.ndarray:
+    """JPEG画像のバイト列をOpenCVで扱える形式にデコードします。
+
+    Arguments:
+        image_bytearray {np.ndarray} -- JPEG画像のバイト列
 
     Returns:
         np.ndarray -- OpenCVで扱える形式の画像
     """
-    image_string = json.dumps(request_image, separators=(",", ":")).strip("[]")
-    image_bytearray = np.fromstring(image_string, np.uint8, sep=",")
-    image = cv2.imdecode(image_bytearray, cv2.IMREAD_COLOR)
-    return image
+    return cv2.imdecode(image_bytearray, cv2.IMREAD_COLOR)
+
+
+def parse_jpeg_size(image_bytearray: np.ndarray) -> Tuple[int, int]:
+    """JPEG画像のヘッダーをデコードせずに走査して幅と高さを取り出します。
+
+    Arguments:
+        image_bytearray {np.ndarray} -- JPEG画像のバイト列
+
+    Raises:
+        ValueError -- JPEG画像として解釈できない
+
+    Returns:
+        Tuple[int, int] -- (幅, 高さ)
+    """
+    data = memoryview(image_bytearray)
+    size = len(data)
+    if size < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        raise ValueError("JPEG画像の開始マーカーが見つかりません")
+
+    index = 2
+    while index + 3 < size:
+        if data[index] != 0xFF:
+            raise ValueError(f"JPEG画像のマーカーが不正です: offset={index}")
+
+        # マーカー前の埋め草 (0xFF の連続) を読み飛ばす
+        while index + 1 < size and data[index + 1] == 0xFF:
+            index += 1
+        marker = data[index + 1]
+        if marker in JPEG_STANDALONE_MARKERS:
+            index += 2
+            continue
+
+        if index + 3 >= size:
+            break
+        length = (data[index + 2] << 8) | data[index + 3]
+        if marker in JPEG_SOF_MARKERS:
+            if index + 8 >= size:
+                break
+            height = (data[index + 5] << 8) | data[index + 6]
+            width = (data[index + 7] << 8) | data[index + 8]
+            if width == 0 or height == 0:
+                raise ValueError(f"JPEG画像のサイズが不正です: {width}x{height}")
+            return width, height
+
+        if marker == 0xDA:
+            # SOF より先に画像データが始まった場合は不正とみなす
+            break
+        index += 2 + length
+
+    raise ValueError("JPEG画像のサイズ情報が見つかりません")
 
 
 def image_to_base64(numpy_image: np.ndarray) -> str:
@@ -0,0 +1,228 @@
+###############################################################################
+#    期限前で未アクションの商品イメージ画像を格子状に並べ、1枚の一覧画像 (コンタクトシート) にまとめる仕組み
+#    一覧画像は並べた商品のID・画像・賞味期限から求めたキーのファイル名で保管し、同じ内容であれば生成し直しません。
+###############################################################################
+import os
+import sys
+import json
+import uuid
+import hashlib
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime as dt
+from typing import List, Optional
+from configparser import ConfigParser
+sys.path.insert(0, ".")
+
+# 独自モジュール読み込み
+import app.log as log
+import app.thumbnails as thumbnails
+import app.image_store as image_store
+from model.products import Product
+logger = log.get_logger("contact_sheets")
+
+# 設定ファイル読み込み
+config = ConfigParser()
+config.read("settings.conf", encoding="utf-8")
+
+##### 設定読み込み ####################
+# 画像保管先を表すディレクトリーパス
+DESTINATION_DIRECTORY_PATH = config.get("register", "destination_directory_path")
+# 1行に並べる商品の数
+COLUMNS = config.getint("listup", "contact_sheet_columns", fallback=6)
+# 1商品あたりの画像の一辺のピクセル数
+TILE_SIZE = config.getint("listup", "contact_sheet_tile_size", fallback=240)
+# 一覧画像のJPEGの画質
+JPEG_QUALITY = config.getint("listup", "contact_sheet_jpeg_quality", fallback=85)
+# 1枚の一覧画像に並べる商品の最大数 (JPEGの大きさの上限とSlackでの見やすさのため)
+MAX_PRODUCTS = config.getint("listup", "contact_sheet_max_products", fallback=200)
+# 商品イメージ画像の読み込みと縮小を並行して行うスレッド数
+MAX_WORKERS = config.getint("listup", "contact_sheet_workers", fallback=4)
+# 残しておく一覧画像の数 (古いものから削除する)
+CACHE_FILES = config.getint("listup", "contact_sheet_cache_files", fallback=20)
+
+##### 定数定義 ####################
+# 一覧画像の保管先ディレクトリー名 (画像保管先の配下)
+CONTACT_SHEET_DIRECTORY_NAME = "contact_sheets"
+# 一覧画像の保管先ディレクトリーパス
+CONTACT_SHEET_DIRECTORY_PATH = os.path.join(DESTINATION_DIRECTORY_PATH, CONTACT_SHEET_DIRECTORY_NAME)
+# 一覧画像の拡張子
+EXTENSION = ".jpg"
+# 賞味期限を書き込む帯の高さ
+LABEL_HEIGHT = 32
+# 商品同士の間隔
+MARGIN = 8
+# 背景色と文字色 (BGR)
+BACKGROUND_COLOR = (255, 255, 255)
+PLACEHOLDER_COLOR = (224, 224, 224)
+LABEL_COLOR = (32, 32, 32)
+
+
+def get_name(products: List[Product]) -> str:
+    """並べる商品から一覧画像のファイル名を求めます。
+    商品のID・画像・賞味期限とレイアウトの設定のいずれかが変われば、別のファイル名になります。
+
+    Arguments:
+        products {List[Product]} -- 並べる順の商品リスト
+
+    Returns:
+        str -- ファイル名
+    """
+    key = json.dumps({
+        "layout": [COLUMNS, TILE_SIZE, JPEG_QUALITY],
+        "products": [
+            [product.id, image_store.get_name(product.image_path), dt.strftime(product.expiration_date, "%Y-%m-%d")]
+            for product in products
+        ],
+    })
+    return f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}{EXTENSION}"
+
+
+def get_path(name: str) -> str:
+    """一覧画像のファイル名から保管先のファイルパスを返します。
+
+    Arguments:
+        name {str} -- ファイル名
+
+    Returns:
+        str -- ファイルパス
+    """
+    return os.path.join(CONTACT_SHEET_DIRECTORY_PATH, name)
+
+
+def get_or_create(products: List[Product]) -> str:
+    """商品を並べた一覧画像のファイル名を返します。同じ内容の一覧画像がまだなければ生成します。
+    並べる商品は先頭から最大 contact_sheet_max_products 件までとします。
+
+    Arguments:
+        products {List[Product]} -- 並べる順の商品リスト
+
+    Raises:
+        ValueError -- 一覧画像をエンコードできなかった
+
+    Returns:
+        str -- 一覧画像のファイル名
+    """
+    products = products[:MAX_PRODUCTS]
+    name = get_name(products)
+    sheet_path = get_path(name)
+    if os.path.exists(sheet_path):
+        logger.debug(f"生成済みの一覧画像を使います: {name}")
+        return name
+
+    sheet = render(products)
+    success, data = cv2.imencode(EXTENSION, sheet, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    if not success:
+        raise ValueError(f"一覧画像をエンコードできませんでした: {sheet.shape[1]}x{sheet.shape[0]}")
+
+    # 書きかけのファイルを返さないように、一時ファイルに書き出してから置き換える
+    os.makedirs(CONTACT_SHEET_DIRECTORY_PATH, exist_ok=True)
+    temporary_path = f"{sheet_path}.{uuid.uuid4().hex}.tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(data.tobytes())
+    os.replace(temporary_path, sheet_path)
+    logger.info(f"一覧画像を生成しました: {name} ({len(products)} 件, {sheet.shape[1]}x{sheet.shape[0]})")
+
+    _prune()
+    return name
+
+
+def render(products: List[Product]) -> np.ndarray:
+    """商品イメージ画像を格子状に並べ、それぞれの下に賞味期限を書き込んだ画像を生成します。
+    商品イメージ画像の読み込みと縮小はスレッドを分けて並行して行います。
+
+    Arguments:
+        products {List[Product]} -- 並べる順の商品リスト
+
+    Returns:
+        np.ndarray -- OpenCVで扱える形式の画像
+    """
+    columns = max(1, min(COLUMNS, len(products)))
+    rows = max(1, (len(products) + columns - 1) // columns)
+    cell_width = TILE_SIZE + MARGIN
+    cell_height = TILE_SIZE + LABEL_HEIGHT + MARGIN
+    sheet = np.full((rows * cell_height + MARGIN, columns * cell_width + MARGIN, 3), BACKGROUND_COLOR, dtype=np.uint8)
+
+    # OpenCV の読み込みと縮小は GIL を解放するため、スレッドで並行させられる
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="contact_sheet") as executor:
+        tiles = executor.map(_load_tile, [product.image_path for product in products])
+
+        for i, (product, tile) in enumerate(zip(products, tiles)):
+            x = MARGIN + (i % columns) * cell_width
+            y = MARGIN + (i // columns) * cell_height
+            if tile is None:
+                sheet[y:y + TILE_SIZE, x:x + TILE_SIZE] = PLACEHOLDER_COLOR
+            else:
+                # 縦横比を保ったまま、枠の中央に配置する
+                height, width = tile.shape[:2]
+                top = y + (TILE_SIZE - height) // 2
+                left = x + (TILE_SIZE - width) // 2
+                sheet[top:top + height, left:left + width] = tile
+            _put_label(sheet, dt.strftime(product.expiration_date, "%Y-%m-%d"), x, y + TILE_SIZE)
+
+    return sheet
+
+
+def _load_tile(image_path: str) -> Optional[np.ndarray]:
+    """商品イメージ画像を、長辺が1商品あたりのピクセル数に収まるように縮小して読み込みます。
+    縮小版があればそれを使い、元の画像のデコードを避けます。
+
+    Arguments:
+        image_path {str} -- 元の画像のファイルパス
+
+    Returns:
+        Optional[np.ndarray] -- 縮小した画像、読み込めなかった場合は None
+    """
+    source_path = image_path
+    size = thumbnails.select_size(TILE_SIZE)
+    if size is not None:
+        try:
+            source_path = thumbnails.get_or_create(image_path, size)
+        except ValueError:
+            logger.warning(f"縮小版を用意できませんでした: {image_path}")
+            return None
+
+    pixels = cv2.imread(source_path, cv2.IMREAD_COLOR)
+    if pixels is None:
+        logger.warning(f"商品イメージ画像を読み込めませんでした: {image_path}")
+        return None
+
+    height, width = pixels.shape[:2]
+    scale = min(1.0, TILE_SIZE / max(height, width))
+    if scale < 1.0:
+        pixels = cv2.resize(pixels, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+    return pixels
+
+
+def _put_label(sheet: np.ndarray, text: str, x: int, y: int):
+    """商品の下の帯に、中央揃えで文字を書き込みます。
+
+    Arguments:
+        sheet {np.ndarray} -- 一覧画像
+        text {str} -- 書き込む文字 (OpenCV の標準フォントで表示できる英数字と記号のみ)
+        x {int} -- 帯の左端
+        y {int} -- 帯の上端
+    """
+    font_scale = TILE_SIZE / 320
+    thickness = max(1, round(font_scale * 2))
+    (width, height), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)
+    origin = (x + max(0, (TILE_SIZE - width) // 2), y + (LABEL_HEIGHT + height) // 2)
+    cv2.putText(sheet, text, origin, cv2.FONT_HERSHEY_SIMPLEX, font_scale, LABEL_COLOR, thickness, cv2.LINE_AA)
+
+
+def _prune():
+    """新しく生成したものから一定数を残して、古い一覧画像を削除します。
+    """
+    try:
+        sheet_paths = [
+            os.path.join(CONTACT_SHEET_DIRECTORY_PATH, name)
+            for name in os.listdir(CONTACT_SHEET_DIRECTORY_PATH)
+            if name.endswith(EXTENSION)
+        ]
+        sheet_paths.sort(key=os.path.getmtime, reverse=True)
+        for sheet_path in sheet_paths[CACHE_FILES:]:
+            os.remove(sheet_path)
+            logger.debug(f"Deleted: {os.path.basename(sheet_path)}")
+    except OSError:
+        logger.exception(f"古い一覧画像を削除できませんでした")
@@ -0,0 +1,147 @@
+###############################################################################
+#    OCRで得られたテキストから賞味期限の候補を抽出する仕組み
+#    設定されたフォーマットを起動時に一度だけコンパイルしておき、テキスト中の日付らしい箇所を順位の高い順に列挙して、
+#    暦の計算で検証した上で最良の1件を選びます。
+###############################################################################
+import sys
+import re
+import calendar
+import datetime
+from typing import Any, Dict, Iterator, List, Optional
+sys.path.insert(0, ".")
+
+# 独自モジュール読み込み
+import app.log as log
+logger = log.get_logger("date_extractor")
+
+##### 定数定義 ####################
+# 抽出した値の格納順序と格納先のキー名
+EXPIRATION_DATE_KEYS = ["year", "month", "day"]
+# テキスト中の任意の位置から照合させるためにフォーマットの先頭に書かれている前置部分
+ANY_PREFIX_PATTERN = re.compile(r"^\.\*\??")
+
+
+class DateExtractor(object):
+    """設定されたフォーマットに従って、テキストから賞味期限に相当する年月日を抽出するクラスです。
+    候補の優先順位は (フォーマットの記載順, テキスト中の位置) とし、検証を通った候補のうち最上位のものを返します。
+    旧実装と異なり、各フォーマットの最初の一致が無効でもテキストの後方にある一致まで検証します。
+    """
+
+    def __init__(self, date_format_patterns: List[str], old_limit_days: int, new_limit_days: int):
+        """
+        Arguments:
+            date_format_patterns {List[str]} -- 優先順に並べた年月日のフォーマット (年, 月, 日 の順にグループで囲んだ正規表現)
+            old_limit_days {int} -- 現在の日付よりも古い期限を許可する日数差分
+            new_limit_days {int} -- 現在の日付よりも新しい期限を許可する日数差分
+        """
+        self.old_limit_days = old_limit_days
+        self.new_limit_days = new_limit_days
+
+        # 先頭の .*? を取り除き、幅0の先読みで囲んで全位置の一致を重なりも含めて列挙できる形にコンパイルしておく
+        # .*? で始まらないフォーマットは re.match と同じくテキストの先頭でのみ照合する
+        self.scanners = []
+        self.anchored = []
+        for date_format_pattern in date_format_patterns:
+            body = ANY_PREFIX_PATTERN.sub("", date_format_pattern)
+            self.scanners.append(re.compile(f"(?=({body}))"))
+            self.anchored.append(body == date_format_pattern)
+
+    def extract(self, text: str, today: Optional[datetime.date] = None) -> Optional[Dict[str, int]]:
+        """テキストから賞味期限に相当する年月日を抽出します。
+        候補は順位の高い順に列挙しながらその場で検証し、最初に検証を通ったものを返します。
+
+        Arguments:
+            text {str} -- 抽出対象のテキスト
+
+        Keyword Arguments:
+            today {Optional[datetime.date]} -- 有効範囲の起点とする日付 (default: {None} で今日)
+
+        Returns:
+            Optional[Dict[str, int]] -- {"year": yyyy, "month": mm, "day": dd}、抽出できなかった場合は None
+        """
+        if today is None:
+            today = datetime.date.today()
+
+        for candidate in self.find_candidates(text):
+            expiration_date = self.validate(candidate["groups"], today)
+            if expiration_date is not None:
+                logger.debug(f"賞味期限の抽出に成功しました: {expiration_date} {candidate}")
+                return expiration_date
+
+        logger.debug(f"賞味期限を抽出できませんでした")
+        return None
+
+    def find_candidates(self, text: str) -> Iterator[Dict[str, Any]]:
+        """テキストからいずれかのフォーマットに一致する箇所を、順位の高い順に列挙します。
+        フォーマットごとにコンパイル済みの走査で1回ずつなめるだけで、後戻りによる再走査は行いません。
+
+        Arguments:
+            text {str} -- 抽出対象のテキスト
+
+        Returns:
+            Iterator[Dict[str, Any]] -- 候補
+                {
+                    // 候補の開始位置
+                    "position": xxx,
+
+                    // 一致したフォーマットの記載順
+                    "format_index": xxx,
+
+                    // フォーマットのグループに一致した文字列
+                    "groups": ("yyyy", "mm", "dd")
+                }
+        """
+        for index, scanner in enumerate(self.scanners):
+            if self.anchored[index]:
+                matches = [match for match in [scanner.match(text)] if match is not None]
+            else:
+                matches = scanner.finditer(text)
+            for match in matches:
+                yield {
+                    "position": match.start(),
+                    "format_index": index,
+                    # 先頭のグループは先読み全体を囲むためのもの
+                    "groups": match.groups()[1:],
+                }
+
+    def validate(self, groups: tuple, today: datetime.date) -> Optional[Dict[str, int]]:
+        """候補を年月日に変換し、実在する日付で、かつ有効範囲に収まるかどうかを検証します。
+
+        Arguments:
+            groups {tuple} -- フォーマットのグループに一致した文字列 (年, 月, 日 の順、日は省略可)
+            today {datetime.date} -- 有効範囲の起点とする日付
+
+        Returns:
+            Optional[Dict[str, int]] -- {"year": yyyy, "month": mm, "day": dd}、無効な候補の場合は None
+        """
+        try:
+            year, month, day = [
+                int(groups[index]) if index < len(groups) and groups[index] is not None else None
+                for index in range(len(EXPIRATION_DATE_KEYS))
+            ]
+        except ValueError:
+            return None
+        if year is None or month is None:
+            return None
+
+        if year < 100:
+            # 年を4桁表記に直す
+            # Y2K問題対策: 年の下二桁が現在よりも小さいときは上二桁に繰り上がりが起きている
+            century = today.year // 100 + (1 if year < today.year % 100 else 0)
+            year += century * 100
+
+        # 存在する年月日かどうか検証し、日が省略されている場合は月末の日付で補完する
+        if not (datetime.MINYEAR <= year <= datetime.MAXYEAR and 1 <= month <= 12):
+            return None
+        last_day = calendar.monthrange(year, month)[1]
+        if day is None:
+            day = last_day
+        elif not 1 <= day <= last_day:
+            return None
+
+        # 現在の日付を起点に見て古すぎないか、未来すぎないか検証
+        days = datetime.date(year, month, day).toordinal() - today.toordinal()
+        if days < -self.old_limit_days or self.new_limit_days < days:
+            return None
+
+        return {"year": year, "month": month, "day": day}
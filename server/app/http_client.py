@@ -0,0 +1,138 @@
+###############################################################################
+#    外部API (Google Cloud Vision API / Slack) 呼出用の共有HTTPクライアント
+#    接続先ホストごとに接続をプールして使い回し、TCP/TLS のハンドシェイクを省略します。
+###############################################################################
+import sys
+import time
+import threading
+import requests
+import urllib.parse
+from requests.adapters import HTTPAdapter
+from typing import Any, Dict, List
+from configparser import ConfigParser
+sys.path.insert(0, ".")
+
+# 独自モジュール読み込み
+import app.log as log
+logger = log.get_logger("http_client")
+
+# 設定ファイル読み込み
+config = ConfigParser()
+config.read("settings.conf", encoding="utf-8")
+
+##### 設定読み込み ####################
+# 接続確立のタイムアウト (秒)
+CONNECT_TIMEOUT = config.getfloat("http", "connect_timeout", fallback=3.05)
+# レスポンス受信のタイムアウト (秒)
+READ_TIMEOUT = config.getfloat("http", "read_timeout", fallback=30.0)
+# 接続をプールする接続先ホストの数
+POOL_CONNECTIONS = config.getint("http", "pool_connections", fallback=4)
+# 接続先ホストごとにプールする接続の最大数 (mod_wsgi の1プロセスあたりのスレッド数に合わせる)
+POOL_MAXSIZE = config.getint("http", "pool_maxsize", fallback=20)
+
+# プロセス内で共有するセッション
+_session = None
+_session_lock = threading.Lock()
+
+# 接続先ホストごとの所要時間の統計
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    """共有セッションを使って GET リクエストを送信します。
+
+    Arguments:
+        url {str} -- URL
+
+    Returns:
+        requests.Response -- レスポンス
+    """
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    """共有セッションを使って POST リクエストを送信します。
+
+    Arguments:
+        url {str} -- URL
+
+    Returns:
+        requests.Response -- レスポンス
+    """
+    return request("POST", url, **kwargs)
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    """共有セッションを使ってリクエストを送信し、接続先ホストごとの所要時間を記録します。
+    タイムアウトが指定されていない場合は設定ファイルのタイムアウトを適用します。
+
+    Arguments:
+        method {str} -- HTTPメソッド
+        url {str} -- URL
+
+    Returns:
+        requests.Response -- レスポンス
+    """
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+    host = urllib.parse.urlsplit(url).netloc
+    start = time.perf_counter()
+    try:
+        response = _get_session().request(method, url, **kwargs)
+    except requests.RequestException:
+        _record(host, time.perf_counter() - start, False)
+        raise
+    _record(host, time.perf_counter() - start, response.ok)
+    return response
+
+
+def get_stats() -> Dict[str, Any]:
+    """このプロセスにおける接続先ホストごとの所要時間の統計を返します。
+
+    Returns:
+        Dict[str, Any] -- 接続先ホストごとの呼出回数・失敗回数・平均/最大所要時間
+    """
+    with _stats_lock:
+        return {
+            host: {
+                "count": stats["count"],
+                "errors": stats["errors"],
+                "average_ms": stats["total"] / stats["count"] * 1000,
+                "max_ms": stats["max"] * 1000,
+            }
+            for host, stats in _stats.items()
+        }
+
+
+def _get_session() -> requests.Session:
+    """プロセス内で共有するセッションを返します。初回呼出時に生成します。
+
+    Returns:
+        requests.Session -- セッション
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+    return _session
+
+
+def _record(host: str, elapsed_seconds: float, success: bool):
+    """接続先ホストごとの所要時間を統計に記録します。
+
+    Arguments:
+        host {str} -- 接続先ホスト
+        elapsed_seconds {float} -- 所要時間 (秒)
+        success {bool} -- 成功したかどうか
+    """
+    logger.debug(f"{host}: {elapsed_seconds * 1000:.1f} ms")
+    with _stats_lock:
+        stats = _stats.setdefault(host, {"count": 0, "errors": 0, "total": 0.0, "max": 0.0})
+        stats["count"] += 1
+        stats["errors"] += 0 if success else 1
+        stats["total"] += elapsed_seconds
+        stats["max"] = max(stats["max"], elapsed_seconds)
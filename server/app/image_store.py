@@ -0,0 +1,177 @@
+###############################################################################
+#    商品イメージ画像の保管先
+#    画像は内容のハッシュ値をファイル名とし、ハッシュ値の先頭から取った階層のディレクトリーに分けて保管します。
+#    同じ内容の画像は1つのファイルを共有し、本登録テーブルの image_path から参照されなくなった時点で削除します。
+#        例: <destination_directory_path>/3f/a2/3fa2....jpg
+###############################################################################
+import os
+import re
+import sys
+import uuid
+import hashlib
+from typing import BinaryIO, List
+from configparser import ConfigParser
+sys.path.insert(0, ".")
+
+# 独自モジュール読み込み
+import app.log as log
+import app.common as common
+import app.thumbnails as thumbnails
+from model.products import Product
+logger = log.get_logger("image_store")
+
+# 設定ファイル読み込み
+config = ConfigParser()
+config.read("settings.conf", encoding="utf-8")
+
+##### 設定読み込み ####################
+# 画像保管先を表すディレクトリーパス
+DESTINATION_DIRECTORY_PATH = config.get("register", "destination_directory_path")
+# ハッシュ値の先頭から取って作るディレクトリーの階層数 (1階層あたり2文字)
+SHARD_DEPTH = config.getint("register", "image_store_shard_depth", fallback=2)
+
+##### 定数定義 ####################
+# 1階層あたりのディレクトリー名の文字数
+SHARD_WIDTH = 2
+# 保管する画像の拡張子
+EXTENSION = ".jpg"
+# 内容のハッシュ値をファイル名とする画像のファイル名
+CONTENT_ADDRESSED_NAME_PATTERN = re.compile(r"^[0-9a-f]{64}\.jpg$")
+
+
+def save(image: common.JpegImage) -> str:
+    """画像を内容のハッシュ値のファイル名で保管します。同じ内容の画像が既にあれば書き込みません。
+    再エンコードによる画質の劣化を避けるため、受け取ったJPEGのバイト列をそのまま書き出します。
+
+    Arguments:
+        image {common.JpegImage} -- 商品画像
+
+    Returns:
+        str -- 保管先のファイルパス (本登録テーブルの image_path に格納する値)
+    """
+    data = image.data.tobytes()
+    image_path = get_path(get_content_name(data))
+
+    if os.path.exists(image_path):
+        logger.debug(f"同じ内容の画像が保管済みです: {os.path.basename(image_path)}")
+        return image_path
+
+    _write(image_path, data)
+    return image_path
+
+
+def ensure(image: common.JpegImage, image_path: str):
+    """本登録を確定した後に、保管した画像が残っていることを確かめます。
+    同じ内容の画像を参照していた別の商品の削除と入れ違いになり、画像が消えていた場合は書き直します。
+
+    Arguments:
+        image {common.JpegImage} -- 商品画像
+        image_path {str} -- save() で得た保管先のファイルパス
+    """
+    if not os.path.exists(image_path):
+        logger.warning(f"参照中の画像が削除されていたため書き直します: {os.path.basename(image_path)}")
+        _write(image_path, image.data.tobytes())
+
+
+def get_content_name(data: bytes) -> str:
+    """画像の内容のハッシュ値から保管時のファイル名を返します。
+
+    Arguments:
+        data {bytes} -- 画像のバイト列
+
+    Returns:
+        str -- ファイル名
+    """
+    return f"{hashlib.sha256(data).hexdigest()}{EXTENSION}"
+
+
+def get_path(name: str) -> str:
+    """ファイル名から保管先のファイルパスを返します。
+    内容のハッシュ値をファイル名とする画像は階層化したディレクトリーに、それ以外 (移行前の画像) は保管先の直下にあるものとします。
+
+    Arguments:
+        name {str} -- ファイル名
+
+    Returns:
+        str -- ファイルパス
+    """
+    if not CONTENT_ADDRESSED_NAME_PATTERN.match(name):
+        return os.path.join(DESTINATION_DIRECTORY_PATH, name)
+    shards = [name[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_DEPTH)]
+    return os.path.join(DESTINATION_DIRECTORY_PATH, *shards, name)
+
+
+def get_name(image_path: str) -> str:
+    """公開用URLやファイルの添付に使うファイル名を返します。
+
+    Arguments:
+        image_path {str} -- 保管先のファイルパス
+
+    Returns:
+        str -- ファイル名
+    """
+    return os.path.basename(image_path)
+
+
+def open_image(image_path: str) -> BinaryIO:
+    """保管した画像を読み取り用に開きます。
+
+    Arguments:
+        image_path {str} -- 保管先のファイルパス
+
+    Returns:
+        BinaryIO -- ファイルオブジェクト
+    """
+    return open(image_path, "rb")
+
+
+def release(image_paths: List[str]) -> int:
+    """本登録テーブルから参照されなくなった画像とその縮小版を削除します。
+    本登録テーブルのレコードを削除したトランザクションを確定した後に呼び出します。既に存在しないファイルは無視します。
+
+    Arguments:
+        image_paths {List[str]} -- 参照が外れた可能性のある画像のファイルパス
+
+    Returns:
+        int -- 削除した画像の数
+    """
+    image_paths = list(set(image_paths))
+    with common.create_session() as session:
+        referenced = set([
+            image_path
+            for image_path, in session
+                .query(Product.image_path)
+                .filter(Product.image_path.in_(image_paths))
+                .group_by(Product.image_path)
+                .all()
+        ])
+
+    count = 0
+    for image_path in image_paths:
+        if image_path in referenced:
+            continue
+        try:
+            os.remove(image_path)
+            count += 1
+            logger.debug(f"Deleted: {os.path.basename(image_path)}")
+        except FileNotFoundError:
+            logger.warning(f"削除しようとした画像が既に存在しません: {image_path}")
+        except OSError:
+            logger.exception(f"画像を削除できませんでした: {image_path}")
+            continue
+        thumbnails.remove_variants([image_path])
+    return count
+
+
+def _write(image_path: str, data: bytes):
+    """書きかけのファイルを返さないように、一時ファイルに書き出してから置き換えます。
+
+    Arguments:
+        image_path {str} -- 書き出し先のファイルパス
+        data {bytes} -- 画像のバイト列
+    """
+    os.makedirs(os.path.dirname(image_path), exist_ok=True)
+    temporary_path = f"{image_path}.{uuid.uuid4().hex}.tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(data)
+    os.replace(temporary_path, image_path)
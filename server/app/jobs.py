@@ -0,0 +1,133 @@
+###############################################################################
+#    時間のかかる処理を非同期ジョブとして実行する仕組み
+#    ジョブの状態は全プロセスで共有するため、どのプロセスからでも結果を参照できます。
+###############################################################################
+import sys
+import json
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+sys.path.insert(0, ".")
+
+# 独自モジュール読み込み
+import app.log as log
+import app.common as common
+from app.kvstore import TTLStore
+logger = log.get_logger("jobs")
+
+##### 定数定義 ####################
+# ジョブの状態
+STATUS_PENDING = "pending"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+# ジョブの完了を待ち合わせるときの確認間隔 (秒)
+POLL_INTERVAL_SECONDS = 0.1
+
+
+class QueueFullError(Exception):
+    """ジョブの待ち行列が上限に達していることを表す例外です。
+    """
+    pass
+
+
+class JobQueue(object):
+    """有限のワーカースレッドでジョブを実行し、結果を有効期限付きで保持するクラスです。
+    """
+
+    def __init__(self, name: str, store_path: str, workers: int, max_queue: int, ttl_seconds: float):
+        """
+        Arguments:
+            name {str} -- ジョブの種類を表す名前 (保存先のテーブル名に使用)
+            store_path {str} -- ジョブの状態の保存先となるSQLiteファイルパス
+            workers {int} -- ワーカースレッド数
+            max_queue {int} -- 実行中と待機中を合わせたジョブ数の上限
+            ttl_seconds {float} -- ジョブの結果を保持する秒数
+        """
+        self.name = name
+        self.max_queue = max_queue
+        self._store = TTLStore(store_path, f"{name}_jobs", ttl_seconds)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-job")
+        self._lock = threading.Lock()
+        self._depth = 0
+        self._stats = {"submitted": 0, "rejected": 0, "done": 0, "failed": 0}
+
+    def submit(self, function: Callable[..., Dict[str, Any]], *args) -> str:
+        """ジョブを待ち行列に追加します。
+
+        Arguments:
+            function {Callable[..., Dict[str, Any]]} -- ジョブとして実行する処理、戻り値はJSONに変換可能な辞書
+
+        Raises:
+            QueueFullError -- 待ち行列が上限に達している
+
+        Returns:
+            str -- ジョブID
+        """
+        with self._lock:
+            if self._depth >= self.max_queue:
+                self._stats["rejected"] += 1
+                raise QueueFullError(f"ジョブの待ち行列が上限に達しています: {self.max_queue}")
+            self._depth += 1
+            self._stats["submitted"] += 1
+
+        job_id = str(uuid.uuid4()).replace("-", "")
+        self._store.set(job_id, json.dumps({"status": STATUS_PENDING}))
+        self._executor.submit(self._run, job_id, function, *args)
+        return job_id
+
+    def get(self, job_id: str, wait_seconds: float = 0) -> Optional[Dict[str, Any]]:
+        """ジョブの状態を取得します。
+        待ち時間を指定した場合は、ジョブが完了するか待ち時間が過ぎるまで待機します (ロングポーリング)。
+
+        Arguments:
+            job_id {str} -- ジョブID
+
+        Keyword Arguments:
+            wait_seconds {float} -- 完了を待つ最大秒数 (default: {0})
+
+        Returns:
+            Optional[Dict[str, Any]] -- {"status": "...", "result": {...}}、存在しないか有効期限切れの場合は None
+        """
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            # ポーリングのたびに書込みが発生しないよう、最終参照日時は更新しない
+            value = self._store.get(job_id, touch=False)
+            if value is None:
+                return None
+            job = json.loads(value)
+            if job["status"] != STATUS_PENDING or time.monotonic() >= deadline:
+                return job
+            time.sleep(POLL_INTERVAL_SECONDS)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """このプロセスにおけるジョブの統計を返します。
+
+        Returns:
+            Dict[str, Any] -- 待ち行列の深さと、受付・拒否・完了・失敗の件数
+        """
+        with self._lock:
+            return dict(queue_depth=self._depth, max_queue=self.max_queue, **self._stats)
+
+    def _run(self, job_id: str, function: Callable[..., Dict[str, Any]], *args):
+        """ジョブを実行して結果を保存します。
+
+        Arguments:
+            job_id {str} -- ジョブID
+            function {Callable[..., Dict[str, Any]]} -- ジョブとして実行する処理
+        """
+        try:
+            job = {"status": STATUS_DONE, "result": function(*args)}
+        except Exception as e:
+            logger.exception(f"ジョブの実行に失敗しました: {job_id}")
+            job = {"status": STATUS_FAILED, "result": None, "message": str(e)}
+        finally:
+            # ワーカースレッドに紐づいたDB接続セッションを次のジョブに持ち越さない
+            common.remove_session()
+            with self._lock:
+                self._depth -= 1
+
+        with self._lock:
+            self._stats[job["status"]] += 1
+        self._store.set(job_id, json.dumps(job, ensure_ascii=False))
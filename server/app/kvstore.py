@@ -0,0 +1,214 @@
+###############################################################################
+#    複数プロセス間で共有できる有効期限付きキーバリューストア
+#    mod_wsgi の各デーモンプロセスから同じSQLiteファイルを参照して使用します。
+###############################################################################
+import os
+import sys
+import time
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+sys.path.insert(0, ".")
+
+
+class TTLStore(object):
+    """有効期限と最大件数を持つキーバリューストアです。
+    最大件数を超えた場合は最後に参照された日時が古いものから削除します。
+    """
+
+    def __init__(self, path: str, table: str, ttl_seconds: float, max_entries: int = 0):
+        """
+        Arguments:
+            path {str} -- 保存先のSQLiteファイルパス
+            table {str} -- 保存先のテーブル名
+            ttl_seconds {float} -- 既定の有効期限 (秒)
+
+        Keyword Arguments:
+            max_entries {int} -- 最大件数、0 以下の場合は無制限 (default: {0})
+        """
+        self.path = path
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._initialized = False
+        self._lock = threading.Lock()
+
+    def get(self, key: str, touch: bool = True) -> Optional[str]:
+        """有効期限内の値を取得し、最終参照日時を更新します。
+
+        Arguments:
+            key {str} -- キー
+
+        Keyword Arguments:
+            touch {bool} -- 最終参照日時を更新するかどうか、
+                False の場合は書込みを行わない (ポーリングなど、頻繁に参照するだけの用途向け) (default: {True})
+
+        Returns:
+            Optional[str] -- 値、存在しないか有効期限切れの場合は None
+        """
+        now = time.time()
+        if not touch:
+            # SELECT のみではトランザクションを開始しないため、書込みロックを取らない
+            row = self._connect().execute(
+                f"SELECT value FROM {self.table} WHERE key = ? AND expires_at > ?",
+                (key, now)
+            ).fetchone()
+            return None if row is None else row[0]
+        with self._connect() as connection:
+            row = connection.execute(
+                f"SELECT value FROM {self.table} WHERE key = ? AND expires_at > ?",
+                (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def set(self, key: str, value: str, ttl_seconds: float = None):
+        """値を保存し、有効期限切れの値と最大件数を超えた分の値を削除します。
+
+        Arguments:
+            key {str} -- キー
+            value {str} -- 値
+
+        Keyword Arguments:
+            ttl_seconds {float} -- 有効期限 (秒)、省略時は既定の有効期限 (default: {None})
+        """
+        now = time.time()
+        ttl_seconds = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._connect() as connection:
+            connection.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl_seconds, now)
+            )
+            self._evict(connection, now)
+
+    def pop(self, key: str) -> Optional[str]:
+        """有効期限内の値を取得した上で削除します。
+        複数のプロセスから同時に取り出された場合は、実際に削除できた1つだけが値を受け取ります。
+
+        Arguments:
+            key {str} -- キー
+
+        Returns:
+            Optional[str] -- 値、存在しないか有効期限切れの場合は None
+        """
+        with self._connect() as connection:
+            row = connection.execute(
+                f"SELECT value FROM {self.table} WHERE key = ? AND expires_at > ?",
+                (key, time.time())
+            ).fetchone()
+            cursor = connection.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+        return None if row is None or cursor.rowcount == 0 else row[0]
+
+    def delete(self, key: str) -> bool:
+        """値を削除します。
+
+        Arguments:
+            key {str} -- キー
+
+        Returns:
+            bool -- 削除した値があったかどうか
+        """
+        with self._connect() as connection:
+            cursor = connection.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+        return cursor.rowcount > 0
+
+    def count(self) -> int:
+        """有効期限内の値の件数を返します。
+
+        Returns:
+            int -- 件数
+        """
+        with self._connect() as connection:
+            return connection.execute(
+                f"SELECT COUNT(*) FROM {self.table} WHERE expires_at > ?",
+                (time.time(),)
+            ).fetchone()[0]
+
+    def increment_counter(self, name: str, amount: int = 1):
+        """全プロセスで共有するカウンターを加算します。
+
+        Arguments:
+            name {str} -- カウンター名
+
+        Keyword Arguments:
+            amount {int} -- 加算する値 (default: {1})
+        """
+        with self._connect() as connection:
+            connection.execute(
+                f"INSERT OR IGNORE INTO {self.table}_counters (name, value) VALUES (?, 0)",
+                (name,)
+            )
+            connection.execute(
+                f"UPDATE {self.table}_counters SET value = value + ? WHERE name = ?",
+                (amount, name)
+            )
+
+    def get_counters(self) -> Dict[str, int]:
+        """全プロセスで共有するカウンターの値をすべて返します。
+
+        Returns:
+            Dict[str, int] -- カウンター名と値の辞書
+        """
+        with self._connect() as connection:
+            rows = connection.execute(f"SELECT name, value FROM {self.table}_counters").fetchall()
+        return {name: value for name, value in rows}
+
+    def _evict(self, connection: sqlite3.Connection, now: float):
+        """有効期限切れの値と、最大件数を超えた分の最終参照日時が古い値を削除します。
+
+        Arguments:
+            connection {sqlite3.Connection} -- DB接続
+            now {float} -- 現在のUNIX時間
+        """
+        connection.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (now,))
+        if self.max_entries <= 0:
+            return
+        connection.execute(
+            f"DELETE FROM {self.table} WHERE key IN ("
+            f"SELECT key FROM {self.table} ORDER BY accessed_at "
+            f"LIMIT MAX((SELECT COUNT(*) FROM {self.table}) - ?, 0))",
+            (self.max_entries,)
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        """スレッドごとに使い回すDB接続を返します。
+        with構文 で使用すると抜けるタイミングで自動的にコミットします。
+
+        Returns:
+            sqlite3.Connection -- DB接続
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory != "" and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=10.0)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._create_tables(connection)
+        return connection
+
+    def _create_tables(self, connection: sqlite3.Connection):
+        """テーブルが存在しない場合は作成します。
+
+        Arguments:
+            connection {sqlite3.Connection} -- DB接続
+        """
+        with self._lock:
+            if self._initialized:
+                return
+            with connection:
+                connection.execute(
+                    f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                    f"key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+                )
+                connection.execute(f"CREATE INDEX IF NOT EXISTS ix_{self.table}_expires_at ON {self.table} (expires_at)")
+                connection.execute(f"CREATE INDEX IF NOT EXISTS ix_{self.table}_accessed_at ON {self.table} (accessed_at)")
+                connection.execute(
+                    f"CREATE TABLE IF NOT EXISTS {self.table}_counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+                )
+            self._initialized = True
@@ -15,6 +15,10 @@ app.config["JSON_AS_ASCII"] = False
 FLASK_SERVER_PORT = 80
 DEBUGGER_PORT = 5000
 
+# Slack への送信待ち行列を処理するスレッドを起動する (前回の起動時に送り残したものもここで再送される)
+import app.outbox as outbox
+outbox.start()
+
 
 @app.route("/detect", methods=["POST"])
 def detect():
@@ -24,6 +28,14 @@ def detect():
     return jsonify(detect.execute(request))
 
 
+@app.route("/detect/<string:job_id>")
+def detect_result(job_id):
+    """非同期ジョブとして受け付けた賞味期限の読み取り結果を返します。
+    """
+    from app.api import detect_result
+    return jsonify(detect_result.execute(request, job_id))
+
+
 @app.route("/register", methods=["POST"])
 def register():
     """与えられた画像とセッションIDを紐づけて本登録を行います。
@@ -32,6 +44,22 @@ def register():
     return jsonify(register.execute(request))
 
 
+@app.route("/capture", methods=["POST"])
+def capture():
+    """与えられた画像から賞味期限を読み取り、同じ画像を商品イメージとして本登録を行います。
+    """
+    from app.api import capture
+    return jsonify(capture.execute(request))
+
+
+@app.route("/capture/cancel", methods=["POST"])
+def capture_cancel():
+    """/capture で本登録した直後の商品を取り消します。
+    """
+    from app.api import capture_cancel
+    return jsonify(capture_cancel.execute(request))
+
+
 @app.route("/cancel", methods=["POST"])
 def cancel():
     """与えられたセッションIDを持つ仮登録情報をキャンセルします。
@@ -69,7 +97,15 @@ def get_image(file_name):
     """[バイナリー返却] 本登録済みのイメージ画像を取得します。
     """
     from app.api import image
-    return image.execute(file_name)
+    return image.execute(file_name, request)
+
+
+@app.route("/contact_sheets/<string:file_name>")
+def get_contact_sheet(file_name):
+    """[バイナリー返却] /listup で生成した商品の一覧画像を取得します。
+    """
+    from app.api import contact_sheet
+    return contact_sheet.execute(file_name, request)
 
 
 @app.route("/remind")
@@ -88,6 +124,22 @@ def cleanup():
     return jsonify(cleanup.execute(request))
 
 
+@app.route("/metrics")
+def metrics():
+    """チューニング用の統計情報を返します。
+    """
+    from app.api import metrics
+    return jsonify(metrics.execute(request))
+
+
+@app.teardown_appcontext
+def remove_session(exception):
+    """リクエストごとのDB接続セッションを破棄して、接続をプールに返します。
+    """
+    import app.common as common
+    common.remove_session()
+
+
 @app.route("/health")
 def health():
     """ステータスコード 200 を返してシステムが正常な状態であることを表します。
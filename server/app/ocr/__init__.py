@@ -0,0 +1,60 @@
+###############################################################################
+#    OCRエンジンの切り替えを担うパッケージ
+#    settings.conf の [detect] ocr_backend で使用するOCRエンジンを選択します。
+###############################################################################
+import sys
+import threading
+from configparser import ConfigParser
+sys.path.insert(0, ".")
+
+from app.ocr.base import OcrBackend
+
+# 設定ファイル読み込み
+config = ConfigParser()
+config.read("settings.conf", encoding="utf-8")
+
+##### 設定読み込み ####################
+# 使用するOCRエンジンの名前
+BACKEND_NAME = config.get("detect", "ocr_backend", fallback="vision")
+
+# 生成済みのOCRエンジン
+_backend = None
+_lock = threading.Lock()
+
+
+def get_backend() -> OcrBackend:
+    """設定ファイルで選択されたOCRエンジンを返します。
+    OCRエンジンはプロセスごとに一度だけ生成して使い回します。
+
+    Raises:
+        ValueError -- 未知のOCRエンジン名が指定された
+
+    Returns:
+        OcrBackend -- OCRエンジン
+    """
+    global _backend
+    with _lock:
+        if _backend is None:
+            _backend = create_backend(BACKEND_NAME)
+    return _backend
+
+
+def create_backend(name: str) -> OcrBackend:
+    """名前に対応するOCRエンジンを生成します。
+
+    Arguments:
+        name {str} -- OCRエンジンの名前 (vision / tesseract)
+
+    Raises:
+        ValueError -- 未知のOCRエンジン名が指定された
+
+    Returns:
+        OcrBackend -- OCRエンジン
+    """
+    if name == "vision":
+        from app.ocr.vision import VisionBackend
+        return VisionBackend()
+    if name == "tesseract":
+        from app.ocr.tesseract import TesseractBackend
+        return TesseractBackend()
+    raise ValueError(f"未知のOCRエンジンが指定されました: {name}")
@@ -0,0 +1,60 @@
+###############################################################################
+#    OCRエンジンの共通インターフェース
+###############################################################################
+import sys
+from typing import Any, Dict, List
+sys.path.insert(0, ".")
+
+import app.common as common
+
+
+class OcrBackend(object):
+    """OCRエンジンの基底クラスです。
+    読み取り結果は、どのOCRエンジンでも Google Cloud Vision API と同じ形式の辞書で返します。
+    """
+
+    # OCRエンジンの名前 (読み取り結果のキャッシュを区別するために使用)
+    name = ""
+
+    def recognize(self, image: common.JpegImage) -> Dict[str, Any]:
+        """画像に含まれるテキストを読み取ります。
+
+        Arguments:
+            image {common.JpegImage} -- 解析対象の画像
+
+        Returns:
+            Dict[str, Any] -- Google Cloud Vision API 形式の読み取り結果
+                {
+                    "responses": [
+                        {
+                            "textAnnotations": [
+                                { "description": "画像全体から読み取ったテキスト" },
+                                ...
+                            ]
+                        }
+                    ]
+                }
+        """
+        raise NotImplementedError()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """OCRエンジン固有の統計情報を返します。
+
+        Returns:
+            Dict[str, Any] -- 統計情報
+        """
+        return {}
+
+
+def create_result(text: str) -> Dict[str, Any]:
+    """読み取ったテキストから Google Cloud Vision API 形式の読み取り結果を生成します。
+
+    Arguments:
+        text {str} -- 画像全体から読み取ったテキスト
+
+    Returns:
+        Dict[str, Any] -- Google Cloud Vision API 形式の読み取り結果
+    """
+    if text.strip() == "":
+        return {"responses": [{}]}
+    return {"responses": [{"textAnnotations": [{"description": text}]}]}
@@ -0,0 +1,116 @@
+###############################################################################
+#    同時に発生したOCR呼出をまとめて1回のリクエストで送信する仕組み
+#    プロセス内で短い待ち時間の間に集まった呼出を1つのバッチにまとめます。
+###############################################################################
+import sys
+import time
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+sys.path.insert(0, ".")
+
+# 独自モジュール読み込み
+import app.log as log
+logger = log.get_logger("ocr.batch")
+
+
+class MicroBatcher(object):
+    """最初の呼出から一定時間、または一定件数に達するまで呼出を待ち合わせ、まとめて処理するクラスです。
+    待ち合わせ時間と件数には上限があるため、単独の呼出が大きく遅れることはありません。
+    """
+
+    def __init__(self, process_batch: Callable[[List[Any]], List[Any]], max_size: int, max_wait_seconds: float,
+                 max_concurrent_batches: int = 4):
+        """
+        Arguments:
+            process_batch {Callable[[List[Any]], List[Any]]} -- 入力のリストを受け取り、同じ順序で結果のリストを返す処理
+            max_size {int} -- 1回のバッチにまとめる最大件数
+            max_wait_seconds {float} -- 最初の呼出からバッチを送信するまでの最大待ち時間 (秒)
+
+        Keyword Arguments:
+            max_concurrent_batches {int} -- 同時に処理するバッチの最大数 (default: {4})
+        """
+        self.process_batch = process_batch
+        self.max_size = max_size
+        self.max_wait_seconds = max_wait_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_batches, thread_name_prefix="ocr-batch-worker")
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {"batches": 0, "items": 0, "max_batch_size": 0}
+
+    def submit(self, item: Any) -> Future:
+        """入力をバッチに追加します。
+
+        Arguments:
+            item {Any} -- 入力
+
+        Returns:
+            Future -- バッチ処理が完了したときに、この入力に対応する結果を返す Future
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def get_stats(self) -> Dict[str, Any]:
+        """このプロセスにおけるバッチの統計を返します。
+
+        Returns:
+            Dict[str, Any] -- 送信したバッチ数・入力数・最大バッチサイズ
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats["average_batch_size"] = stats["items"] / stats["batches"] if stats["batches"] > 0 else None
+        return stats
+
+    def _ensure_started(self):
+        """バッチを送信するスレッドが起動していなければ起動します。
+        """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="ocr-batch", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        """最初の入力が届いてから待ち時間が過ぎるか最大件数に達するまで入力を集め、まとめて処理します。
+        処理中も次のバッチを集められるよう、処理そのものは別スレッドで行います。
+        """
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait_seconds
+            while len(batch) < self.max_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._executor.submit(self._process, batch)
+
+    def _process(self, batch: List[Any]):
+        """バッチを処理し、それぞれの呼出元に結果を返します。
+
+        Arguments:
+            batch {List[Any]} -- (入力, Future) のリスト
+        """
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["items"] += len(batch)
+            self._stats["max_batch_size"] = max(self._stats["max_batch_size"], len(batch))
+        logger.debug(f"{len(batch)} 件の呼出をまとめて処理します")
+
+        try:
+            results = self.process_batch([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"バッチ処理の結果の件数が一致しません: {len(results)} != {len(batch)}")
+        except Exception as e:
+            logger.exception(f"バッチ処理に失敗しました")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
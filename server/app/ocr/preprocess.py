@@ -0,0 +1,203 @@
+###############################################################################
+#    OCRエンジンに渡す前の画像の前処理
+#    テキスト領域の切り出し・グレースケール化・縮小を行い、OCRに渡すデータ量を減らします。
+###############################################################################
+import sys
+import json
+import time
+import threading
+import cv2
+import numpy as np
+from typing import Any, Callable, Dict, List
+from configparser import ConfigParser
+sys.path.insert(0, ".")
+
+# 独自モジュール読み込み
+import app.log as log
+import app.common as common
+logger = log.get_logger("ocr.preprocess")
+
+# 設定ファイル読み込み
+config = ConfigParser()
+config.read("settings.conf", encoding="utf-8")
+
+##### 設定読み込み ####################
+# 適用する前処理の名前を適用順に並べたリスト (空の場合は受け取った画像をそのままOCRに渡す)
+STAGE_NAMES = json.loads(config.get("detect", "preprocess_stages", fallback="[]"))
+# 縮小後のテキストの高さの目安 (ピクセル)
+TARGET_TEXT_HEIGHT = config.getint("detect", "preprocess_target_text_height", fallback=32)
+# 縮小後の画像の長辺の上限 (ピクセル)
+MAX_SIDE = config.getint("detect", "preprocess_max_side", fallback=1024)
+# 前処理後の画像をエンコードするときのJPEGの画質
+JPEG_QUALITY = config.getint("detect", "preprocess_jpeg_quality", fallback=90)
+
+##### 定数定義 ####################
+# 適用する前処理の組み合わせを表す文字列 (読み取り結果のキャッシュを区別するために使用)
+SIGNATURE = ",".join(STAGE_NAMES)
+# テキスト領域の切り出し時に、検出した領域の周囲に加える余白の割合
+CROP_MARGIN_RATIO = 0.1
+
+# 前処理ごとの所要時間の統計
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def apply(image: common.JpegImage) -> common.JpegImage:
+    """設定ファイルで指定された前処理を順に適用します。
+
+    Arguments:
+        image {common.JpegImage} -- OCR対象の画像
+
+    Returns:
+        common.JpegImage -- 前処理を適用した画像、前処理が指定されていない場合は受け取った画像そのもの
+    """
+    if len(STAGE_NAMES) == 0:
+        return image
+
+    pixels = image.pixels
+    context = {}
+    for name in STAGE_NAMES:
+        start = time.perf_counter()
+        pixels = STAGES[name](pixels, context)
+        _record(name, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    processed_image = common.JpegImage.from_pixels(pixels, JPEG_QUALITY)
+    _record("encode", time.perf_counter() - start)
+
+    logger.debug(
+        f"前処理を適用しました: {image.width}x{image.height} ({len(image.data)} bytes) "
+        f"-> {processed_image.width}x{processed_image.height} ({len(processed_image.data)} bytes)"
+    )
+    return processed_image
+
+
+def get_stats() -> Dict[str, Any]:
+    """このプロセスにおける前処理ごとの所要時間の統計を返します。
+
+    Returns:
+        Dict[str, Any] -- 前処理名ごとの呼出回数と平均所要時間
+    """
+    with _stats_lock:
+        return {
+            "stages": STAGE_NAMES,
+            "timings": {
+                name: {
+                    "count": count,
+                    "average_ms": total / count * 1000,
+                }
+                for name, (count, total) in _stats.items()
+            },
+        }
+
+
+def crop_text(pixels: np.ndarray, context: Dict[str, Any]) -> np.ndarray:
+    """モルフォロジー勾配からテキストらしい領域を検出し、その領域をまとめて切り出します。
+    検出した行のうち最も低い行の高さを context["text_height"] に記録します。
+    賞味期限の印字は商品名などより小さいことが多いため、縮小の基準は最も小さい行に合わせます。
+
+    Arguments:
+        pixels {np.ndarray} -- 画像
+        context {Dict[str, Any]} -- 前処理間で共有する情報
+
+    Returns:
+        np.ndarray -- 切り出した画像、テキストらしい領域が見つからない場合は元の画像
+    """
+    gray = pixels if pixels.ndim == 2 else cv2.cvtColor(pixels, cv2.COLOR_BGR2GRAY)
+    height, width = gray.shape[:2]
+    scale = max(width / 320, 1.0)
+
+    # 文字の輪郭を強調して二値化し、横方向に連結して行単位の塊にする
+    gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    _, binary = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (int(9 * scale), max(int(scale), 1)))
+    connected = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
+    contours, _ = cv2.findContours(connected, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    # 横長で、十分な輪郭を含む塊だけをテキスト行とみなす
+    boxes = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if h < 6 * scale or w < h or h > height * 0.5:
+            continue
+        if cv2.countNonZero(binary[y:y + h, x:x + w]) < w * h * 0.2:
+            continue
+        boxes.append((x, y, w, h))
+
+    if len(boxes) == 0:
+        logger.debug(f"テキストらしい領域が見つからないため切り出しを省略します")
+        return pixels
+
+    context["text_height"] = float(min(h for _, _, _, h in boxes))
+    left = min(x for x, _, _, _ in boxes)
+    top = min(y for _, y, _, _ in boxes)
+    right = max(x + w for x, _, w, _ in boxes)
+    bottom = max(y + h for _, y, _, h in boxes)
+    margin = int(max(right - left, bottom - top) * CROP_MARGIN_RATIO)
+    return pixels[max(top - margin, 0):min(bottom + margin, height), max(left - margin, 0):min(right + margin, width)]
+
+
+def grayscale(pixels: np.ndarray, context: Dict[str, Any]) -> np.ndarray:
+    """グレースケールに変換します。
+
+    Arguments:
+        pixels {np.ndarray} -- 画像
+        context {Dict[str, Any]} -- 前処理間で共有する情報
+
+    Returns:
+        np.ndarray -- グレースケール画像
+    """
+    if pixels.ndim == 2:
+        return pixels
+    return cv2.cvtColor(pixels, cv2.COLOR_BGR2GRAY)
+
+
+def downscale(pixels: np.ndarray, context: Dict[str, Any]) -> np.ndarray:
+    """読み取り精度を保てる範囲で最小の解像度に縮小します。
+    テキスト領域を切り出し済みの場合は最も低い行の高さが目安の値になるまで、そうでない場合は長辺が上限値になるまで縮小します。
+    最も低い行を目安の高さより小さくしないことを長辺の上限より優先し、拡大は行いません。
+
+    Arguments:
+        pixels {np.ndarray} -- 画像
+        context {Dict[str, Any]} -- 前処理間で共有する情報
+
+    Returns:
+        np.ndarray -- 縮小した画像
+    """
+    height, width = pixels.shape[:2]
+    if "text_height" in context:
+        # 最も低い行 (賞味期限の印字であることが多い) が目安の高さを下回らないようにする
+        scale = TARGET_TEXT_HEIGHT / context["text_height"]
+    else:
+        scale = MAX_SIDE / max(width, height)
+    if scale >= 1.0:
+        return pixels
+
+    context["text_height"] = context.get("text_height", height) * scale
+    return cv2.resize(pixels, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+def _record(name: str, elapsed_seconds: float):
+    """前処理の所要時間を統計に記録します。
+
+    Arguments:
+        name {str} -- 前処理名
+        elapsed_seconds {float} -- 所要時間 (秒)
+    """
+    logger.debug(f"前処理 [{name}]: {elapsed_seconds * 1000:.2f} ms")
+    with _stats_lock:
+        count, total = _stats.get(name, (0, 0.0))
+        _stats[name] = (count + 1, total + elapsed_seconds)
+
+
+# 前処理名と処理内容の対応表
+STAGES: Dict[str, Callable[[np.ndarray, Dict[str, Any]], np.ndarray]] = {
+    "crop_text": crop_text,
+    "grayscale": grayscale,
+    "downscale": downscale,
+}
+
+# 未知の前処理名が指定されていれば起動時に気付けるようにする
+for _name in STAGE_NAMES:
+    if _name not in STAGES:
+        raise ValueError(f"未知の前処理が指定されました: {_name}")
@@ -0,0 +1,223 @@
+###############################################################################
+#    OCRエンジンに渡す前のフレーム品質判定
+#    ブレ・露出・テキストらしさを数ミリ秒で採点し、読み取れる見込みのないフレームを OCR API を呼ばずに棄却します。
+###############################################################################
+import sys
+import json
+import time
+import threading
+import cv2
+import numpy as np
+from typing import Any, Dict, List, Optional
+from configparser import ConfigParser
+sys.path.insert(0, ".")
+
+# 独自モジュール読み込み
+import app.log as log
+import app.common as common
+logger = log.get_logger("ocr.quality")
+
+# 設定ファイル読み込み
+config = ConfigParser()
+config.read("settings.conf", encoding="utf-8")
+
+##### 設定読み込み ####################
+# フレーム品質判定で棄却を行うかどうか
+# (既定では無効で、採点と記録のみを行う。記録した採点結果で閾値を調整してから有効にする)
+ENABLED = config.getboolean("detect", "quality_gate_enabled", fallback=False)
+# ブレとみなすラプラシアン分散の下限値
+MIN_SHARPNESS = config.getfloat("detect", "quality_min_sharpness", fallback=15.0)
+# 暗すぎるとみなす平均輝度の下限値 (0-255)
+MIN_BRIGHTNESS = config.getfloat("detect", "quality_min_brightness", fallback=40.0)
+# 明るすぎるとみなす平均輝度の上限値 (0-255)
+MAX_BRIGHTNESS = config.getfloat("detect", "quality_max_brightness", fallback=220.0)
+# 黒つぶれ・白とびした画素の割合の上限値
+MAX_CLIPPED_RATIO = config.getfloat("detect", "quality_max_clipped_ratio", fallback=0.5)
+# テキストらしさ (輪郭が強い画素の割合) の下限値
+MIN_TEXT_SCORE = config.getfloat("detect", "quality_min_text_score", fallback=0.005)
+# 採点結果を1行1件のJSONで追記するファイルパス (空の場合はログ出力のみ)
+LOG_PATH = config.get("detect", "quality_log_path", fallback="")
+
+##### 定数定義 ####################
+# 採点に使う画像の幅 (これより大きい画像は縮小してから採点する)
+SCORING_WIDTH = 320
+# 黒つぶれとみなす輝度の上限値
+CLIPPED_DARK_LEVEL = 5
+# 白とびとみなす輝度の下限値
+CLIPPED_BRIGHT_LEVEL = 250
+# テキストの輪郭とみなすモルフォロジー勾配の下限値
+TEXT_GRADIENT_LEVEL = 48
+# 輪郭が見当たらなくても、輝度の標準偏差がこれ以上あれば何かが写っている (ぶれている) とみなす
+BLURRED_MIN_CONTRAST = 8.0
+
+# 判定結果を表すコード
+REASON_OK = "ok"
+REASON_TOO_DARK = "too_dark"
+REASON_TOO_BRIGHT = "too_bright"
+REASON_NO_TEXT = "no_text"
+REASON_BLURRY = "blurry"
+
+# 棄却理由ごとの利用者向けメッセージ
+MESSAGES = {
+    REASON_TOO_DARK: "画像が暗すぎるため読み取りを行いませんでした",
+    REASON_TOO_BRIGHT: "画像が明るすぎるため読み取りを行いませんでした",
+    REASON_NO_TEXT: "画像内に文字らしいものが見当たらないため読み取りを行いませんでした",
+    REASON_BLURRY: "画像がぶれているため読み取りを行いませんでした",
+}
+
+# 判定結果ごとの件数と採点結果の合計
+_stats = {}
+_stats_lock = threading.Lock()
+_log_lock = threading.Lock()
+
+
+def check(image: common.JpegImage) -> Optional[str]:
+    """フレームを採点し、OCRにかける価値があるかどうかを判定します。
+    採点結果と判定はログ・統計、および設定されていればJSONファイルに記録します。
+    判定が無効の場合 (既定) は記録のみを行い、棄却はしません。
+
+    Arguments:
+        image {common.JpegImage} -- 判定対象の画像
+
+    Returns:
+        Optional[str] -- 棄却する場合はその理由を表すコード、OCRにかける場合は None
+    """
+    start = time.perf_counter()
+    scores = score(image.pixels)
+    reason = judge(scores)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    _record(reason, scores, elapsed_ms)
+    if not ENABLED or reason == REASON_OK:
+        return None
+    return reason
+
+
+def score(pixels: np.ndarray) -> Dict[str, float]:
+    """フレームのブレ・露出・テキストらしさを採点します。
+
+    Arguments:
+        pixels {np.ndarray} -- 画像
+
+    Returns:
+        Dict[str, float] -- 採点結果
+            {
+                // ラプラシアン分散 (小さいほどぶれている)
+                "sharpness": xxx,
+
+                // 平均輝度 (0-255)
+                "brightness": xxx,
+
+                // 黒つぶれ・白とびした画素の割合
+                "clipped_ratio": xxx,
+
+                // 輝度の標準偏差 (0 に近いほど一様な画像)
+                "contrast": xxx,
+
+                // 輪郭が強い画素の割合 (小さいほど文字が写っていない)
+                "text_score": xxx
+            }
+    """
+    gray = pixels if pixels.ndim == 2 else cv2.cvtColor(pixels, cv2.COLOR_BGR2GRAY)
+    scale = SCORING_WIDTH / gray.shape[1]
+    if scale < 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    # 輝度ヒストグラムから露出を求める
+    histogram = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel()
+    pixel_count = gray.size
+    levels = np.arange(256)
+    brightness = float(np.dot(histogram, levels) / pixel_count)
+    contrast = float(np.sqrt(np.dot(histogram, (levels - brightness) ** 2) / pixel_count))
+    clipped = histogram[:CLIPPED_DARK_LEVEL + 1].sum() + histogram[CLIPPED_BRIGHT_LEVEL:].sum()
+
+    # 文字の輪郭に相当する強い勾配がどれだけ含まれるか
+    gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+
+    return {
+        "sharpness": float(cv2.Laplacian(gray, cv2.CV_64F).var()),
+        "brightness": brightness,
+        "clipped_ratio": float(clipped / pixel_count),
+        "contrast": contrast,
+        "text_score": float(np.count_nonzero(gradient >= TEXT_GRADIENT_LEVEL) / pixel_count),
+    }
+
+
+def judge(scores: Dict[str, float]) -> str:
+    """採点結果を閾値と比較して判定します。
+    暗いフレームや文字のないフレームはラプラシアン分散も小さくなるため、露出・テキストらしさ・ブレの順に判定します。
+    ただし大きくぶれて輪郭が消えたフレームは、濃淡が残っていればブレとして扱います。
+
+    Arguments:
+        scores {Dict[str, float]} -- score() の採点結果
+
+    Returns:
+        str -- 判定結果を表すコード
+    """
+    if scores["brightness"] < MIN_BRIGHTNESS:
+        return REASON_TOO_DARK
+    if scores["brightness"] > MAX_BRIGHTNESS:
+        return REASON_TOO_BRIGHT
+    if scores["clipped_ratio"] > MAX_CLIPPED_RATIO:
+        return REASON_TOO_DARK if scores["brightness"] < 128 else REASON_TOO_BRIGHT
+    if scores["text_score"] < MIN_TEXT_SCORE:
+        if scores["sharpness"] < MIN_SHARPNESS and scores["contrast"] >= BLURRED_MIN_CONTRAST:
+            return REASON_BLURRY
+        return REASON_NO_TEXT
+    if scores["sharpness"] < MIN_SHARPNESS:
+        return REASON_BLURRY
+    return REASON_OK
+
+
+def get_stats() -> Dict[str, Any]:
+    """このプロセスにおける判定結果ごとの件数と平均採点結果を返します。
+
+    Returns:
+        Dict[str, Any] -- 統計情報
+    """
+    with _stats_lock:
+        return {
+            "enabled": ENABLED,
+            "decisions": {
+                reason: {
+                    "count": count,
+                    "average_ms": total_ms / count,
+                    **{name: value / count for name, value in totals.items()},
+                }
+                for reason, (count, total_ms, totals) in _stats.items()
+            },
+        }
+
+
+def _record(reason: str, scores: Dict[str, float], elapsed_ms: float):
+    """採点結果と判定を記録します。
+
+    Arguments:
+        reason {str} -- 判定結果を表すコード
+        scores {Dict[str, float]} -- 採点結果
+        elapsed_ms {float} -- 採点に要した時間 (ミリ秒)
+    """
+    logger.info(f"フレーム品質判定: {reason} {scores} ({elapsed_ms:.2f} ms)")
+
+    with _stats_lock:
+        count, total_ms, totals = _stats.get(reason, (0, 0.0, {}))
+        _stats[reason] = (
+            count + 1,
+            total_ms + elapsed_ms,
+            {name: totals.get(name, 0.0) + value for name, value in scores.items()},
+        )
+
+    if LOG_PATH == "":
+        return
+    line = json.dumps({
+        "time": time.time(),
+        "reason": reason,
+        "enabled": ENABLED,
+        "elapsed_ms": elapsed_ms,
+        **scores,
+    })
+    try:
+        with _log_lock, open(LOG_PATH, "a", encoding="utf-8") as w:
+            w.write(line + "\n")
+    except OSError as e:
+        logger.warning(f"フレーム品質判定の記録に失敗しました: {e}")
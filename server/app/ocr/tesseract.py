@@ -0,0 +1,80 @@
+###############################################################################
+#    Tesseract を使用してサーバー内で完結するOCRエンジン
+#    ネットワークを介さないため、オフライン環境でも賞味期限を読み取ることができます。
+###############################################################################
+import sys
+import cv2
+import numpy as np
+from typing import Any, Dict, List
+from configparser import ConfigParser
+sys.path.insert(0, ".")
+
+# 独自モジュール読み込み
+import app.log as log
+import app.common as common
+from app.ocr.base import OcrBackend, create_result
+logger = log.get_logger("ocr.tesseract")
+
+# 設定ファイル読み込み
+config = ConfigParser()
+config.read("settings.conf", encoding="utf-8")
+
+##### 設定読み込み ####################
+# Tesseract に渡すオプション
+# 賞味期限の表記に現れる数字と区切り文字だけを読み取り対象とし、誤認識を減らす
+TESSERACT_CONFIG = config.get(
+    "detect", "tesseract_config",
+    fallback="--oem 1 --psm 6 -c tessedit_char_whitelist=0123456789./-"
+)
+# Tesseract に渡す前に拡大するときの画像の高さの下限 (ピクセル)
+MIN_HEIGHT = config.getint("detect", "tesseract_min_height", fallback=480)
+
+
+class TesseractBackend(OcrBackend):
+    """Tesseract をサブプロセスとして呼び出すOCRエンジンです。
+    ドット区切りの日付が読み取りやすくなるよう、二値化と拡大を行ってから読み取ります。
+    """
+
+    name = "tesseract"
+
+    def __init__(self):
+        # 使用しない環境では依存パッケージを要求しない
+        import pytesseract
+        self.pytesseract = pytesseract
+
+    def recognize(self, image: common.JpegImage) -> Dict[str, Any]:
+        """Tesseract で画像に含まれるテキストを読み取ります。
+
+        Arguments:
+            image {common.JpegImage} -- 解析対象の画像
+
+        Returns:
+            Dict[str, Any] -- Google Cloud Vision API 形式の読み取り結果
+        """
+        binary_image = binarize(image.pixels)
+        text = self.pytesseract.image_to_string(binary_image, config=TESSERACT_CONFIG)
+        logger.debug(f"Tesseract の読み取り結果: [{text}]")
+        return create_result(text)
+
+
+def binarize(image: np.ndarray) -> np.ndarray:
+    """文字を黒、背景を白とした二値画像に変換します。
+    ドット区切りの小さな点が潰れないよう、低解像度の画像は拡大してから二値化します。
+
+    Arguments:
+        image {np.ndarray} -- OpenCVで扱える形式の画像
+
+    Returns:
+        np.ndarray -- 二値画像
+    """
+    gray_image = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if gray_image.shape[0] < MIN_HEIGHT:
+        scale = MIN_HEIGHT / gray_image.shape[0]
+        gray_image = cv2.resize(gray_image, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+
+    _, binary_image = cv2.threshold(gray_image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+    # 背景が暗い場合は白黒を反転して黒い文字に揃える
+    if np.count_nonzero(binary_image) < binary_image.size / 2:
+        binary_image = cv2.bitwise_not(binary_image)
+    return binary_image
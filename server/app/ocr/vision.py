@@ -0,0 +1,112 @@
+###############################################################################
+#    Google Cloud Vision API を使用するOCRエンジン
+###############################################################################
+import sys
+import json
+from typing import Any, Dict, List
+from configparser import ConfigParser
+sys.path.insert(0, ".")
+
+# 独自モジュール読み込み
+import app.log as log
+import app.http_client as http_client
+import app.common as common
+from app.ocr.base import OcrBackend
+from app.ocr.batch import MicroBatcher
+logger = log.get_logger("ocr.vision")
+
+# 設定ファイル読み込み
+config = ConfigParser()
+config.read("settings.conf", encoding="utf-8")
+
+##### 設定読み込み ####################
+# OCRに使用するAPIキー
+API_KEY = config.get("detect", "api_key")
+# OCRに使用するAPIのURL
+API_URL = config.get("detect", "ocr_api_url", fallback="https://vision.googleapis.com/v1/images:annotate")
+# 同時に発生したOCR呼出を1回のリクエストにまとめる最大件数 (1 以下でまとめない)
+BATCH_MAX_SIZE = config.getint("detect", "ocr_batch_max_size", fallback=8)
+# 同時に発生したOCR呼出を待ち合わせる最大時間 (ミリ秒)
+BATCH_MAX_WAIT_MS = config.getfloat("detect", "ocr_batch_max_wait_ms", fallback=5.0)
+
+##### 定数定義 ####################
+# OCRに使用するAPIのURL
+OCR_API_URL = f"{API_URL}?key={API_KEY}"
+
+
+class VisionBackend(OcrBackend):
+    """Google Cloud Vision API の TEXT_DETECTION を呼び出すOCRエンジンです。
+    同時に発生した呼出は images:annotate の requests にまとめて1回のリクエストで送信します。
+    """
+
+    name = "vision"
+
+    def __init__(self):
+        self.batcher = None
+        if BATCH_MAX_SIZE > 1:
+            self.batcher = MicroBatcher(self.annotate, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS / 1000)
+
+    def recognize(self, image: common.JpegImage) -> Dict[str, Any]:
+        """Google Cloud Vision API に投げて結果を辞書にして返します。
+        再エンコードによる画質の劣化を避けるため、受け取ったJPEGのバイト列をそのまま送信します。
+
+        Arguments:
+            image {common.JpegImage} -- 解析対象の画像
+
+        Returns:
+            Dict[str, Any] -- Google Cloud Vision API の読み取り結果
+        """
+        if self.batcher is None:
+            return self.annotate([image])[0]
+        return self.batcher.submit(image).result()
+
+    def annotate(self, images: List[common.JpegImage]) -> List[Dict[str, Any]]:
+        """複数の画像を1回のリクエストで Google Cloud Vision API に投げ、画像ごとの結果に分けて返します。
+
+        Arguments:
+            images {List[common.JpegImage]} -- 解析対象の画像のリスト
+
+        Returns:
+            List[Dict[str, Any]] -- 画像と同じ順序で並べた、1件ずつの読み取り結果
+        """
+        response = http_client.post(
+            OCR_API_URL,
+            data=json.dumps({
+                "requests": [
+                    {
+                        "image": {
+                            "content": image.to_base64()
+                        },
+                        "features": [
+                            {
+                                "type": "TEXT_DETECTION"
+                            }
+                        ],
+                        "imageContext": {
+                            "languageHints": ["en"]
+                        }
+                    }
+                    for image in images
+                ]
+            })
+        )
+
+        response_json = response.json()
+
+        response_str = json.dumps(response_json, ensure_ascii=False, indent=4)
+        logger.debug(f"Vision API のレスポンス: {response_str}")
+
+        # リクエスト全体が失敗した場合は、すべての呼出元に同じエラーを返す
+        if "responses" not in response_json:
+            return [response_json for _ in images]
+        return [{"responses": [result]} for result in response_json["responses"]]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """このプロセスにおけるバッチの統計を返します。
+
+        Returns:
+            Dict[str, Any] -- バッチの統計
+        """
+        if self.batcher is None:
+            return {"enabled": False}
+        return dict(enabled=True, **self.batcher.get_stats())
@@ -0,0 +1,91 @@
+###############################################################################
+#    OCRの読み取り結果を画像の内容ごとにキャッシュするモジュール
+#    同じフレームに対して繰り返し OCR API を呼び出すのを防ぎます。
+###############################################################################
+import sys
+import json
+import hashlib
+from typing import Any, Callable, Dict, List, Optional
+from configparser import ConfigParser
+sys.path.insert(0, ".")
+
+# 独自モジュール読み込み
+import app.log as log
+from app.kvstore import TTLStore
+logger = log.get_logger("ocr_cache")
+
+# 設定ファイル読み込み
+config = ConfigParser()
+config.read("settings.conf", encoding="utf-8")
+
+##### 設定読み込み ####################
+# キャッシュを有効にするかどうか
+ENABLED = config.getboolean("detect", "ocr_cache_enabled", fallback=True)
+# キャッシュの保存先となるSQLiteファイルパス
+CACHE_PATH = config.get("detect", "ocr_cache_path", fallback="db/ocr_cache.db")
+# キャッシュの有効期限 (秒)
+TTL_SECONDS = config.getint("detect", "ocr_cache_ttl_seconds", fallback=600)
+# キャッシュの最大件数
+MAX_ENTRIES = config.getint("detect", "ocr_cache_max_entries", fallback=1000)
+
+# 全プロセスで共有するキャッシュ
+_store = TTLStore(CACHE_PATH, "ocr_cache", TTL_SECONDS, MAX_ENTRIES)
+
+
+def get_or_call(image_data, call_ocr: Callable[[], Dict[str, Any]], namespace: str = "") -> Dict[str, Any]:
+    """画像の内容に対応する読み取り結果がキャッシュにあればそれを返し、なければOCRを呼び出して結果をキャッシュします。
+
+    Arguments:
+        image_data -- 画像のバイト列
+        call_ocr {Callable[[], Dict[str, Any]]} -- キャッシュにない場合に呼び出すOCR処理
+
+    Keyword Arguments:
+        namespace {str} -- 読み取り結果を区別するための名前 (OCRエンジン名など) (default: {""})
+
+    Returns:
+        Dict[str, Any] -- Google Cloud Vision API 形式の読み取り結果
+    """
+    if not ENABLED:
+        return call_ocr()
+
+    key = f"{namespace}:{hashlib.sha256(image_data).hexdigest()}"
+    cached = _store.get(key)
+    if cached is not None:
+        _store.increment_counter("hits")
+        logger.debug(f"OCR結果のキャッシュにヒットしました: {key}")
+        return json.loads(cached)
+
+    _store.increment_counter("misses")
+    response_json = call_ocr()
+
+    # エラー応答はキャッシュせず、画像全体のテキストを表す先頭の読み取り結果だけを残す
+    result = response_json.get("responses", [{}])[0]
+    if "error" not in response_json and "error" not in result:
+        cached_json = {
+            "responses": [
+                {"textAnnotations": result.get("textAnnotations", [])[:1]}
+            ]
+        }
+        _store.set(key, json.dumps(cached_json, ensure_ascii=False))
+
+    return response_json
+
+
+def get_stats() -> Dict[str, Any]:
+    """キャッシュのヒット数・ミス数などの統計情報を返します。
+
+    Returns:
+        Dict[str, Any] -- 統計情報
+    """
+    counters = _store.get_counters()
+    hits = counters.get("hits", 0)
+    misses = counters.get("misses", 0)
+    return {
+        "enabled": ENABLED,
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / (hits + misses) if hits + misses > 0 else None,
+        "entries": _store.count(),
+        "max_entries": MAX_ENTRIES,
+        "ttl_seconds": TTL_SECONDS,
+    }
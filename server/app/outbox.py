@@ -0,0 +1,620 @@
+###############################################################################
+#    外部 (Slack) に送信するメッセージを、いったんDBの送信待ち行列 (アウトボックス) に記録してから送信する仕組み
+#    メッセージはきっかけとなったDBの変更と同じトランザクションで記録し、コミット後に送信スレッドが送信します。
+#    送信に失敗したメッセージは指数関数的に間隔を空けて再送し、送信先ごとにトークンバケットで送信頻度を制限します。
+#    同じキーを持つ送信待ちのメッセージは、後から追加された内容で1件にまとめます。
+###############################################################################
+import os
+import sys
+import json
+import time
+import random
+import atexit
+import datetime
+import threading
+import requests
+from datetime import datetime as dt
+from typing import Any, Dict, Optional, Tuple
+from configparser import ConfigParser
+from sqlalchemy import event, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.session import Session
+sys.path.insert(0, ".")
+
+# 独自モジュール読み込み
+import app.log as log
+import app.common as common
+import app.http_client as http_client
+import app.image_store as image_store
+from model.outbox_messages import OutboxMessage
+from model.outbox_rate_limits import OutboxRateLimit
+logger = log.get_logger("outbox")
+
+# 設定ファイル読み込み
+config = ConfigParser()
+config.read("settings.conf", encoding="utf-8")
+
+##### 設定読み込み ####################
+# このプロセスで送信スレッドを動かすかどうか
+DISPATCHER_ENABLED = config.getboolean("outbox", "dispatcher_enabled", fallback=True)
+# 送信待ちのメッセージを確認する間隔 (秒)
+POLL_INTERVAL_SECONDS = config.getfloat("outbox", "poll_interval_seconds", fallback=5.0)
+# 1回の確認で取り出すメッセージの最大数
+BATCH_SIZE = config.getint("outbox", "batch_size", fallback=20)
+# 送信を試みる最大回数 (超えたものは送信失敗として諦める)
+MAX_ATTEMPTS = config.getint("outbox", "max_attempts", fallback=8)
+# 再送までの間隔の初期値 (秒)、失敗するたびに倍にする
+BACKOFF_BASE_SECONDS = config.getfloat("outbox", "backoff_base_seconds", fallback=2.0)
+# 再送までの間隔の上限 (秒)
+BACKOFF_MAX_SECONDS = config.getfloat("outbox", "backoff_max_seconds", fallback=600.0)
+# 送信中のまま応答がないメッセージを再送の対象に戻すまでの秒数
+LEASE_SECONDS = config.getfloat("outbox", "lease_seconds", fallback=60.0)
+# 送信を終えたメッセージを残しておく日数
+RETENTION_DAYS = config.getint("outbox", "retention_days", fallback=7)
+# メッセージを送信するための Slack Incoming Webhook URL
+SLACK_INCOMING_WEBHOOK_URL = config.get("slack", "incoming_webhook_url")
+# Slack API トークン
+SLACK_TOKEN = config.get("slack", "token")
+# Slack Web API のベースURL
+SLACK_API_BASE_URL = config.get("slack", "api_base_url", fallback="https://slack.com/api")
+
+##### 定数定義 ####################
+# メッセージの状態
+STATUS_PENDING = "pending"
+STATUS_SENDING = "sending"
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"
+STATUS_COLLAPSED = "collapsed"
+# 送信先の種類
+DESTINATION_SLACK_WEBHOOK = "slack_webhook"
+DESTINATION_SLACK_FILE_UPLOAD = "slack_file_upload"
+# ファイルアップロードを行うための Slack API エンドポイント
+SLACK_FILE_UPLOAD_URL = f"{SLACK_API_BASE_URL}/files.upload"
+# 送信先から待機時間の指示がない場合に、送信頻度の制限に達したとみなして待つ秒数
+DEFAULT_RETRY_AFTER_SECONDS = 1.0
+# 送信を終えたメッセージの削除を行う間隔 (秒)
+PURGE_INTERVAL_SECONDS = 3600.0
+
+
+class DeliveryError(Exception):
+    """メッセージの送信に失敗したことを表す例外です。
+    """
+
+    def __init__(self, message: str, retryable: bool = True, retry_after: Optional[float] = None):
+        """
+        Arguments:
+            message {str} -- 失敗した原因
+
+        Keyword Arguments:
+            retryable {bool} -- 再送すれば成功する見込みがあるかどうか (default: {True})
+            retry_after {Optional[float]} -- 送信先から指示された、次に送信してよいまでの秒数 (default: {None})
+        """
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+# 送信スレッド
+_dispatcher = None
+_dispatcher_pid = None
+_dispatcher_lock = threading.Lock()
+_wake = threading.Event()
+_stopped = threading.Event()
+_last_purge = 0.0
+
+# このプロセスでの送信結果の統計
+_stats = {"enqueued": 0, "collapsed": 0, "sent": 0, "retried": 0, "failed": 0, "throttled": 0}
+_stats_lock = threading.Lock()
+
+
+def enqueue(session: Session, destination: str, payload: Dict[str, Any], dedupe_key: Optional[str] = None) -> OutboxMessage:
+    """呼出元のトランザクションにメッセージの送信を追加します。
+    トランザクションを確定した時点で送信スレッドに通知され、ロールバックした場合は送信されません。
+    dedupe_key を指定した場合、同じキーの送信待ちのメッセージがあれば、その内容を置き換えて1件にまとめます。
+
+    Arguments:
+        session {Session} -- DB接続セッション
+        destination {str} -- 送信先の種類 (slack_webhook / slack_file_upload)
+        payload {Dict[str, Any]} -- 送信内容
+
+    Keyword Arguments:
+        dedupe_key {Optional[str]} -- 送信待ちのメッセージをまとめるためのキー (default: {None})
+
+    Raises:
+        ValueError -- 未知の送信先が指定された
+
+    Returns:
+        OutboxMessage -- 追加または置き換えたメッセージ
+    """
+    if destination not in DESTINATIONS:
+        raise ValueError(f"未知の送信先が指定されました: {destination}")
+
+    now = dt.now()
+    data = json.dumps(payload, ensure_ascii=False)
+    event.listen(session, "after_commit", _on_commit, once=True)
+
+    if dedupe_key is not None:
+        message = session \
+            .query(OutboxMessage) \
+            .filter(OutboxMessage.dedupe_key == dedupe_key) \
+            .filter(OutboxMessage.status == STATUS_PENDING) \
+            .order_by(OutboxMessage.id.desc()) \
+            .first()
+        if message is not None:
+            logger.info(f"送信待ちのメッセージをまとめます: id={message.id}, dedupe_key={dedupe_key}")
+            message.destination = destination
+            message.payload = data
+            _count("collapsed")
+            return message
+
+    message = OutboxMessage(
+        destination=destination,
+        payload=data,
+        dedupe_key=dedupe_key,
+        status=STATUS_PENDING,
+        attempts=0,
+        next_attempt_time=now,
+        created_time=now
+    )
+    session.add(message)
+    _count("enqueued")
+    return message
+
+
+def post(destination: str, payload: Dict[str, Any], dedupe_key: Optional[str] = None) -> int:
+    """きっかけとなるDBの変更がないメッセージを、単独のトランザクションで送信待ち行列に追加します。
+
+    Arguments:
+        destination {str} -- 送信先の種類 (slack_webhook / slack_file_upload)
+        payload {Dict[str, Any]} -- 送信内容
+
+    Keyword Arguments:
+        dedupe_key {Optional[str]} -- 送信待ちのメッセージをまとめるためのキー (default: {None})
+
+    Returns:
+        int -- メッセージのID
+    """
+    with common.create_session() as session:
+        message = enqueue(session, destination, payload, dedupe_key)
+        session.flush()
+        message_id = message.id
+        session.commit()
+    return message_id
+
+
+def notify():
+    """送信スレッドに送信待ちのメッセージがあることを知らせます。送信スレッドが動いていなければ起動します。
+    """
+    if not DISPATCHER_ENABLED:
+        return
+    start()
+    _wake.set()
+
+
+def dispatch(limit: int = BATCH_SIZE) -> float:
+    """送信期限を迎えたメッセージを古い順に送信します。
+    他のプロセスと同じメッセージを送信しないように、1件ずつ送信中の状態に切り替えてから送信します。
+
+    Keyword Arguments:
+        limit {int} -- 送信するメッセージの最大数 (default: {BATCH_SIZE})
+
+    Returns:
+        float -- 次に送信を試みるまでに待つべき秒数
+    """
+    now = dt.now()
+    with common.create_session() as session:
+        # 送信中のまま応答がないものは、プロセスが途中で終了したとみなして再送の対象に戻す
+        session \
+            .query(OutboxMessage) \
+            .filter(OutboxMessage.status == STATUS_SENDING) \
+            .filter(OutboxMessage.next_attempt_time <= now) \
+            .update({OutboxMessage.status: STATUS_PENDING}, synchronize_session=False)
+        targets = session \
+            .query(OutboxMessage.id, OutboxMessage.destination) \
+            .filter(OutboxMessage.status == STATUS_PENDING) \
+            .filter(OutboxMessage.next_attempt_time <= now) \
+            .order_by(OutboxMessage.next_attempt_time) \
+            .limit(limit) \
+            .all()
+        session.commit()
+
+    # 送信頻度の制限に達した送信先は、この回では以降のメッセージも送らない
+    waits = {}
+    for message_id, destination in targets:
+        if destination in waits:
+            continue
+        wait = _take_token(destination)
+        if wait > 0:
+            _count("throttled")
+            waits[destination] = wait
+            continue
+        message = _claim(message_id)
+        if message is not None:
+            _deliver(*message)
+
+    _purge()
+    if len(waits) > 0:
+        return min(waits.values())
+    if len(targets) == limit:
+        return 0.0
+
+    # 再送を待っているメッセージがあれば、その送信時刻まで待つ
+    with common.create_session() as session:
+        next_attempt_time = session \
+            .query(func.min(OutboxMessage.next_attempt_time)) \
+            .filter(OutboxMessage.status == STATUS_PENDING) \
+            .scalar()
+    if next_attempt_time is None:
+        return POLL_INTERVAL_SECONDS
+    return min(POLL_INTERVAL_SECONDS, max(0.0, (next_attempt_time - dt.now()).total_seconds()))
+
+
+def get_stats() -> Dict[str, Any]:
+    """送信待ちのメッセージの件数と、このプロセスでの送信結果の件数を返します。
+
+    Returns:
+        Dict[str, Any] -- {"pending": xxx, "enqueued": xxx, "sent": xxx, "retried": xxx, "failed": xxx, ...}
+    """
+    with common.create_session() as session:
+        pending = session \
+            .query(func.count(OutboxMessage.id)) \
+            .filter(OutboxMessage.status == STATUS_PENDING) \
+            .scalar()
+    with _stats_lock:
+        return dict(pending=pending, **_stats)
+
+
+def stop(timeout_seconds: float = 5.0):
+    """送信スレッドを停止します。送信中のメッセージがあれば、その送信が終わるまで待ちます。
+    プロセスの終了時に自動的に呼び出されます。
+
+    Keyword Arguments:
+        timeout_seconds {float} -- 停止を待つ最大秒数 (default: {5.0})
+    """
+    _stopped.set()
+    _wake.set()
+    dispatcher = _dispatcher
+    if dispatcher is not None and _dispatcher_pid == os.getpid():
+        dispatcher.join(timeout_seconds)
+
+
+def start():
+    """このプロセスの送信スレッドを起動します。起動済みであれば何もしません。fork 後は起動し直します。
+    前回のプロセスが送信しきれなかったメッセージも、起動した時点から送信されます。
+    """
+    global _dispatcher, _dispatcher_pid
+    if not DISPATCHER_ENABLED:
+        return
+    with _dispatcher_lock:
+        if _dispatcher is not None and _dispatcher_pid == os.getpid() and _dispatcher.is_alive():
+            return
+        _stopped.clear()
+        _dispatcher = threading.Thread(target=_run_dispatcher, name="outbox-dispatcher", daemon=True)
+        _dispatcher.start()
+        _dispatcher_pid = os.getpid()
+
+
+def _run_dispatcher():
+    """停止するまで、送信待ちのメッセージの送信と待機を繰り返します。
+    """
+    logger.info(f"送信スレッドを起動しました")
+    while not _stopped.is_set():
+        # 送信中に追加されたメッセージの通知を取りこぼさないように、送信を始める前に通知を消す
+        _wake.clear()
+        wait = POLL_INTERVAL_SECONDS
+        try:
+            wait = dispatch()
+        except Exception:
+            logger.exception(f"送信待ちのメッセージの送信に失敗しました")
+        finally:
+            # 送信スレッドに紐づいたDB接続セッションを持ち越さない
+            common.remove_session()
+        if wait > 0:
+            _wake.wait(min(wait, POLL_INTERVAL_SECONDS))
+
+
+def _on_commit(session: Session):
+    """メッセージを追加したトランザクションが確定した時点で、送信スレッドに知らせます。
+    """
+    notify()
+
+
+def _take_token(destination: str) -> float:
+    """送信先のトークンバケットからトークンを1つ取り出します。
+    バケットの状態は全プロセスで共有し、補充と取り出しを1文の UPDATE で行います。
+
+    Arguments:
+        destination {str} -- 送信先の種類
+
+    Returns:
+        float -- トークンを取り出せた場合は 0、取り出せなかった場合は次のトークンが補充されるまでの秒数
+    """
+    rate, burst = DESTINATIONS[destination][1:]
+    now = time.time()
+    with common.create_session() as session:
+        refilled = func.min(burst, OutboxRateLimit.tokens + (now - OutboxRateLimit.updated_time) * rate)
+        count = session \
+            .query(OutboxRateLimit) \
+            .filter(OutboxRateLimit.destination == destination) \
+            .filter(refilled >= 1) \
+            .update({OutboxRateLimit.tokens: refilled - 1, OutboxRateLimit.updated_time: now}, synchronize_session=False)
+        if count > 0:
+            session.commit()
+            return 0.0
+
+        bucket = session \
+            .query(OutboxRateLimit) \
+            .filter(OutboxRateLimit.destination == destination) \
+            .one_or_none()
+        if bucket is None:
+            # 初めての送信先は満杯のバケットから始める
+            try:
+                session.add(OutboxRateLimit(destination=destination, tokens=burst - 1, updated_time=now))
+                session.commit()
+                return 0.0
+            except IntegrityError:
+                session.rollback()
+                return 1.0 / rate
+        tokens = min(burst, bucket.tokens + (now - bucket.updated_time) * rate)
+        return max(1.0 / rate / 10, (1 - tokens) / rate)
+
+
+def _penalize(destination: str, retry_after: float):
+    """送信先から待機を指示された場合に、その秒数だけ全プロセスの送信を止めるようにバケットを空にします。
+
+    Arguments:
+        destination {str} -- 送信先の種類
+        retry_after {float} -- 次に送信してよいまでの秒数
+    """
+    rate = DESTINATIONS[destination][1]
+    with common.create_session() as session:
+        session \
+            .query(OutboxRateLimit) \
+            .filter(OutboxRateLimit.destination == destination) \
+            .update({OutboxRateLimit.tokens: -retry_after * rate, OutboxRateLimit.updated_time: time.time()}, synchronize_session=False)
+        session.commit()
+
+
+def _claim(message_id: int) -> Optional[Tuple[int, str, Dict[str, Any], int]]:
+    """メッセージを送信中の状態に切り替えます。
+    同じキーを持つより新しい送信待ちのメッセージがある場合は、送信せずにまとめられたものとして扱います。
+
+    Arguments:
+        message_id {int} -- メッセージのID
+
+    Returns:
+        Optional[Tuple[int, str, Dict[str, Any], int]] -- (ID, 送信先, 送信内容, 送信を試みた回数)、他のプロセスが先に切り替えた場合は None
+    """
+    now = dt.now()
+    with common.create_session() as session:
+        count = session \
+            .query(OutboxMessage) \
+            .filter(OutboxMessage.id == message_id) \
+            .filter(OutboxMessage.status == STATUS_PENDING) \
+            .filter(OutboxMessage.next_attempt_time <= now) \
+            .update({
+                OutboxMessage.status: STATUS_SENDING,
+                OutboxMessage.attempts: OutboxMessage.attempts + 1,
+                OutboxMessage.next_attempt_time: now + datetime.timedelta(seconds=LEASE_SECONDS),
+            }, synchronize_session=False)
+        if count == 0:
+            session.rollback()
+            return None
+
+        message = session.query(OutboxMessage).filter(OutboxMessage.id == message_id).one()
+        result = (message.id, message.destination, json.loads(message.payload), message.attempts)
+
+        # 同時に追加されてまとめきれなかった重複は、新しい方だけを送信する
+        if message.dedupe_key is not None:
+            newer = session \
+                .query(OutboxMessage.id) \
+                .filter(OutboxMessage.dedupe_key == message.dedupe_key) \
+                .filter(OutboxMessage.status == STATUS_PENDING) \
+                .filter(OutboxMessage.id > message_id) \
+                .first()
+            if newer is not None:
+                message.status = STATUS_COLLAPSED
+                session.commit()
+                _count("collapsed")
+                logger.info(f"より新しいメッセージにまとめました: id={message_id} -> id={newer[0]}")
+                return None
+
+        session.commit()
+    return result
+
+
+def _deliver(message_id: int, destination: str, payload: Dict[str, Any], attempts: int):
+    """メッセージを送信し、結果に応じて状態を更新します。
+
+    Arguments:
+        message_id {int} -- メッセージのID
+        destination {str} -- 送信先の種類
+        payload {Dict[str, Any]} -- 送信内容
+        attempts {int} -- 今回を含めた送信を試みた回数
+    """
+    send = DESTINATIONS[destination][0]
+    error = None
+    try:
+        send(payload)
+    except DeliveryError as e:
+        error = e
+    except requests.RequestException as e:
+        error = DeliveryError(f"{type(e).__name__}: {e}")
+
+    values = {}
+    if error is None:
+        values = {OutboxMessage.status: STATUS_SENT, OutboxMessage.sent_time: dt.now()}
+        _count("sent")
+        logger.info(f"メッセージを送信しました: id={message_id}, destination={destination}, attempts={attempts}")
+    elif not error.retryable or MAX_ATTEMPTS <= attempts:
+        values = {OutboxMessage.status: STATUS_FAILED, OutboxMessage.last_error: str(error)}
+        _count("failed")
+        logger.error(f"メッセージの送信を諦めました: id={message_id}, destination={destination}, attempts={attempts}, error={error}")
+    else:
+        delay = _get_backoff_seconds(attempts)
+        if error.retry_after is not None:
+            delay = max(delay, error.retry_after)
+            _penalize(destination, error.retry_after)
+        values = {
+            OutboxMessage.status: STATUS_PENDING,
+            OutboxMessage.next_attempt_time: dt.now() + datetime.timedelta(seconds=delay),
+            OutboxMessage.last_error: str(error),
+        }
+        _count("retried")
+        logger.warning(f"メッセージの送信に失敗したため {delay:.1f} 秒後に再送します: id={message_id}, destination={destination}, attempts={attempts}, error={error}")
+
+    with common.create_session() as session:
+        session \
+            .query(OutboxMessage) \
+            .filter(OutboxMessage.id == message_id) \
+            .filter(OutboxMessage.status == STATUS_SENDING) \
+            .update(values, synchronize_session=False)
+        session.commit()
+
+
+def _get_backoff_seconds(attempts: int) -> float:
+    """再送までの間隔を返します。失敗するたびに倍にし、同時に失敗したメッセージの再送が重ならないように揺らぎを加えます。
+
+    Arguments:
+        attempts {int} -- 送信を試みた回数
+
+    Returns:
+        float -- 再送までの秒数
+    """
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** (attempts - 1)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _purge():
+    """送信を終えてから保持期間を過ぎたメッセージを削除します。一定の間隔をおいて実行します。
+    """
+    global _last_purge
+    if time.monotonic() < _last_purge + PURGE_INTERVAL_SECONDS:
+        return
+    _last_purge = time.monotonic()
+
+    threshold = dt.now() - datetime.timedelta(days=RETENTION_DAYS)
+    with common.create_session() as session:
+        for status in (STATUS_SENT, STATUS_FAILED, STATUS_COLLAPSED):
+            session \
+                .query(OutboxMessage) \
+                .filter(OutboxMessage.status == status) \
+                .filter(OutboxMessage.next_attempt_time < threshold) \
+                .delete(synchronize_session=False)
+        session.commit()
+
+
+def _count(name: str):
+    """送信結果の統計を1つ増やします。
+    """
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _send_slack_webhook(payload: Dict[str, Any]):
+    """Slack Incoming Webhook にメッセージを送信します。
+
+    Arguments:
+        payload {Dict[str, Any]} -- Slack に渡すパラメーター
+
+    Raises:
+        DeliveryError -- 送信に失敗
+    """
+    response = http_client.post(
+        url=SLACK_INCOMING_WEBHOOK_URL,
+        data=json.dumps(payload),
+        headers={"Content-Type": "application/json"}
+    )
+    logger.debug(f"Slack API Response: {response.status_code}\n{response.text}")
+    _raise_for_status(response)
+
+
+def _send_slack_file_upload(payload: Dict[str, Any]):
+    """Slack のチャンネルに商品イメージ画像をアップロードします。
+
+    Arguments:
+        payload {Dict[str, Any]} -- {"image_path": "...", "channels": "...", "filename": "..."}
+
+    Raises:
+        DeliveryError -- 送信に失敗
+    """
+    # POST リクエストパラメーターを生成
+    parameters = {
+        "token": SLACK_TOKEN,
+        "channels": payload["channels"],
+        "filename": payload["filename"],
+    }
+
+    # Slack API に POST する
+    try:
+        f = image_store.open_image(payload["image_path"])
+    except FileNotFoundError:
+        raise DeliveryError(f"アップロードする画像が存在しません: {payload['image_path']}", retryable=False)
+    with f:
+        response = http_client.post(
+            url=SLACK_FILE_UPLOAD_URL,
+            params=parameters,
+            files={"file": f}
+        )
+    logger.debug(f"Slack API Response: {response.status_code}\n{response.text}")
+    _raise_for_status(response)
+
+    # Web API は失敗してもステータスコード 200 で ok: false を返す
+    try:
+        body = response.json()
+    except ValueError:
+        return
+    if not body.get("ok", True):
+        error = body.get("error", "")
+        raise DeliveryError(f"Slack API Error: {error}", retryable=error == "ratelimited", retry_after=_get_retry_after(response) if error == "ratelimited" else None)
+
+
+def _raise_for_status(response: requests.Response):
+    """レスポンスのステータスコードから、送信に失敗したかどうかと再送すべきかどうかを判定します。
+
+    Arguments:
+        response {requests.Response} -- レスポンス
+
+    Raises:
+        DeliveryError -- 送信に失敗
+    """
+    if response.ok:
+        return
+    message = f"HTTP {response.status_code}: {response.text[:200]}"
+    if response.status_code == 429:
+        raise DeliveryError(message, retry_after=_get_retry_after(response))
+    # 送信先の一時的な障害であれば再送し、リクエストの内容に問題があれば諦める
+    raise DeliveryError(message, retryable=response.status_code >= 500 or response.status_code == 408)
+
+
+def _get_retry_after(response: requests.Response) -> float:
+    """送信先から指示された、次に送信してよいまでの秒数を返します。
+
+    Arguments:
+        response {requests.Response} -- レスポンス
+
+    Returns:
+        float -- 秒数
+    """
+    try:
+        return float(response.headers.get("Retry-After", DEFAULT_RETRY_AFTER_SECONDS))
+    except ValueError:
+        return DEFAULT_RETRY_AFTER_SECONDS
+
+
+# 送信先の種類ごとの (送信処理, 1秒あたりに補充するトークン数, バケットの容量)
+DESTINATIONS = {
+    DESTINATION_SLACK_WEBHOOK: (
+        _send_slack_webhook,
+        config.getfloat("outbox", "slack_webhook_rate_per_second", fallback=1.0),
+        config.getfloat("outbox", "slack_webhook_burst", fallback=3.0),
+    ),
+    DESTINATION_SLACK_FILE_UPLOAD: (
+        _send_slack_file_upload,
+        config.getfloat("outbox", "slack_file_upload_rate_per_second", fallback=0.3),
+        config.getfloat("outbox", "slack_file_upload_burst", fallback=3.0),
+    ),
+}
+
+# プロセスの終了時に送信スレッドを止める
+atexit.register(stop)
@@ -0,0 +1,196 @@
+###############################################################################
+#    賞味期限を読み取ってから本登録またはキャンセルされるまでの間、仮登録セッションを保持する仕組み
+#    settings.conf の [detect] temporary_session_store で保存先を選択します。
+#        database: 仮登録テーブル (temporary_products) に保存し、cleanup で古いものを削除
+#        kvstore:  全プロセスで共有する有効期限付きキーバリューストアに保存し、有効期限切れで自動的に削除
+###############################################################################
+import sys
+import uuid
+import threading
+from datetime import datetime as dt
+from typing import Any, Dict, List, Optional
+from configparser import ConfigParser
+from sqlalchemy.orm.session import Session
+sys.path.insert(0, ".")
+
+# 独自モジュール読み込み
+import app.log as log
+import app.common as common
+from app.kvstore import TTLStore
+from model.temporary_products import TemporaryProduct
+logger = log.get_logger("temporary_sessions")
+
+# 設定ファイル読み込み
+config = ConfigParser()
+config.read("settings.conf", encoding="utf-8")
+
+##### 設定読み込み ####################
+# 仮登録セッションの保存先の名前
+STORE_NAME = config.get("detect", "temporary_session_store", fallback="database")
+# 仮登録セッションの保存先となるSQLiteファイルパス (temporary_session_store=kvstore の場合)
+KVSTORE_PATH = config.get("detect", "temporary_session_path", fallback="db/temporary_sessions.db")
+# 仮登録セッションの有効期限 (秒) (temporary_session_store=kvstore の場合)
+KVSTORE_TTL_SECONDS = config.getint("detect", "temporary_session_ttl_seconds", fallback=3600)
+
+# 生成済みの保存先
+_store = None
+_lock = threading.Lock()
+
+
+class TemporarySessionStore(object):
+    """仮登録セッションの保存先の基底クラスです。
+    """
+    name = ""
+
+    def create(self, expiration_date: dt) -> str:
+        """読み取った賞味期限を保存し、新しい仮登録セッションIDを発行します。
+
+        Arguments:
+            expiration_date {dt} -- 賞味期限
+
+        Returns:
+            str -- 仮登録セッションID
+        """
+        raise NotImplementedError()
+
+    def pop(self, session_id: str, session: Optional[Session] = None) -> Optional[dt]:
+        """仮登録セッションを取り出して削除します。
+
+        Arguments:
+            session_id {str} -- 仮登録セッションID
+
+        Keyword Arguments:
+            session {Optional[Session]} -- 本登録と同じトランザクションで削除する場合のDB接続セッション (default: {None})
+
+        Returns:
+            Optional[dt] -- 賞味期限、該当する仮登録セッションがない場合は None
+        """
+        raise NotImplementedError()
+
+    def count(self) -> int:
+        """保持している仮登録セッションの件数を返します。
+
+        Returns:
+            int -- 件数
+        """
+        raise NotImplementedError()
+
+
+class DatabaseSessionStore(TemporarySessionStore):
+    """仮登録テーブルに保存する従来の保存先です。
+    """
+    name = "database"
+
+    def create(self, expiration_date: dt) -> str:
+        session_id = _create_session_id()
+        with common.create_session() as session:
+            session.add(TemporaryProduct(
+                session_id=session_id,
+                expiration_date=expiration_date,
+                created_time=dt.now()
+            ))
+            session.commit()
+        return session_id
+
+    def pop(self, session_id: str, session: Optional[Session] = None) -> Optional[dt]:
+        if session is None:
+            with common.create_session() as session:
+                return self.pop(session_id, session)
+
+        target_temporary_product = session \
+            .query(TemporaryProduct) \
+            .filter(TemporaryProduct.session_id == session_id) \
+            .one_or_none()
+        if target_temporary_product is None:
+            return None
+
+        # 仮登録テーブルから該当レコードを削除 (コミットは呼出元のトランザクションに任せる)
+        expiration_date = target_temporary_product.expiration_date
+        session.delete(target_temporary_product)
+        return expiration_date
+
+    def count(self) -> int:
+        with common.create_session() as session:
+            return session.query(TemporaryProduct).count()
+
+
+class KeyValueSessionStore(TemporarySessionStore):
+    """全プロセスで共有する有効期限付きキーバリューストアに保存する保存先です。
+    本登録されなかったセッションは有効期限切れで自動的に削除されるため、DBへの書き込みは本登録の1回だけになります。
+    """
+    name = "kvstore"
+
+    def __init__(self, path: str, ttl_seconds: float):
+        """
+        Arguments:
+            path {str} -- 保存先のSQLiteファイルパス
+            ttl_seconds {float} -- 仮登録セッションの有効期限 (秒)
+        """
+        self._store = TTLStore(path, "temporary_sessions", ttl_seconds)
+
+    def create(self, expiration_date: dt) -> str:
+        session_id = _create_session_id()
+        self._store.set(session_id, expiration_date.isoformat())
+        return session_id
+
+    def pop(self, session_id: str, session: Optional[Session] = None) -> Optional[dt]:
+        value = self._store.pop(session_id)
+        return None if value is None else dt.fromisoformat(value)
+
+    def count(self) -> int:
+        return self._store.count()
+
+
+def get_store() -> TemporarySessionStore:
+    """設定ファイルで選択された仮登録セッションの保存先を返します。
+    保存先はプロセスごとに一度だけ生成して使い回します。
+
+    Raises:
+        ValueError -- 未知の保存先の名前が指定された
+
+    Returns:
+        TemporarySessionStore -- 仮登録セッションの保存先
+    """
+    global _store
+    with _lock:
+        if _store is None:
+            _store = create_store(STORE_NAME)
+    return _store
+
+
+def create_store(name: str) -> TemporarySessionStore:
+    """名前に対応する仮登録セッションの保存先を生成します。
+
+    Arguments:
+        name {str} -- 保存先の名前 (database / kvstore)
+
+    Raises:
+        ValueError -- 未知の保存先の名前が指定された
+
+    Returns:
+        TemporarySessionStore -- 仮登録セッションの保存先
+    """
+    if name == "database":
+        return DatabaseSessionStore()
+    if name == "kvstore":
+        return KeyValueSessionStore(KVSTORE_PATH, KVSTORE_TTL_SECONDS)
+    raise ValueError(f"未知の仮登録セッションの保存先が指定されました: {name}")
+
+
+def get_stats() -> Dict[str, Any]:
+    """仮登録セッションの保存先と保持している件数を返します。
+
+    Returns:
+        Dict[str, Any] -- {"store": "...", "count": xxx}
+    """
+    store = get_store()
+    return {"store": store.name, "count": store.count()}
+
+
+def _create_session_id() -> str:
+    """新しい仮登録セッションIDを発行します。
+
+    Returns:
+        str -- 仮登録セッションID
+    """
+    return str(uuid.uuid4()).replace("-", "")
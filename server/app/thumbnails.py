@@ -0,0 +1,209 @@
+###############################################################################
+#    本登録済みの商品イメージ画像から、表示先に合わせた縮小版 (サムネイル) を生成する仕組み
+#    縮小版は本登録の直後にバックグラウンドで生成し、まだ生成されていないものは最初に要求された時点で生成します。
+###############################################################################
+import os
+import sys
+import uuid
+import urllib.parse
+import cv2
+import numpy as np
+from typing import Any, Dict, List, Optional
+from configparser import ConfigParser
+sys.path.insert(0, ".")
+
+# 独自モジュール読み込み
+import app.log as log
+logger = log.get_logger("thumbnails")
+
+# 設定ファイル読み込み
+config = ConfigParser()
+config.read("settings.conf", encoding="utf-8")
+
+##### 設定読み込み ####################
+# 生成する縮小版の長辺のピクセル数 (カンマ区切り)
+SIZES = sorted([int(size) for size in config.get("register", "thumbnail_sizes", fallback="160,360,720").split(",") if size.strip() != ""])
+# 縮小版のJPEGの画質
+JPEG_QUALITY = config.getint("register", "thumbnail_jpeg_quality", fallback=80)
+# JPEGに加えて WebP の縮小版も生成するかどうか
+WEBP_ENABLED = config.getboolean("register", "thumbnail_webp_enabled", fallback=False)
+# 縮小版の WebP の画質
+WEBP_QUALITY = config.getint("register", "thumbnail_webp_quality", fallback=75)
+
+##### 定数定義 ####################
+# 縮小版の保管先ディレクトリー名 (元の画像と同じディレクトリーの配下)
+THUMBNAIL_DIRECTORY_NAME = "thumbnails"
+# 縮小版の形式ごとの拡張子とエンコードのパラメーター
+FORMATS = {
+    "jpeg": (".jpg", [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]),
+    "webp": (".webp", [cv2.IMWRITE_WEBP_QUALITY, WEBP_QUALITY]),
+}
+
+
+def get_formats() -> List[str]:
+    """生成する縮小版の形式を返します。
+
+    Returns:
+        List[str] -- 形式の名前 (jpeg / webp)
+    """
+    return ["jpeg", "webp"] if WEBP_ENABLED else ["jpeg"]
+
+
+def select_size(required: int) -> Optional[int]:
+    """長辺が指定したピクセル数以上となる縮小版のうち、最も小さいもののサイズを返します。
+
+    Arguments:
+        required {int} -- 表示先で必要な長辺のピクセル数
+
+    Returns:
+        Optional[int] -- 縮小版の長辺のピクセル数、該当するものがなく元の画像を使うべき場合は None
+    """
+    for size in SIZES:
+        if required <= size:
+            return size
+    return None
+
+
+def get_url(image_url: str, required: int, version: Optional[str] = None) -> str:
+    """表示先で必要な大きさに最も適した縮小版を取得するためのURLを返します。
+
+    Arguments:
+        image_url {str} -- 元の画像を取得するためのURL
+        required {int} -- 表示先で必要な長辺のピクセル数
+
+    Keyword Arguments:
+        version {Optional[str]} -- 元の画像のバージョン、指定すると長期間キャッシュさせるURLになる (default: {None})
+
+    Returns:
+        str -- 縮小版を取得するためのURL、該当するものがない場合は元の画像のURL
+    """
+    parameters = {}
+    size = select_size(required)
+    if size is not None:
+        parameters["size"] = size
+    if version is not None:
+        parameters["v"] = version
+    return image_url if len(parameters) == 0 else f"{image_url}?{urllib.parse.urlencode(parameters)}"
+
+
+def get_variant_path(image_path: str, size: int, format: str = "jpeg") -> str:
+    """縮小版の保管先のファイルパスを返します。
+
+    Arguments:
+        image_path {str} -- 元の画像のファイルパス
+        size {int} -- 縮小版の長辺のピクセル数
+
+    Keyword Arguments:
+        format {str} -- 縮小版の形式 (default: {"jpeg"})
+
+    Returns:
+        str -- 縮小版のファイルパス
+    """
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    return os.path.join(os.path.dirname(image_path), THUMBNAIL_DIRECTORY_NAME, f"{stem}_{size}{FORMATS[format][0]}")
+
+
+def get_or_create(image_path: str, size: int, format: str = "jpeg") -> str:
+    """縮小版の保管先のファイルパスを返します。まだ生成されていない場合はその場で生成します。
+
+    Arguments:
+        image_path {str} -- 元の画像のファイルパス
+        size {int} -- 縮小版の長辺のピクセル数
+
+    Keyword Arguments:
+        format {str} -- 縮小版の形式 (default: {"jpeg"})
+
+    Raises:
+        ValueError -- 設定されていないサイズや形式が指定された、または元の画像を読み取れなかった
+
+    Returns:
+        str -- 縮小版のファイルパス
+    """
+    if size not in SIZES or format not in get_formats():
+        raise ValueError(f"生成できない縮小版が指定されました: size={size}, format={format}")
+
+    variant_path = get_variant_path(image_path, size, format)
+    if not os.path.exists(variant_path):
+        logger.info(f"縮小版を生成します: {os.path.basename(variant_path)}")
+        _write_variant(_read_image(image_path), variant_path, size, format)
+    return variant_path
+
+
+def generate(image_path: str) -> List[str]:
+    """設定されたすべてのサイズと形式の縮小版を生成します。本登録の直後にバックグラウンドで呼び出します。
+
+    Arguments:
+        image_path {str} -- 元の画像のファイルパス
+
+    Returns:
+        List[str] -- 生成した縮小版のファイルパス
+    """
+    pixels = _read_image(image_path)
+    variant_paths = []
+    for format in get_formats():
+        for size in SIZES:
+            variant_path = get_variant_path(image_path, size, format)
+            _write_variant(pixels, variant_path, size, format)
+            variant_paths.append(variant_path)
+    logger.debug(f"縮小版を生成しました: {[os.path.basename(path) for path in variant_paths]}")
+    return variant_paths
+
+
+def remove_variants(image_paths: List[str]):
+    """元の画像に対応する縮小版をすべて削除します。生成されていない縮小版は無視します。
+
+    Arguments:
+        image_paths {List[str]} -- 元の画像のファイルパス
+    """
+    for image_path in image_paths:
+        for format in FORMATS.keys():
+            for size in SIZES:
+                try:
+                    os.remove(get_variant_path(image_path, size, format))
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    logger.exception(f"縮小版を削除できませんでした: {image_path}")
+
+
+def _read_image(image_path: str) -> np.ndarray:
+    """元の画像を読み込みます。
+
+    Arguments:
+        image_path {str} -- 元の画像のファイルパス
+
+    Raises:
+        ValueError -- 画像を読み取れなかった
+
+    Returns:
+        np.ndarray -- OpenCVで扱える形式の画像
+    """
+    pixels = cv2.imread(image_path, cv2.IMREAD_COLOR)
+    if pixels is None:
+        raise ValueError(f"画像を読み取れませんでした: {image_path}")
+    return pixels
+
+
+def _write_variant(pixels: np.ndarray, variant_path: str, size: int, format: str):
+    """長辺が指定したピクセル数になるように縮小して書き出します。元の画像より大きくはしません。
+    書きかけのファイルを返さないように、一時ファイルに書き出してから置き換えます。
+
+    Arguments:
+        pixels {np.ndarray} -- 元の画像
+        variant_path {str} -- 書き出し先のファイルパス
+        size {int} -- 長辺のピクセル数
+        format {str} -- 形式
+    """
+    height, width = pixels.shape[:2]
+    scale = min(1.0, size / max(height, width))
+    if scale < 1.0:
+        pixels = cv2.resize(pixels, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+
+    extension, parameters = FORMATS[format]
+    _, data = cv2.imencode(extension, pixels, parameters)
+
+    os.makedirs(os.path.dirname(variant_path), exist_ok=True)
+    temporary_path = f"{variant_path}.{uuid.uuid4().hex}.tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(data.tobytes())
+    os.replace(temporary_path, variant_path)
@@ -0,0 +1,4 @@
+###############################################################################
+#    性能計測用のスクリプト群
+#    いずれも /server/ 直下を起動ディレクトリーとして python -m benchmark.xxx の形式で実行して下さい。
+###############################################################################
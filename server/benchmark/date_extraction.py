@@ -0,0 +1,116 @@
+###############################################################################
+#    OCRで得られたテキストから賞味期限を抽出する処理の所要時間を、
+#    フォーマットを1つずつ re.match で試す旧実装と比較計測します。
+#    テキスト長を10倍ずつ伸ばしたときに、1文字あたりの所要時間が一定 (線形) であることを確認します。
+#
+#    実行例: python -m benchmark.date_extraction --repeat 20
+###############################################################################
+import sys
+import re
+import json
+import argparse
+import timeit
+import datetime
+import numpy as np
+from datetime import datetime as dt
+from configparser import ConfigParser
+sys.path.insert(0, ".")
+
+from app.date_extractor import DateExtractor
+
+# 計測対象のテキスト長
+TEXT_LENGTHS = [100, 1000, 10000, 100000]
+# ノイズとして混ぜる文字 (数字と区切り文字を多めにして、日付らしい断片が頻繁に現れるようにする)
+NOISE_CHARACTERS = list("0123456789" * 4 + "..//-- " * 3 + "ABCDEFGHIJKLMNOPQRSTUVWXYZ" + "賞味期限製造所")
+
+
+def legacy_find(date_format_patterns, old_limit_days, new_limit_days, found_text):
+    """旧実装: フォーマットごとに .*? 付きの正規表現で先頭から照合し、最初の一致だけを検証します。
+    """
+    for date_format_pattern in date_format_patterns:
+        result = re.match(date_format_pattern, found_text)
+        if not result:
+            continue
+        date_parts = list(result.groups())
+        try:
+            expiration_date = {
+                key: int(date_parts[index]) if index < len(date_parts) else None
+                for index, key in enumerate(["year", "month", "day"])
+            }
+        except ValueError:
+            continue
+        if expiration_date["year"] < 100:
+            upper = int(dt.now().year / 100)
+            lower = dt.now().year % 100
+            if expiration_date["year"] < lower:
+                upper += 1
+            expiration_date["year"] = int(f"{upper:02}{expiration_date['year']:02}")
+        try:
+            if expiration_date["day"] is None:
+                date = dt.strptime(f"{expiration_date['year']}-{expiration_date['month']:02}", "%Y-%m")
+                temp_year = expiration_date["year"]
+                temp_month = expiration_date["month"] + 1
+                if temp_month > 12:
+                    temp_year += 1
+                    temp_month %= 12
+                next_month_date = dt.strptime(f"{temp_year}-{temp_month:02}", "%Y-%m")
+                expiration_date["day"] = (next_month_date - date).days
+            else:
+                date = dt.strptime(f"{expiration_date['year']}-{expiration_date['month']:02}-{expiration_date['day']:02}", "%Y-%m-%d")
+        except ValueError:
+            continue
+        now = dt.now()
+        if date < now and (now - date).days > old_limit_days:
+            continue
+        if now <= date and (date - now).days > new_limit_days:
+            continue
+        return expiration_date
+    return None
+
+
+def create_text(length: int) -> str:
+    """日付らしい断片を多く含むノイズの末尾に、有効な賞味期限を1つだけ置いたテキストを生成します。
+    """
+    random = np.random.RandomState(length)
+    expiration_date = (datetime.date.today() + datetime.timedelta(days=100)).strftime("%Y.%m.%d")
+    noise = "".join(random.choice(NOISE_CHARACTERS, max(length - len(expiration_date) - 1, 0)))
+    # 旧実装と同じく空白を除いた状態にそろえる
+    return (noise + " " + expiration_date).replace(" ", "")
+
+
+def describe(result) -> str:
+    """抽出結果を表示用の文字列にします。旧実装は各フォーマットの最初の一致しか検証しないため、末尾の有効な日付を見落とすことがあります。
+    """
+    return "-" if result is None else f"{result['year']}.{result['month']:02}.{result['day']:02}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=10, help="1ケースあたりの繰り返し回数")
+    parser.add_argument("--settings", default="settings.sample.conf", help="賞味期限フォーマットを読み込む設定ファイル")
+    args = parser.parse_args()
+
+    config = ConfigParser()
+    config.read(args.settings, encoding="utf-8")
+    date_format_patterns = json.loads(config.get("detect", "date_format_patterns"))
+    old_limit_days = int(config.get("detect", "old_limit_days"))
+    new_limit_days = int(config.get("detect", "new_limit_days"))
+    extractor = DateExtractor(date_format_patterns, old_limit_days, new_limit_days)
+
+    print(f"{'chars':>7} {'legacy[ms]':>11} {'legacy[us/char]':>16} {'current[ms]':>12} {'current[us/char]':>17} {'legacy':>12} {'current':>12}")
+    for length in TEXT_LENGTHS:
+        text = create_text(length)
+        legacy_result = legacy_find(date_format_patterns, old_limit_days, new_limit_days, text)
+        current_result = extractor.extract(text)
+
+        legacy_ms = min(timeit.repeat(lambda: legacy_find(date_format_patterns, old_limit_days, new_limit_days, text), number=1, repeat=args.repeat)) * 1000
+        current_ms = min(timeit.repeat(lambda: extractor.extract(text), number=1, repeat=args.repeat)) * 1000
+
+        print(
+            f"{len(text):>7} {legacy_ms:>11.3f} {legacy_ms * 1000 / len(text):>16.3f} "
+            f"{current_ms:>12.3f} {current_ms * 1000 / len(text):>17.3f} {describe(legacy_result):>12} {describe(current_result):>12}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,531 @@
+###############################################################################
+#    サーバー全体のエンドツーエンドの所要時間を計測します。
+#    Google Cloud Vision API と Slack はローカルのスタブ (benchmark/stubs.py) に置き換え、
+#    app/main.py の Flask アプリケーションを実際のHTTPサーバーで起動して各APIを呼び出します。
+#
+#    DBの件数ごとに一時ディレクトリーへ本番と同じ構成 (app, model, migrate へのリンクと設定ファイル) を作り、
+#    別プロセスでマイグレーション・初期データ投入・計測を行います。
+#    結果は p50/p95/p99 とスループットを表示し、--output を指定するとJSONに書き出します。
+#    --baseline に以前の結果を指定すると、同じ条件の結果と比較して表示します。
+#
+#    実行例:
+#        python -m benchmark.e2e --sizes 1000,100000 --output /tmp/e2e.json
+#        python -m benchmark.e2e --vision-latency-ms 300 --baseline /tmp/e2e.json
+###############################################################################
+import os
+import sys
+import json
+import time
+import logging
+import uuid
+import shutil
+import sqlite3
+import argparse
+import platform
+import tempfile
+import datetime
+import threading
+import subprocess
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from configparser import ConfigParser
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import cv2
+import numpy as np
+import requests
+sys.path.insert(0, ".")
+
+import benchmark.stubs as stubs
+
+# server ディレクトリーの実体のパス
+SERVER_DIRECTORY = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+# 一時ディレクトリーから参照させる server ディレクトリー内のディレクトリー
+LINKED_DIRECTORIES = ["app", "model", "migrate", "benchmark"]
+# 計測対象のAPI
+ENDPOINTS = ["detect", "register", "listup", "remind", "command", "cleanup"]
+# /cleanup の1回の呼出の前に投入する削除対象のレコード数
+CLEANUP_BATCH_SIZE = 20
+# SQLite に格納される日時の書式 (SQLAlchemy の DateTime 型と同じ)
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="本登録テーブルの件数 (カンマ区切り)")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="計測対象のAPI (カンマ区切り)")
+    parser.add_argument("--requests", type=int, default=50, help="APIごとのリクエスト数")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時に送るリクエスト数 (/cleanup は常に 1)")
+    parser.add_argument("--max-seconds", type=float, default=60.0, help="APIごとの計測時間の上限 (秒)、超えた時点で以降のリクエストを送らない")
+    parser.add_argument("--settings", default=os.path.join(SERVER_DIRECTORY, "settings.sample.conf"), help="元にする設定ファイル")
+    parser.add_argument("--ocr-cache", action="store_true", help="OCRの読み取り結果のキャッシュを有効にする")
+    parser.add_argument("--log-level", default="WARNING", help="サーバーのログレベル")
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    parser.add_argument("--baseline", help="比較対象とする以前の結果のJSONファイル")
+    parser.add_argument("--keep-workdir", action="store_true", help="計測に使った一時ディレクトリーを残す")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    stubs.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    results = []
+    for size in [int(size) for size in args.sizes.split(",")]:
+        results += run_size(size, args)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(),
+            "git_commit": _get_git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "arguments": {key: value for key, value in vars(args).items() if key not in ("worker", "size")},
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as w:
+            json.dump(report, w, ensure_ascii=False, indent=2)
+        print(f"結果を書き出しました: {args.output}")
+
+    print_results(results, load_baseline(args.baseline))
+
+
+def run_size(size: int, args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """指定された件数のDBを用意した一時ディレクトリーで、別プロセスとして計測を行います。
+
+    Arguments:
+        size {int} -- 本登録テーブルの件数
+        args {argparse.Namespace} -- コマンドライン引数
+
+    Returns:
+        List[Dict[str, Any]] -- APIごとの計測結果
+    """
+    workdir = create_workdir(f"e2e_{size}_", args.log_level)
+    try:
+        print(f"[{size} 件] 計測を開始します: {workdir}", flush=True)
+        output_path = os.path.join(workdir, "result.json")
+        subprocess.run(
+            [sys.executable, "-m", "benchmark.e2e"] + sys.argv[1:] + ["--worker", "--size", str(size), "--output", output_path],
+            cwd=workdir,
+            stdout=subprocess.DEVNULL,
+            check=True
+        )
+        with open(output_path, encoding="utf-8") as f:
+            return json.load(f)
+    finally:
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def create_workdir(prefix: str, log_level: str) -> str:
+    """本番と同じ構成 (app, model, migrate へのリンクと設定ファイル) の一時ディレクトリーを作成します。
+    settings.conf は計測を行うプロセスが write_settings() で書き出します。
+
+    Arguments:
+        prefix {str} -- 一時ディレクトリー名の接頭辞
+        log_level {str} -- サーバーのログレベル
+
+    Returns:
+        str -- 作成した一時ディレクトリーのパス
+    """
+    workdir = tempfile.mkdtemp(prefix=prefix)
+    for name in LINKED_DIRECTORIES:
+        os.symlink(os.path.join(SERVER_DIRECTORY, name), os.path.join(workdir, name))
+    shutil.copy(os.path.join(SERVER_DIRECTORY, "alembic.ini"), workdir)
+    with open(os.path.join(SERVER_DIRECTORY, "logging.ini"), encoding="utf-8") as f:
+        logging_ini = f.read().replace("level=DEBUG", f"level={log_level}")
+    with open(os.path.join(workdir, "logging.ini"), "w", encoding="utf-8") as w:
+        w.write(logging_ini)
+    os.makedirs(os.path.join(workdir, "db", "capture"))
+    return workdir
+
+
+def run_worker(args: argparse.Namespace):
+    """一時ディレクトリー上でスタブとサーバーを起動し、各APIを計測して結果をファイルに書き出します。
+
+    Arguments:
+        args {argparse.Namespace} -- コマンドライン引数
+    """
+    state = stubs.create_state(args)
+    stub_server = stubs.start(state)
+    write_settings(args.settings, f"http://127.0.0.1:{stub_server.server_port}", args.ocr_cache)
+
+    started = time.perf_counter()
+    database_path, seed_image_path = migrate_and_seed(args.size)
+    _log(f"初期データを投入しました: {args.size} 件 ({time.perf_counter() - started:.1f} 秒)")
+
+    # アプリケーションを実際のHTTPサーバーで起動する
+    from werkzeug.serving import make_server
+    from app.main import app
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    context = {
+        "base_url": base_url,
+        "database_path": database_path,
+        "seed_image_path": seed_image_path,
+        "jpeg": cv2.imencode(".jpg", create_label_image())[1].tobytes(),
+    }
+    results = []
+    for endpoint in args.endpoints.split(","):
+        stub_counts = dict(state.counts)
+        result = run_scenario(SCENARIOS[endpoint], context, args)
+        result.update({
+            "db_size": args.size,
+            "endpoint": endpoint,
+            "stub_calls": {
+                name: count - stub_counts.get(name, 0)
+                for name, count in state.counts.items()
+                if count != stub_counts.get(name, 0)
+            },
+        })
+        _log(f"{endpoint}: {result}")
+        results.append(result)
+
+    server.shutdown()
+    stub_server.shutdown()
+    with open(args.output, "w", encoding="utf-8") as w:
+        json.dump(results, w)
+
+
+def write_settings(base_path: str, stub_url: str, ocr_cache: bool):
+    """元の設定ファイルをもとに、外部APIの接続先をスタブに向けた settings.conf を書き出します。
+
+    Arguments:
+        base_path {str} -- 元にする設定ファイル
+        stub_url {str} -- スタブサーバーのURL
+        ocr_cache {bool} -- OCRの読み取り結果のキャッシュを有効にするかどうか
+    """
+    config = ConfigParser()
+    config.read(base_path, encoding="utf-8")
+    overrides = {
+        "detect": {
+            "ocr_backend": "vision",
+            "api_key": "benchmark",
+            "ocr_api_url": f"{stub_url}/v1/images:annotate",
+            "ocr_cache_enabled": str(ocr_cache).lower(),
+        },
+        "register": {
+            "destination_directory_path": os.path.abspath(os.path.join("db", "capture")),
+        },
+        "slack": {
+            "incoming_webhook_url": f"{stub_url}/slack/webhook",
+            "api_base_url": f"{stub_url}/slack/api",
+            "url_name_base": "benchmark.local",
+        },
+    }
+    for section, values in overrides.items():
+        if not config.has_section(section):
+            config.add_section(section)
+        for key, value in values.items():
+            config.set(section, key, value)
+    with open("settings.conf", "w", encoding="utf-8") as w:
+        config.write(w)
+
+
+def migrate_and_seed(size: int) -> Tuple[str, str]:
+    """本番と同じくマイグレーションでテーブルを作成してから、計測用のレコードを投入します。
+
+    Arguments:
+        size {int} -- 本登録テーブルの件数
+
+    Returns:
+        Tuple[str, str] -- (SQLiteファイルのパス, 全レコードで共有する商品イメージ画像のパス)
+    """
+    from alembic.config import main as alembic_main
+    alembic_main(argv=["upgrade", "head"])
+
+    config = ConfigParser()
+    config.read("alembic.ini", encoding="utf-8")
+    database_path = config.get("alembic", "sqlalchemy.url")[len("sqlite:///"):]
+    seed_image_path = os.path.abspath(os.path.join("db", "capture", "seed.jpg"))
+    cv2.imwrite(seed_image_path, create_label_image())
+    seed(database_path, size, seed_image_path)
+    return database_path, seed_image_path
+
+
+def seed(database_path: str, size: int, image_path: str):
+    """本登録テーブルと仮登録テーブルに計測用のレコードを投入します。
+    賞味期限は今日から2年先までに散らばらせ、一部は消費済み・買い物リスト追加済みとします。
+
+    Arguments:
+        database_path {str} -- SQLiteファイルのパス
+        size {int} -- 本登録テーブルの件数
+        image_path {str} -- 全レコードで共有する商品イメージ画像のパス
+    """
+    random = np.random.RandomState(size)
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    now = datetime.datetime.now()
+    chunk_size = 100000
+
+    connection = sqlite3.connect(database_path)
+    with connection:
+        for start in range(0, size, chunk_size):
+            count = min(chunk_size, size - start)
+            expiration_days = random.randint(0, 731, count)
+            created_seconds = random.randint(0, 365 * 24 * 3600, count)
+            consumed = random.random_sample(count) < 0.1
+            added_shopping_list = random.random_sample(count) < 0.05
+            connection.executemany(
+                "INSERT INTO products (image_path, expiration_date, consumed, added_shopping_list, created_time) VALUES (?, ?, ?, ?, ?)",
+                (
+                    (
+                        image_path,
+                        (today + datetime.timedelta(days=int(expiration_days[i]))).strftime(DATETIME_FORMAT),
+                        int(consumed[i]),
+                        int(added_shopping_list[i]),
+                        (now - datetime.timedelta(seconds=int(created_seconds[i]))).strftime(DATETIME_FORMAT),
+                    )
+                    for i in range(count)
+                )
+            )
+        connection.executemany(
+            "INSERT INTO temporary_products (session_id, expiration_date, created_time) VALUES (?, ?, ?)",
+            (
+                (uuid.uuid4().hex, today.strftime(DATETIME_FORMAT), now.strftime(DATETIME_FORMAT))
+                for _ in range(size // 10)
+            )
+        )
+    connection.close()
+
+
+def create_label_image() -> np.ndarray:
+    """賞味期限を印字した商品ラベルを模した画像を生成します。
+    """
+    image = np.full((240, 320, 3), 200, np.uint8)
+    text = (datetime.date.today() + datetime.timedelta(days=100)).strftime("%Y.%m.%d")
+    cv2.putText(image, text, (20, 130), cv2.FONT_HERSHEY_SIMPLEX, 1.4, (20, 20, 20), 3)
+    return image
+
+
+def run_scenario(scenario: Dict[str, Any], context: Dict[str, Any], args: argparse.Namespace) -> Dict[str, Any]:
+    """1つのAPIに対してリクエストを送り、所要時間の分布とスループットを求めます。
+    計測対象のリクエストに必要な準備 (セッションIDの取得など) は計測前にまとめて済ませておきます。
+    リクエストごとに準備が必要なAPIは1件ずつ準備と計測を交互に行い、スループットは計測部分の合計時間から求めます。
+
+    Arguments:
+        scenario {Dict[str, Any]} -- 計測内容
+        context {Dict[str, Any]} -- 計測に必要な情報
+        args {argparse.Namespace} -- コマンドライン引数
+
+    Returns:
+        Dict[str, Any] -- 計測結果
+    """
+    specs = scenario["prepare"](context, args.requests)
+    before_each = scenario.get("before_each")
+    concurrency = 1 if before_each is not None else args.concurrency
+    deadline = time.perf_counter() + args.max_seconds
+    local = threading.local()
+
+    def send(spec: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if deadline < time.perf_counter():
+            return None
+        if before_each is not None:
+            before_each(context)
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            response = local.session.request(url=context["base_url"] + spec.pop("path"), **spec)
+            elapsed = time.perf_counter() - started
+            ok = response.status_code == 200 and _is_success(response)
+        except requests.RequestException:
+            elapsed = time.perf_counter() - started
+            ok = False
+        return {"elapsed": elapsed, "ok": ok}
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        samples = [sample for sample in executor.map(send, specs) if sample is not None]
+    wall_seconds = time.perf_counter() - started
+
+    latencies = np.array([sample["elapsed"] for sample in samples]) * 1000
+    if before_each is not None:
+        wall_seconds = float(latencies.sum()) / 1000
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for sample in samples if not sample["ok"]),
+        "concurrency": concurrency,
+        "p50_ms": float(np.percentile(latencies, 50)) if len(samples) > 0 else None,
+        "p95_ms": float(np.percentile(latencies, 95)) if len(samples) > 0 else None,
+        "p99_ms": float(np.percentile(latencies, 99)) if len(samples) > 0 else None,
+        "mean_ms": float(latencies.mean()) if len(samples) > 0 else None,
+        "max_ms": float(latencies.max()) if len(samples) > 0 else None,
+        "throughput_rps": len(samples) / wall_seconds if 0 < wall_seconds else None,
+    }
+
+
+def _prepare_detect(context: Dict[str, Any], count: int) -> List[Dict[str, Any]]:
+    return [
+        {"method": "POST", "path": "/detect", "data": context["jpeg"], "headers": {"Content-Type": "image/jpeg"}}
+        for _ in range(count)
+    ]
+
+
+def _prepare_register(context: Dict[str, Any], count: int) -> List[Dict[str, Any]]:
+    # 本登録に使うセッションIDを仮登録で発行しておく
+    specs = []
+    with requests.Session() as session:
+        for _ in range(count):
+            session_id = session.post(
+                context["base_url"] + "/detect",
+                data=context["jpeg"],
+                headers={"Content-Type": "image/jpeg"}
+            ).json()["session_id"]
+            specs.append({
+                "method": "POST",
+                "path": f"/register?session_id={session_id}",
+                "data": context["jpeg"],
+                "headers": {"Content-Type": "image/jpeg"},
+            })
+    return specs
+
+
+def _prepare_listup(context: Dict[str, Any], count: int) -> List[Dict[str, Any]]:
+    return [
+        {"method": "POST", "path": "/listup", "data": {"command": "/listup", "text": ""}}
+        for _ in range(count)
+    ]
+
+
+def _prepare_remind(context: Dict[str, Any], count: int) -> List[Dict[str, Any]]:
+    return [
+        {"method": "GET", "path": "/remind?days=3"}
+        for _ in range(count)
+    ]
+
+
+def _prepare_command(context: Dict[str, Any], count: int) -> List[Dict[str, Any]]:
+    # 買い物リストへの追加 (Slack files.upload の呼出を伴う) を未操作の商品に対して行う
+    connection = sqlite3.connect(context["database_path"])
+    product_ids = [
+        row[0]
+        for row in connection.execute(
+            "SELECT id FROM products WHERE added_shopping_list = 0 AND consumed = 0 ORDER BY random() LIMIT ?",
+            (count,)
+        )
+    ]
+    connection.close()
+
+    specs = []
+    for product_id in product_ids:
+        callback_id = f"command_{product_id}"
+        payload = {
+            "callback_id": callback_id,
+            "actions": [{"name": "action", "type": "button", "value": "shoppinglist"}],
+            "original_message": {
+                "text": "あと3日で期限が切れます。",
+                "attachments": [{"callback_id": callback_id}, {"callback_id": "command_0"}],
+            },
+        }
+        specs.append({
+            "method": "POST",
+            "path": "/command",
+            "data": "payload=" + urllib.parse.quote(json.dumps(payload)),
+            "headers": {"Content-Type": "application/x-www-form-urlencoded"},
+        })
+    return specs
+
+
+def _prepare_cleanup(context: Dict[str, Any], count: int) -> List[Dict[str, Any]]:
+    return [
+        {"method": "GET", "path": "/cleanup"}
+        for _ in range(count)
+    ]
+
+
+def insert_cleanup_targets(context: Dict[str, Any]):
+    """/cleanup の削除対象となる期限切れの本登録レコード (画像ファイル付き) と古い仮登録レコードを投入します。
+    """
+    expired = (datetime.datetime.combine(datetime.date.today(), datetime.time()) - datetime.timedelta(days=30)).strftime(DATETIME_FORMAT)
+    directory = os.path.dirname(context["seed_image_path"])
+    rows = []
+    for _ in range(CLEANUP_BATCH_SIZE):
+        image_path = os.path.join(directory, f"{uuid.uuid4().hex}.jpg")
+        shutil.copy(context["seed_image_path"], image_path)
+        rows.append((image_path, expired, 0, 0, expired))
+
+    connection = sqlite3.connect(context["database_path"])
+    with connection:
+        connection.executemany(
+            "INSERT INTO products (image_path, expiration_date, consumed, added_shopping_list, created_time) VALUES (?, ?, ?, ?, ?)",
+            rows
+        )
+        connection.executemany(
+            "INSERT INTO temporary_products (session_id, expiration_date, created_time) VALUES (?, ?, ?)",
+            [(uuid.uuid4().hex, expired, expired) for _ in range(CLEANUP_BATCH_SIZE)]
+        )
+    connection.close()
+
+
+# APIごとの計測内容
+SCENARIOS: Dict[str, Dict[str, Callable]] = {
+    "detect": {"prepare": _prepare_detect},
+    "register": {"prepare": _prepare_register},
+    "listup": {"prepare": _prepare_listup},
+    "remind": {"prepare": _prepare_remind},
+    "command": {"prepare": _prepare_command},
+    "cleanup": {"prepare": _prepare_cleanup, "before_each": insert_cleanup_targets},
+}
+
+
+def load_baseline(path: Optional[str]) -> Dict[tuple, Dict[str, Any]]:
+    """比較対象とする以前の結果を (DB件数, API名) ごとに読み込みます。
+    """
+    if path is None:
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return {(result["db_size"], result["endpoint"]): result for result in json.load(f)["results"]}
+
+
+def print_results(results: List[Dict[str, Any]], baseline: Dict[tuple, Dict[str, Any]]):
+    """計測結果を表形式で表示します。比較対象がある場合は p50/p95 の比率 (今回 / 以前) を併記します。
+    """
+    header = f"{'db_size':>8} {'endpoint':<9} {'n':>4} {'err':>4} {'p50[ms]':>9} {'p95[ms]':>9} {'p99[ms]':>9} {'rps':>8}"
+    if len(baseline) > 0:
+        header += f" {'p50 ratio':>10} {'p95 ratio':>10}"
+    print(header)
+    for result in results:
+        if result["requests"] == 0:
+            print(f"{result['db_size']:>8} {result['endpoint']:<9} {0:>4}")
+            continue
+        line = (
+            f"{result['db_size']:>8} {result['endpoint']:<9} {result['requests']:>4} {result['errors']:>4} "
+            f"{result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f} {result['throughput_rps']:>8.1f}"
+        )
+        previous = baseline.get((result["db_size"], result["endpoint"]))
+        if previous is not None and previous["requests"] > 0:
+            line += f" {result['p50_ms'] / previous['p50_ms']:>9.2f}x {result['p95_ms'] / previous['p95_ms']:>9.2f}x"
+        print(line)
+
+
+def _is_success(response: requests.Response) -> bool:
+    # 処理結果に success を含むAPIは、その値も成否に反映する
+    try:
+        body = response.json()
+    except ValueError:
+        return True
+    return not isinstance(body, dict) or body.get("success", True) is not False
+
+
+def _get_git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=SERVER_DIRECTORY, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True
+        ).stdout.decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _log(message: str):
+    # ワーカープロセスの標準出力は捨てるため、進捗は標準エラー出力に出す
+    print(message, file=sys.stderr, flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+###############################################################################
+#    Slack への送信待ち行列 (app/outbox.py) が、Slack の障害や送信頻度の制限に対して
+#    想定どおりに再送・待機・集約を行うかを、ローカルのスタブ (benchmark/stubs.py) を相手に確認します。
+#
+#    シナリオごとにスタブの応答を切り替えてメッセージを追加し、送信スレッドと同じ処理 (outbox.dispatch) を
+#    送信待ちがなくなるまで繰り返して、スタブが受け取った時刻と回数、メッセージの最終状態を確かめます。
+#
+#    実行例: python -m benchmark.outbox --rate 5 --burst 2 --messages 10
+###############################################################################
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+from configparser import ConfigParser
+from typing import Any, Callable, Dict, List
+sys.path.insert(0, ".")
+
+import benchmark.e2e as e2e
+import benchmark.stubs as stubs
+
+# 1シナリオあたりの待ち時間の上限 (秒)
+SCENARIO_TIMEOUT_SECONDS = 30.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=5.0, help="Incoming Webhook への1秒あたりの送信数")
+    parser.add_argument("--burst", type=int, default=2, help="Incoming Webhook にまとめて送信できる最大数")
+    parser.add_argument("--messages", type=int, default=10, help="送信頻度の確認で追加するメッセージ数")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="HTTP 429 で指示する待機秒数")
+    parser.add_argument("--keep-workdir", action="store_true", help="確認に使った一時ディレクトリーを残す")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        sys.exit(run_worker(args))
+
+    workdir = e2e.create_workdir("outbox_", "WARNING")
+    try:
+        completed = subprocess.run([sys.executable, "-m", "benchmark.outbox"] + sys.argv[1:] + ["--worker"], cwd=workdir)
+    finally:
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(completed.returncode)
+
+
+def run_worker(args: argparse.Namespace) -> int:
+    """一時ディレクトリー上でスタブを起動し、各シナリオを順に確認します。
+
+    Arguments:
+        args {argparse.Namespace} -- コマンドライン引数
+
+    Returns:
+        int -- 終了コード (すべて想定どおりであれば 0)
+    """
+    state = stubs.StubState()
+    stub_server = stubs.start(state)
+    e2e.write_settings(os.path.join(e2e.SERVER_DIRECTORY, "settings.sample.conf"), f"http://127.0.0.1:{stub_server.server_port}", False)
+    write_outbox_settings(args)
+    e2e.migrate_and_seed(0)
+
+    # 送信スレッドは起動せず、このスレッドから送信を進めて時刻を計測する
+    import app.outbox as outbox
+    context = {"outbox": outbox, "state": state, "args": args}
+
+    failures = 0
+    for name, scenario in SCENARIOS:
+        reset(context)
+        started = time.monotonic()
+        try:
+            checks = scenario(context)
+        except Exception as e:
+            checks = [(f"{type(e).__name__}: {e}", False)]
+        elapsed = time.monotonic() - started
+        passed = all([ok for _, ok in checks])
+        failures += 0 if passed else 1
+        print(f"[{'OK' if passed else 'NG'}] {name} ({elapsed:.2f} 秒)")
+        for description, ok in checks:
+            print(f"    {'o' if ok else 'x'} {description}")
+
+    print(f"統計: {json.dumps(outbox.get_stats(), ensure_ascii=False)}")
+    stub_server.shutdown()
+    return 0 if failures == 0 else 1
+
+
+def write_outbox_settings(args: argparse.Namespace):
+    """確認に合わせて短い間隔にした [outbox] の設定を settings.conf に書き加えます。
+
+    Arguments:
+        args {argparse.Namespace} -- コマンドライン引数
+    """
+    config = ConfigParser()
+    config.read("settings.conf", encoding="utf-8")
+    if not config.has_section("outbox"):
+        config.add_section("outbox")
+    values = {
+        "dispatcher_enabled": "false",
+        "poll_interval_seconds": "0.5",
+        "max_attempts": "4",
+        "backoff_base_seconds": "0.2",
+        "backoff_max_seconds": "2.0",
+        "slack_webhook_rate_per_second": str(args.rate),
+        "slack_webhook_burst": str(args.burst),
+        "slack_file_upload_rate_per_second": str(args.rate),
+        "slack_file_upload_burst": str(args.burst),
+    }
+    for key, value in values.items():
+        config.set("outbox", key, value)
+    with open("settings.conf", "w", encoding="utf-8") as w:
+        config.write(w)
+
+
+def reset(context: Dict[str, Any]):
+    """前のシナリオのメッセージとバケット、スタブの記録を消します。
+    """
+    import app.common as common
+    from model.outbox_messages import OutboxMessage
+    from model.outbox_rate_limits import OutboxRateLimit
+    with common.create_session() as session:
+        session.query(OutboxMessage).delete(synchronize_session=False)
+        session.query(OutboxRateLimit).delete(synchronize_session=False)
+        session.commit()
+
+    state = context["state"]
+    state.slack_replay = []
+    state._replay_index["slack"] = 0
+    state.received.clear()
+
+
+def drain(context: Dict[str, Any]):
+    """送信スレッドと同じく、送信待ちのメッセージがなくなるまで送信と待機を繰り返します。
+    """
+    import app.common as common
+    from model.outbox_messages import OutboxMessage
+    outbox = context["outbox"]
+    deadline = time.monotonic() + SCENARIO_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        wait = outbox.dispatch()
+        with common.create_session() as session:
+            remaining = session \
+                .query(OutboxMessage) \
+                .filter(OutboxMessage.status.in_([outbox.STATUS_PENDING, outbox.STATUS_SENDING])) \
+                .count()
+        if remaining == 0:
+            return
+        time.sleep(min(max(wait, 0.01), outbox.POLL_INTERVAL_SECONDS))
+    raise TimeoutError(f"{SCENARIO_TIMEOUT_SECONDS} 秒以内に送信待ちがなくなりませんでした")
+
+
+def get_messages() -> List[Dict[str, Any]]:
+    """送信待ち行列のメッセージをID順に返します。
+    """
+    import app.common as common
+    from model.outbox_messages import OutboxMessage
+    with common.create_session() as session:
+        return [
+            {"id": message.id, "status": message.status, "attempts": message.attempts, "payload": json.loads(message.payload)}
+            for message in session.query(OutboxMessage).order_by(OutboxMessage.id).all()
+        ]
+
+
+def get_intervals(state: stubs.StubState) -> List[float]:
+    """スタブが受け取ったリクエストの間隔を返します。
+    """
+    times = [received["time"] for received in state.received]
+    return [later - earlier for earlier, later in zip(times, times[1:])]
+
+
+def scenario_retry_server_error(context: Dict[str, Any]) -> List[tuple]:
+    """HTTP 500 が続いた後に成功するメッセージは、間隔を空けて再送されて最後に送信済みとなる。
+    """
+    outbox, state = context["outbox"], context["state"]
+    state.slack_replay = [{"status": 500, "body": "error"}, {"status": 503, "body": "error"}, {"status": 200, "body": "ok"}]
+    outbox.post(outbox.DESTINATION_SLACK_WEBHOOK, {"text": "retry"})
+    drain(context)
+
+    messages = get_messages()
+    intervals = get_intervals(state)
+    return [
+        (f"受信回数 3 回: {len(state.received)} 回", len(state.received) == 3),
+        (f"最終状態 sent / 試行 3 回: {messages[0]['status']} / {messages[0]['attempts']} 回", messages[0]["status"] == outbox.STATUS_SENT and messages[0]["attempts"] == 3),
+        (f"再送間隔が広がっている: {[round(interval, 2) for interval in intervals]}", len(intervals) == 2 and outbox.BACKOFF_BASE_SECONDS / 2 <= intervals[0] and outbox.BACKOFF_BASE_SECONDS <= intervals[1]),
+    ]
+
+
+def scenario_retry_after(context: Dict[str, Any]) -> List[tuple]:
+    """HTTP 429 を受けたら、Retry-After の秒数が経つまで同じ送信先には何も送らない。
+    """
+    outbox, state, args = context["outbox"], context["state"], context["args"]
+    state.slack_replay = [{"status": 429, "body": "rate_limited", "headers": {"Retry-After": str(args.retry_after)}}] + [{"status": 200, "body": "ok"}] * 2
+    outbox.post(outbox.DESTINATION_SLACK_WEBHOOK, {"text": "first"})
+    outbox.post(outbox.DESTINATION_SLACK_WEBHOOK, {"text": "second"})
+    drain(context)
+
+    messages = get_messages()
+    intervals = get_intervals(state)
+    return [
+        (f"すべて送信済み: {[message['status'] for message in messages]}", all([message["status"] == outbox.STATUS_SENT for message in messages])),
+        (f"429 の後 {args.retry_after} 秒以上空けて送信: {[round(interval, 2) for interval in intervals]}", len(intervals) > 0 and intervals[0] >= args.retry_after * 0.95),
+    ]
+
+
+def scenario_rate_limit(context: Dict[str, Any]) -> List[tuple]:
+    """まとめて追加したメッセージは、トークンバケットの容量を超えた分が補充の速さに合わせて送信される。
+    """
+    outbox, state, args = context["outbox"], context["state"], context["args"]
+    for i in range(args.messages):
+        outbox.post(outbox.DESTINATION_SLACK_WEBHOOK, {"text": f"message {i}"})
+    drain(context)
+
+    times = [received["time"] for received in state.received]
+    span = times[-1] - times[0] if len(times) > 1 else 0.0
+    expected = (args.messages - args.burst) / args.rate
+    observed_rate = (len(times) - args.burst) / span if span > 0 else float("inf")
+    return [
+        (f"受信回数 {args.messages} 回: {len(times)} 回", len(times) == args.messages),
+        (f"所要時間 {expected:.2f} 秒以上: {span:.2f} 秒 (バースト後 {observed_rate:.2f} 件/秒)", span >= expected * 0.95),
+    ]
+
+
+def scenario_collapse(context: Dict[str, Any]) -> List[tuple]:
+    """同じキーで送信待ちのメッセージは、最後に追加した内容の1件にまとめて送信される。
+    """
+    outbox, state = context["outbox"], context["state"]
+    message_ids = [outbox.post(outbox.DESTINATION_SLACK_WEBHOOK, {"text": f"listup {i}"}, "listup") for i in range(5)]
+    drain(context)
+
+    bodies = [json.loads(received["body"]) for received in state.received]
+    return [
+        (f"同じメッセージにまとめられた: {message_ids}", len(set(message_ids)) == 1),
+        (f"受信回数 1 回で最後の内容: {bodies}", bodies == [{"text": "listup 4"}]),
+    ]
+
+
+def scenario_permanent_failure(context: Dict[str, Any]) -> List[tuple]:
+    """HTTP 400 やアップロードする画像がない場合は再送せずに失敗とし、他のメッセージの送信は続ける。
+    """
+    outbox, state = context["outbox"], context["state"]
+    state.slack_replay = [{"status": 400, "body": "invalid_payload"}, {"status": 200, "body": "ok"}]
+    outbox.post(outbox.DESTINATION_SLACK_WEBHOOK, {"text": "invalid"})
+    outbox.post(outbox.DESTINATION_SLACK_FILE_UPLOAD, {"image_path": os.path.abspath("missing.jpg"), "channels": "shoppinglist", "filename": "missing.jpg"})
+    outbox.post(outbox.DESTINATION_SLACK_WEBHOOK, {"text": "valid"})
+    drain(context)
+
+    messages = get_messages()
+    return [
+        (f"状態 failed / failed / sent: {[message['status'] for message in messages]}", [message["status"] for message in messages] == [outbox.STATUS_FAILED, outbox.STATUS_FAILED, outbox.STATUS_SENT]),
+        (f"失敗したものは1回で諦めた: {[message['attempts'] for message in messages]}", [message["attempts"] for message in messages[:2]] == [1, 1]),
+    ]
+
+
+def scenario_max_attempts(context: Dict[str, Any]) -> List[tuple]:
+    """障害が続く場合は、設定された回数まで試みたところで失敗とする。
+    """
+    outbox, state = context["outbox"], context["state"]
+    state.slack_replay = [{"status": 502, "body": "bad gateway"}]
+    outbox.post(outbox.DESTINATION_SLACK_WEBHOOK, {"text": "unreachable"})
+    drain(context)
+
+    messages = get_messages()
+    return [
+        (f"受信回数 {outbox.MAX_ATTEMPTS} 回: {len(state.received)} 回", len(state.received) == outbox.MAX_ATTEMPTS),
+        (f"最終状態 failed: {messages[0]['status']}", messages[0]["status"] == outbox.STATUS_FAILED),
+    ]
+
+
+# 確認するシナリオ (名前, 確認処理)
+SCENARIOS = [
+    ("HTTP 5xx の再送", scenario_retry_server_error),
+    ("HTTP 429 と Retry-After", scenario_retry_after),
+    ("送信頻度の制限", scenario_rate_limit),
+    ("重複の集約", scenario_collapse),
+    ("再送しない失敗", scenario_permanent_failure),
+    ("試行回数の上限", scenario_max_attempts),
+]
+
+
+if __name__ == "__main__":
+    main()
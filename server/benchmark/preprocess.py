@@ -0,0 +1,114 @@
+###############################################################################
+#    OCR前の前処理によって賞味期限の読み取り率が変わらないことを確認し、
+#    OCRに渡すデータ量と所要時間を前処理の有無で比較します。
+#
+#    コーパスのファイル名は "<期待する賞味期限 yyyy-mm-dd>_<任意の文字列>.jpg" とします。
+#    実際の撮影画像を集めたディレクトリーを指定するか、--generate で合成画像のコーパスを生成して使用します。
+#
+#    実行例:
+#        python -m benchmark.preprocess --generate /tmp/corpus
+#        python -m benchmark.preprocess --corpus /tmp/corpus
+###############################################################################
+import os
+import sys
+import glob
+import time
+import argparse
+import datetime
+import cv2
+import numpy as np
+sys.path.insert(0, ".")
+
+import app.common as common
+import app.ocr as ocr
+import app.ocr.preprocess as preprocess
+import app.api.detect as detect
+
+# 合成画像に描画する賞味期限の表記
+DATE_FORMATS = ["%Y.%m.%d", "%y.%m.%d", "%Y.%m", "%y. %m. %d"]
+
+
+def generate_corpus(directory: str, count: int):
+    """賞味期限を印字した商品ラベルを模した合成画像のコーパスを生成します。
+    """
+    os.makedirs(directory, exist_ok=True)
+    random = np.random.RandomState(0)
+    today = datetime.date.today()
+    for i in range(count):
+        width, height = [(320, 240), (640, 480)][i % 2]
+        expiration_date = today + datetime.timedelta(days=int(random.randint(1, 365)))
+        date_format = DATE_FORMATS[i % len(DATE_FORMATS)]
+        if "%d" not in date_format:
+            # 日が省略された表記は月末として読み取られる
+            expiration_date = (expiration_date.replace(day=28) + datetime.timedelta(days=4)).replace(day=1) - datetime.timedelta(days=1)
+
+        # 背景色とノイズの上に、ランダムな位置・大きさで賞味期限を描画する
+        background = random.randint(120, 256, 3)
+        image = np.clip(
+            np.full((height, width, 3), background, np.float32) + random.normal(0, 12, (height, width, 3)),
+            0, 255
+        ).astype(np.uint8)
+        font_scale = width / 320 * random.uniform(0.6, 1.0)
+        text = expiration_date.strftime(date_format)
+        (text_width, text_height), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, 2)
+        x = int(random.randint(0, max(width - text_width, 1)))
+        y = int(random.randint(text_height, height))
+        cv2.putText(image, text, (x, y), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (20, 20, 20), 2)
+
+        path = os.path.join(directory, f"{expiration_date.isoformat()}_{i:03}.jpg")
+        cv2.imwrite(path, image, [cv2.IMWRITE_JPEG_QUALITY, 80])
+    print(f"{count} 件の合成画像を生成しました: {directory}")
+
+
+def evaluate(paths, backend, use_preprocess: bool):
+    """コーパス全体を読み取り、正解数・OCRに渡したデータ量・所要時間を集計します。
+    """
+    correct = 0
+    total_bytes = 0
+    total_seconds = 0.0
+    for path in paths:
+        expected = os.path.basename(path).split("_")[0]
+        with open(path, "rb") as f:
+            image = common.JpegImage(np.frombuffer(f.read(), np.uint8))
+
+        start = time.perf_counter()
+        target = preprocess.apply(image) if use_preprocess else image
+        response_json = backend.recognize(target)
+        total_seconds += time.perf_counter() - start
+        total_bytes += len(target.data)
+
+        expiration_date = detect._find_expiration_date(detect._extract_text_from_ocr_result(response_json))
+        if expiration_date is not None and detect.to_datetime(expiration_date).date().isoformat() == expected:
+            correct += 1
+    return correct, total_bytes, total_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", help="コーパスのディレクトリー")
+    parser.add_argument("--generate", help="合成画像のコーパスを生成するディレクトリー")
+    parser.add_argument("--count", type=int, default=40, help="生成する合成画像の件数")
+    args = parser.parse_args()
+
+    if args.generate:
+        generate_corpus(args.generate, args.count)
+        return
+
+    paths = sorted(glob.glob(os.path.join(args.corpus, "*.jpg")))
+    backend = ocr.get_backend()
+    if len(preprocess.STAGE_NAMES) == 0:
+        print("settings.conf の [detect] preprocess_stages に前処理が指定されていません")
+        return
+
+    print(f"OCRエンジン: {backend.name}, 前処理: {preprocess.STAGE_NAMES}, 件数: {len(paths)}")
+    print(f"{'mode':<12} {'accuracy':>9} {'avg bytes':>10} {'avg ms':>8}")
+    for label, use_preprocess in [("original", False), ("preprocess", True)]:
+        correct, total_bytes, total_seconds = evaluate(paths, backend, use_preprocess)
+        print(
+            f"{label:<12} {correct / len(paths):>9.1%} "
+            f"{total_bytes / len(paths):>10.0f} {total_seconds / len(paths) * 1000:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+###############################################################################
+#    各APIが発行するクエリーが、テーブルの全件走査や一時的なソートを伴わずにインデックスを使うことを確認します。
+#    マイグレーションを適用した一時DBに対して実際に各APIを呼び出し、発行されたクエリーを
+#    EXPLAIN QUERY PLAN にかけます。インデックスを使わないクエリーがあれば終了コード 1 で終了します。
+#
+#    実行例: python -m benchmark.query_plan
+###############################################################################
+import os
+import re
+import sys
+import json
+import shutil
+import sqlite3
+import argparse
+import subprocess
+import urllib.parse
+from configparser import ConfigParser
+from typing import Any, Dict, List
+sys.path.insert(0, ".")
+
+import benchmark.e2e as e2e
+import benchmark.stubs as stubs
+
+# 検証時に投入する本登録テーブルの件数
+SEED_SIZE = 2000
+# インデックスを使っていないことを表す実行計画
+FULL_SCAN_PATTERN = re.compile(r"^SCAN (TABLE )?(products|temporary_products|outbox_messages|outbox_rate_limits)( AS \w+)?$")
+TEMP_SORT_PATTERN = re.compile(r"^USE TEMP B-TREE FOR ORDER BY$")
+# 実行計画を検証する対象のテーブル
+TABLES = ("products", "temporary_products", "outbox_messages", "outbox_rate_limits")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        sys.exit(run_worker())
+
+    workdir = e2e.create_workdir("query_plan_", "WARNING")
+    try:
+        result = subprocess.run([sys.executable, "-m", "benchmark.query_plan", "--worker"], cwd=workdir, stdout=subprocess.DEVNULL)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(result.returncode)
+
+
+def run_worker() -> int:
+    """一時ディレクトリー上で各APIを呼び出し、発行されたクエリーの実行計画を検証します。
+
+    Returns:
+        int -- 終了コード (すべてのクエリーがインデックスを使っていれば 0)
+    """
+    stub_server = stubs.start(stubs.StubState())
+    e2e.write_settings(e2e.SERVER_DIRECTORY + "/settings.sample.conf", f"http://127.0.0.1:{stub_server.server_port}", False)
+    _disable_outbox_dispatcher()
+    database_path, seed_image_path = e2e.migrate_and_seed(SEED_SIZE)
+
+    # 各APIが発行するクエリーを記録する
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    statements = {}
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def _capture(connection, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().split(" ")[0] in ("SELECT", "UPDATE", "DELETE"):
+            statements.setdefault(statement, (api_name, parameters))
+
+    from app.main import app
+    client = app.test_client()
+    jpeg = open(seed_image_path, "rb").read()
+    product_id = sqlite3.connect(database_path).execute(
+        "SELECT id FROM products WHERE consumed = 0 AND added_shopping_list = 0 LIMIT 1"
+    ).fetchone()[0]
+
+    api_name = "detect"
+    session_id = client.post("/detect", data=jpeg, content_type="image/jpeg").get_json()["session_id"]
+    api_name = "register"
+    client.post(f"/register?session_id={session_id}", data=jpeg, content_type="image/jpeg")
+    api_name = "cancel"
+    session_id = client.post("/detect", data=jpeg, content_type="image/jpeg").get_json()["session_id"]
+    client.post("/cancel", json={"session_id": session_id})
+    api_name = "capture"
+    cancel_token = client.post("/capture", data=jpeg, content_type="image/jpeg").get_json()["cancel_token"]
+    api_name = "capture_cancel"
+    client.post("/capture/cancel", json={"cancel_token": cancel_token})
+    api_name = "listup"
+    client.post("/listup", data={"command": "/listup", "text": ""})
+    api_name = "remind"
+    client.get("/remind?days=3")
+    api_name = "command"
+    callback_id = f"command_{product_id}"
+    payload = {
+        "callback_id": callback_id,
+        "actions": [{"name": "action", "value": "shoppinglist"}],
+        "original_message": {"text": "", "attachments": [{"callback_id": callback_id}]},
+    }
+    client.post(
+        "/command",
+        data="payload=" + urllib.parse.quote(json.dumps(payload)),
+        content_type="application/x-www-form-urlencoded"
+    )
+    api_name = "cleanup"
+    e2e.insert_cleanup_targets({"database_path": database_path, "seed_image_path": seed_image_path})
+    client.get("/cleanup")
+    api_name = "outbox"
+    import app.outbox as outbox
+    outbox.dispatch()
+    outbox.get_stats()
+    stub_server.shutdown()
+
+    # 記録したクエリーの実行計画を検証する
+    connection = sqlite3.connect(database_path)
+    failures = 0
+    for statement, (name, parameters) in statements.items():
+        plan = [row[3] for row in connection.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+        if not any(table in statement for table in TABLES):
+            continue
+        ok = not any(FULL_SCAN_PATTERN.match(detail) or TEMP_SORT_PATTERN.match(detail) for detail in plan)
+        failures += 0 if ok else 1
+        print(f"[{'OK' if ok else 'NG'}] {name}: {' '.join(statement.split())}", file=sys.stderr)
+        for detail in plan:
+            print(f"    {detail}", file=sys.stderr)
+
+    print(f"{len(statements)} 件のクエリーのうち、インデックスを使わないもの: {failures} 件", file=sys.stderr)
+    return 1 if failures > 0 else 0
+
+
+def _disable_outbox_dispatcher():
+    """送信待ち行列のクエリーを呼出元のAPIと区別して記録するため、送信スレッドを起動しないように settings.conf を書き換えます。
+    送信はすべてのAPIを呼び出した後に outbox.dispatch() で行います。
+    """
+    config = ConfigParser()
+    config.read("settings.conf", encoding="utf-8")
+    if not config.has_section("outbox"):
+        config.add_section("outbox")
+    config.set("outbox", "dispatcher_enabled", "false")
+    with open("settings.conf", "w", encoding="utf-8") as w:
+        config.write(w)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+###############################################################################
+#    M5Stackの従来形式 {"image": [uint8, ...]} のリクエストボディを
+#    JPEG画像のバイト列に変換する処理の所要時間を、旧実装と比較計測します。
+#
+#    実行例: python -m benchmark.request_image --repeat 200
+###############################################################################
+import sys
+import json
+import argparse
+import timeit
+import cv2
+import numpy as np
+from typing import Tuple
+sys.path.insert(0, ".")
+
+import app.common as common
+
+# 計測対象のフレームサイズ
+FRAME_SIZES = {
+    "QVGA": (320, 240),
+    "VGA": (640, 480),
+}
+
+
+def legacy_convert(body: bytes) -> np.ndarray:
+    """旧実装: request.json によるデコード → json.dumps → np.fromstring の往復で変換します。
+    """
+    request_image = json.loads(body)["image"]
+    image_string = json.dumps(request_image, separators=(",", ":")).strip("[]")
+    return np.fromstring(image_string, np.uint8, sep=",")
+
+
+def current_convert(body: bytes) -> np.ndarray:
+    """現行実装: リクエストボディから画像の配列部分だけを一括で変換します。
+    """
+    return common.parse_legacy_image_array(body)
+
+
+def create_request_body(width: int, height: int) -> Tuple[bytes, bytes]:
+    """M5Stackのファームウェアと同じ書式のリクエストボディを生成します。
+    JPEG圧縮後のサイズが実際の撮影画像に近づくよう、ノイズを含む画像を使用します。
+
+    Returns:
+        Tuple[bytes, bytes] -- (リクエストボディ, 変換結果と比較するための元のJPEG画像のバイト列)
+    """
+    random = np.random.RandomState(0)
+    image = cv2.GaussianBlur(random.randint(0, 256, (height, width, 3), dtype=np.uint8), (5, 5), 0)
+    cv2.putText(image, "2020.12.31", (width // 8, height // 2), cv2.FONT_HERSHEY_SIMPLEX, width / 320, (0, 0, 0), 2)
+    _, jpeg = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 80])
+    return ("{\"image\":[" + ",".join(str(value) for value in jpeg.tobytes()) + "]}").encode("utf-8"), jpeg.tobytes()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=100, help="1ケースあたりの繰り返し回数")
+    args = parser.parse_args()
+
+    print(f"{'frame':<6} {'jpeg[B]':>9} {'body[B]':>9} {'legacy[ms]':>11} {'current[ms]':>12} {'speedup':>8}")
+    for name, (width, height) in FRAME_SIZES.items():
+        body, jpeg = create_request_body(width, height)
+
+        # 変換結果が旧実装と一致することを確認してから計測する
+        assert legacy_convert(body).tobytes() == jpeg
+        assert current_convert(body).tobytes() == jpeg
+
+        legacy_ms = min(timeit.repeat(lambda: legacy_convert(body), number=1, repeat=args.repeat)) * 1000
+        current_ms = min(timeit.repeat(lambda: current_convert(body), number=1, repeat=args.repeat)) * 1000
+        print(f"{name:<6} {len(jpeg):>9} {len(body):>9} {legacy_ms:>11.3f} {current_ms:>12.3f} {legacy_ms / current_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+###############################################################################
+#    複数のプロセス・スレッドから同時にSQLiteへ書き込んだときのスループットとロックエラーの件数を、
+#    SQLiteのチューニングプロファイル ([database] sqlite_profile) ごとに計測します。
+#    本番 (mod_wsgi の processes × threads) と同じく、プロセスごとに app/common.py のエンジンを使い、
+#    書き込みスレッドが detect → register と同じ順序で仮登録・本登録のトランザクションを繰り返し、
+#    読み取りスレッドが listup と同じく未消費の商品を賞味期限の近い順に読み出し続けます。
+#
+#    実行例: python -m benchmark.sqlite_contention --profiles none,safe,fast --processes 4 --threads 20
+###############################################################################
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import argparse
+import threading
+import subprocess
+import multiprocessing
+from configparser import ConfigParser
+from typing import Any, Dict, List
+import numpy as np
+sys.path.insert(0, ".")
+
+import benchmark.e2e as e2e
+
+# 計測前に投入しておく本登録テーブルの件数
+SEED_SIZE = 10000
+# 読み取りスレッドが1回に読み出す件数
+READ_LIMIT = 100
+# ロックの競合によるエラーを表すメッセージ
+LOCKED_MESSAGES = ["database is locked", "database table is locked"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profiles", default="none,safe,fast", help="計測するプロファイル名 (カンマ区切り、none はプラグマを適用しない従来の動作)")
+    parser.add_argument("--processes", type=int, default=4, help="書き込みを行うプロセス数")
+    parser.add_argument("--threads", type=int, default=20, help="プロセスあたりの書き込みスレッド数")
+    parser.add_argument("--readers", type=int, default=4, help="プロセスあたりの読み取りスレッド数")
+    parser.add_argument("--seconds", type=float, default=10.0, help="1プロファイルあたりの計測秒数")
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--profile", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    results = []
+    for profile in args.profiles.split(","):
+        workdir = e2e.create_workdir("sqlite_contention_", "WARNING")
+        try:
+            subprocess.run(
+                [
+                    sys.executable, "-m", "benchmark.sqlite_contention", "--worker", "--profile", profile,
+                    "--processes", str(args.processes), "--threads", str(args.threads), "--readers", str(args.readers),
+                    "--seconds", str(args.seconds),
+                ],
+                cwd=workdir, stdout=subprocess.DEVNULL, check=True
+            )
+            with open(os.path.join(workdir, "result.json"), encoding="utf-8") as f:
+                results.append(json.load(f))
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'profile':<8} {'commits':>8} {'tx/s':>8} {'reads':>7} {'locked':>7} {'errors':>7} {'p50[ms]':>8} {'p95[ms]':>8} {'p99[ms]':>8}")
+    for result in results:
+        print(
+            f"{result['profile']:<8} {result['commits']:>8} {result['throughput_tps']:>8.1f} {result['reads']:>7} {result['locked']:>7} "
+            f"{result['errors']:>7} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f}"
+        )
+
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as w:
+            json.dump(results, w, ensure_ascii=False, indent=2)
+
+
+def run_worker(args: argparse.Namespace):
+    """一時ディレクトリー上で指定したプロファイルの設定ファイルとDBを用意し、書き込みの競合を計測します。
+
+    Arguments:
+        args {argparse.Namespace} -- コマンドライン引数
+    """
+    e2e.write_settings(e2e.SERVER_DIRECTORY + "/settings.sample.conf", "http://127.0.0.1:9", False)
+    config = ConfigParser()
+    config.read("settings.conf", encoding="utf-8")
+    if not config.has_section("database"):
+        config.add_section("database")
+    config.set("database", "sqlite_profile", args.profile)
+    with open("settings.conf", "w", encoding="utf-8") as w:
+        config.write(w)
+    e2e.migrate_and_seed(SEED_SIZE)
+
+    # 本番の mod_wsgi と同じく、親プロセスではDBに接続せずにプロセスを分ける
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    deadline = time.time() + args.seconds
+    processes = [context.Process(target=run_process, args=(args.threads, args.readers, deadline, queue)) for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    outcomes = [queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    latencies = np.array(sum([outcome["latencies"] for outcome in outcomes], [])) * 1000
+    result = {
+        "profile": args.profile,
+        "processes": args.processes,
+        "threads": args.threads,
+        "readers": args.readers,
+        "seconds": args.seconds,
+        "commits": len(latencies),
+        "reads": sum([outcome["reads"] for outcome in outcomes]),
+        "locked": sum([outcome["locked"] for outcome in outcomes]),
+        "errors": sum([outcome["errors"] for outcome in outcomes]),
+        "throughput_tps": float(len(latencies) / args.seconds),
+        "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) > 0 else 0.0,
+        "p95_ms": float(np.percentile(latencies, 95)) if len(latencies) > 0 else 0.0,
+        "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) > 0 else 0.0,
+    }
+    with open("result.json", "w", encoding="utf-8") as w:
+        json.dump(result, w)
+
+
+def run_process(threads: int, readers: int, deadline: float, queue: multiprocessing.Queue):
+    """1プロセス分のスレッドを起動して、期限まで書き込みと読み取りを繰り返します。
+
+    Arguments:
+        threads {int} -- 書き込みスレッド数
+        readers {int} -- 読み取りスレッド数
+        deadline {float} -- 書き込みを終える時刻 (time.time() の値)
+        queue {multiprocessing.Queue} -- 結果を親プロセスへ返すキュー
+    """
+    outcome = {"latencies": [], "reads": 0, "locked": 0, "errors": 0}
+    lock = threading.Lock()
+    workers = [threading.Thread(target=run_thread, args=(deadline, outcome, lock)) for _ in range(threads)]
+    workers += [threading.Thread(target=run_reader, args=(deadline, outcome, lock)) for _ in range(readers)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    queue.put(outcome)
+
+
+def run_thread(deadline: float, outcome: Dict[str, Any], lock: threading.Lock):
+    """期限まで仮登録と本登録のトランザクションを繰り返し、所要時間とエラーの件数を記録します。
+
+    Arguments:
+        deadline {float} -- 書き込みを終える時刻 (time.time() の値)
+        outcome {Dict[str, Any]} -- 結果の格納先
+        lock {threading.Lock} -- 結果の格納先を保護するロック
+    """
+    import datetime
+    from datetime import datetime as dt
+    import app.common as common
+    from model.temporary_products import TemporaryProduct
+    from model.products import Product
+
+    while time.time() < deadline:
+        session_id = str(uuid.uuid4())
+        expiration_date = dt.combine(datetime.date.today() + datetime.timedelta(days=100), datetime.time())
+        started = time.perf_counter()
+        try:
+            # detect: 仮登録
+            with common.create_session() as session:
+                session.add(TemporaryProduct(session_id=session_id, expiration_date=expiration_date, created_time=dt.now()))
+
+            # register: 仮登録を本登録に移す
+            with common.create_session() as session:
+                temporary_product = session \
+                    .query(TemporaryProduct) \
+                    .filter(TemporaryProduct.session_id == session_id) \
+                    .one()
+                session.add(Product(
+                    image_path="benchmark.jpg",
+                    expiration_date=temporary_product.expiration_date,
+                    consumed=False,
+                    added_shopping_list=False,
+                    created_time=dt.now()
+                ))
+                session.delete(temporary_product)
+            elapsed = time.perf_counter() - started
+            with lock:
+                outcome["latencies"].append(elapsed)
+        except Exception as e:
+            with lock:
+                if any(message in str(e) for message in LOCKED_MESSAGES):
+                    outcome["locked"] += 1
+                else:
+                    outcome["errors"] += 1
+        finally:
+            common.remove_session()
+
+
+def run_reader(deadline: float, outcome: Dict[str, Any], lock: threading.Lock):
+    """期限まで未消費の商品を賞味期限順に読み出し続け、読み取りの件数とエラーの件数を記録します。
+
+    Arguments:
+        deadline {float} -- 読み取りを終える時刻 (time.time() の値)
+        outcome {Dict[str, Any]} -- 結果の格納先
+        lock {threading.Lock} -- 結果の格納先を保護するロック
+    """
+    import app.common as common
+    from model.products import Product
+
+    while time.time() < deadline:
+        try:
+            with common.create_session() as session:
+                session \
+                    .query(Product) \
+                    .filter(Product.consumed == False) \
+                    .filter(Product.added_shopping_list == False) \
+                    .order_by(Product.expiration_date) \
+                    .limit(READ_LIMIT) \
+                    .all()
+            with lock:
+                outcome["reads"] += 1
+        except Exception as e:
+            with lock:
+                if any(message in str(e) for message in LOCKED_MESSAGES):
+                    outcome["locked"] += 1
+                else:
+                    outcome["errors"] += 1
+        finally:
+            common.remove_session()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+###############################################################################
+#    Google Cloud Vision API と Slack の代わりに応答するローカルのスタブサーバー
+#    外部にトラフィックを送らずにサーバー全体の所要時間を計測するために使用します。
+#
+#    エンドポイント:
+#        POST /v1/images:annotate  Vision API (images:annotate)
+#        POST /slack/webhook       Slack Incoming Webhook
+#        POST /slack/api/<method>  Slack Web API (files.upload など)
+#
+#    応答を再生するファイル (--vision-replay / --slack-replay) にはJSON配列を記載し、先頭から順に繰り返し返します。
+#        Vision: images:annotate の responses[] の要素 (1画像分の読み取り結果) の配列
+#        Slack:  {"status": 200, "body": "...", "headers": {"Retry-After": "1"}} の配列 (headers は省略可)
+#
+#    実行例: python -m benchmark.stubs --port 8080 --vision-latency-ms 300 --slack-latency-ms 100
+###############################################################################
+import sys
+import json
+import time
+import argparse
+import datetime
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+
+class StubState(object):
+    """スタブの応答内容と呼出回数を保持するクラスです。
+    """
+
+    def __init__(self, vision_latency_seconds: float = 0.0, slack_latency_seconds: float = 0.0,
+                 vision_replay: Optional[List[Dict[str, Any]]] = None, slack_replay: Optional[List[Dict[str, Any]]] = None,
+                 vision_text: Optional[str] = None):
+        """
+        Keyword Arguments:
+            vision_latency_seconds {float} -- Vision API の応答までに待つ秒数 (default: {0.0})
+            slack_latency_seconds {float} -- Slack の応答までに待つ秒数 (default: {0.0})
+            vision_replay {Optional[List[Dict[str, Any]]]} -- Vision API の1画像分の読み取り結果を順に返す場合のリスト (default: {None})
+            slack_replay {Optional[List[Dict[str, Any]]]} -- Slack の応答を順に返す場合のリスト (default: {None})
+            vision_text {Optional[str]} -- 再生しない場合に読み取り結果として返すテキスト (default: {None} で100日後の日付)
+        """
+        self.vision_latency_seconds = vision_latency_seconds
+        self.slack_latency_seconds = slack_latency_seconds
+        self.vision_replay = vision_replay or []
+        self.slack_replay = slack_replay or []
+        if vision_text is None:
+            vision_text = (datetime.date.today() + datetime.timedelta(days=100)).strftime("賞味期限\n%Y.%m.%d")
+        self.vision_text = vision_text
+        self.counts = {}
+        self.received = []
+        self._lock = threading.Lock()
+        self._replay_index = {"vision": 0, "slack": 0}
+
+    def count(self, name: str) -> int:
+        """呼出回数を1つ増やし、増やす前の回数を返します。
+        """
+        with self._lock:
+            number = self.counts.get(name, 0)
+            self.counts[name] = number + 1
+            return number
+
+    def record(self, name: str, body: bytes):
+        """Slack が受け取ったリクエストを、受け取った時刻とともに記録します。
+        """
+        with self._lock:
+            self.received.append({"name": name, "time": time.monotonic(), "body": body})
+
+    def next_vision_response(self) -> Dict[str, Any]:
+        """1画像分の読み取り結果を返します。
+        """
+        if len(self.vision_replay) == 0:
+            return {"textAnnotations": [{"description": self.vision_text}]}
+        with self._lock:
+            index = self._replay_index["vision"]
+            self._replay_index["vision"] = index + 1
+        return self.vision_replay[index % len(self.vision_replay)]
+
+    def next_slack_response(self, default_body: str) -> Dict[str, Any]:
+        """Slack の応答を返します。
+        """
+        if len(self.slack_replay) == 0:
+            return {"status": 200, "body": default_body}
+        with self._lock:
+            index = self._replay_index["slack"]
+            self._replay_index["slack"] = index + 1
+        return self.slack_replay[index % len(self.slack_replay)]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Vision API と Slack の各エンドポイントに応答するハンドラーです。
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        state = self.server.state
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = self.path.split("?")[0]
+
+        if path.endswith("/images:annotate"):
+            state.count("vision")
+            time.sleep(state.vision_latency_seconds)
+            requests = json.loads(body).get("requests", [])
+            self._send(200, "application/json", json.dumps({
+                "responses": [state.next_vision_response() for _ in requests],
+            }))
+        elif path == "/slack/webhook":
+            state.count("slack_webhook")
+            state.record("slack_webhook", body)
+            time.sleep(state.slack_latency_seconds)
+            response = state.next_slack_response("ok")
+            self._send(response["status"], "text/plain", response["body"], response.get("headers"))
+        elif path.startswith("/slack/api/"):
+            state.count(path[len("/slack/api/"):])
+            state.record(path[len("/slack/api/"):], body)
+            time.sleep(state.slack_latency_seconds)
+            response = state.next_slack_response(json.dumps({"ok": True}))
+            self._send(response["status"], "application/json", response["body"], response.get("headers"))
+        else:
+            self._send(404, "text/plain", "not found")
+
+    def log_message(self, format, *args):
+        # 計測の妨げにならないようにアクセスログは出力しない
+        pass
+
+    def _send(self, status: int, content_type: str, body: str, headers: Optional[Dict[str, str]] = None):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start(state: StubState, port: int = 0) -> ThreadingHTTPServer:
+    """スタブサーバーをバックグラウンドのスレッドで起動します。
+
+    Arguments:
+        state {StubState} -- スタブの応答内容
+
+    Keyword Arguments:
+        port {int} -- 待ち受けるポート番号 (default: {0} で空いているポート)
+
+    Returns:
+        ThreadingHTTPServer -- 起動したサーバー (server_port で実際のポート番号を参照できる)
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def load_replay(path: Optional[str]) -> Optional[List[Dict[str, Any]]]:
+    """応答を再生するファイルを読み込みます。
+    """
+    if path is None:
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """スタブの設定に関するコマンドライン引数を追加します。
+    """
+    parser.add_argument("--vision-latency-ms", type=float, default=0.0, help="Vision API の応答までに待つミリ秒")
+    parser.add_argument("--slack-latency-ms", type=float, default=0.0, help="Slack の応答までに待つミリ秒")
+    parser.add_argument("--vision-replay", help="Vision API の読み取り結果を順に返すJSONファイル")
+    parser.add_argument("--slack-replay", help="Slack の応答を順に返すJSONファイル")
+
+
+def create_state(args: argparse.Namespace) -> StubState:
+    """コマンドライン引数からスタブの応答内容を生成します。
+    """
+    return StubState(
+        vision_latency_seconds=args.vision_latency_ms / 1000,
+        slack_latency_seconds=args.slack_latency_ms / 1000,
+        vision_replay=load_replay(args.vision_replay),
+        slack_replay=load_replay(args.slack_replay),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8080, help="待ち受けるポート番号")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = start(create_state(args), args.port)
+    print(f"スタブサーバーを起動しました: http://127.0.0.1:{server.server_port}")
+    print(f"    [detect] ocr_api_url=http://127.0.0.1:{server.server_port}/v1/images:annotate")
+    print(f"    [slack] incoming_webhook_url=http://127.0.0.1:{server.server_port}/slack/webhook")
+    print(f"    [slack] api_base_url=http://127.0.0.1:{server.server_port}/slack/api")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""Add Indexes
+
+Revision ID: 0e05961af45c
+Revises: 186c0614b975
+Create Date: 2026-10-18 15:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0e05961af45c'
+down_revision = '186c0614b975'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 一意インデックスを張る前に、重複したセッションIDの仮登録レコードは最新のものだけを残す
+    op.execute(
+        "DELETE FROM temporary_products "
+        "WHERE id NOT IN (SELECT MAX(id) FROM temporary_products GROUP BY session_id)"
+    )
+    op.create_index('ix_temporary_products_session_id', 'temporary_products', ['session_id'], unique=True)
+    op.create_index('ix_temporary_products_created_time', 'temporary_products', ['created_time'], unique=False)
+
+    # 期限前で未アクションの商品だけを対象とする部分インデックス
+    op.create_index(
+        'ix_products_active_expiration_date', 'products', ['expiration_date', 'created_time'], unique=False,
+        sqlite_where=sa.text('consumed = 0 AND added_shopping_list = 0')
+    )
+    op.create_index('ix_products_expiration_date', 'products', ['expiration_date'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_products_expiration_date', table_name='products')
+    op.drop_index('ix_products_active_expiration_date', table_name='products')
+    op.drop_index('ix_temporary_products_created_time', table_name='temporary_products')
+    op.drop_index('ix_temporary_products_session_id', table_name='temporary_products')
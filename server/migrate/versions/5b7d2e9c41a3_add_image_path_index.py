@@ -0,0 +1,25 @@
+"""Add Image Path Index
+
+Revision ID: 5b7d2e9c41a3
+Revises: 0e05961af45c
+Create Date: 2026-10-18 21:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b7d2e9c41a3'
+down_revision = '0e05961af45c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 同じ内容の商品イメージ画像を共有する商品を数えるためのインデックス
+    op.create_index('ix_products_image_path', 'products', ['image_path'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_products_image_path', table_name='products')
@@ -0,0 +1,47 @@
+"""Add Outbox
+
+Revision ID: 8c3f1a7d52e0
+Revises: 5b7d2e9c41a3
+Create Date: 2026-10-18 23:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c3f1a7d52e0'
+down_revision = '5b7d2e9c41a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('outbox_messages',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('destination', sa.Text(), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('dedupe_key', sa.Text(), nullable=True),
+    sa.Column('status', sa.Text(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_time', sa.DateTime(), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('sent_time', sa.DateTime(), nullable=True),
+    sa.Column('created_time', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_outbox_messages_status_next_attempt_time', 'outbox_messages', ['status', 'next_attempt_time'], unique=False)
+    op.create_index('ix_outbox_messages_dedupe_key', 'outbox_messages', ['dedupe_key', 'status'], unique=False)
+    op.create_table('outbox_rate_limits',
+    sa.Column('destination', sa.Text(), nullable=False),
+    sa.Column('tokens', sa.Float(), nullable=False),
+    sa.Column('updated_time', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('destination')
+    )
+
+
+def downgrade():
+    op.drop_table('outbox_rate_limits')
+    op.drop_index('ix_outbox_messages_dedupe_key', table_name='outbox_messages')
+    op.drop_index('ix_outbox_messages_status_next_attempt_time', table_name='outbox_messages')
+    op.drop_table('outbox_messages')
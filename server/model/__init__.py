@@ -8,4 +8,4 @@ Base = declarative_base()
 # Alembicにて自動的にマイグレーションを行う
 import sys
 sys.path.insert(0, "./model")
-import products, temporary_products
+import products, temporary_products, outbox_messages, outbox_rate_limits
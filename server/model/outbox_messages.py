@@ -0,0 +1,50 @@
+###############################################################################
+#    外部 (Slack) に送信するメッセージの送信待ち行列 (アウトボックス) を表すテーブルの定義
+###############################################################################
+from model import Base
+from sqlalchemy import Index
+from sqlalchemy.sql.schema import Column
+from sqlalchemy.sql.sqltypes import Integer, Text, DateTime
+
+
+"""送信待ちメッセージトランザクションテーブル
+"""
+class OutboxMessage(Base):
+    __tablename__ = "outbox_messages"
+    __table_args__ = (
+        # 送信期限を迎えたメッセージを古い順に取り出すためのインデックス (outbox)
+        Index("ix_outbox_messages_status_next_attempt_time", "status", "next_attempt_time"),
+        # 送信待ちの同じ内容のメッセージをまとめるためのインデックス (outbox)
+        Index("ix_outbox_messages_dedupe_key", "dedupe_key", "status"),
+        {"extend_existing": True},
+    )
+
+    # 固有のID
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    # 送信先の種類 (slack_webhook / slack_file_upload)
+    destination = Column(Text, nullable=False)
+
+    # 送信内容 (JSON)
+    payload = Column(Text, nullable=False)
+
+    # 送信待ちの間に同じキーのメッセージが追加されたら1件にまとめるためのキー
+    dedupe_key = Column(Text, nullable=True)
+
+    # 状態 (pending / sending / sent / failed / collapsed)
+    status = Column(Text, nullable=False)
+
+    # 送信を試みた回数
+    attempts = Column(Integer, nullable=False)
+
+    # 次に送信を試みる日時 (送信中の場合は、送信が終わらなかったとみなして再送する日時)
+    next_attempt_time = Column(DateTime, nullable=False)
+
+    # 最後に送信に失敗した原因
+    last_error = Column(Text, nullable=True)
+
+    # 送信に成功した日時
+    sent_time = Column(DateTime, nullable=True)
+
+    # レコード作成日時
+    created_time = Column(DateTime, nullable=False)
@@ -0,0 +1,25 @@
+###############################################################################
+#    送信先ごとの送信頻度の制限 (トークンバケット) の状態を表すテーブルの定義
+#    全プロセスで同じ状態を共有し、1文の UPDATE でトークンを取り出します。
+###############################################################################
+from model import Base
+from sqlalchemy.sql.schema import Column
+from sqlalchemy.sql.sqltypes import Float, Text
+
+
+"""送信頻度制限マスターテーブル
+"""
+class OutboxRateLimit(Base):
+    __tablename__ = "outbox_rate_limits"
+    __table_args__ = (
+        {"extend_existing": True},
+    )
+
+    # 送信先の種類
+    destination = Column(Text, primary_key=True)
+
+    # バケットに残っているトークンの数 (負の値は送信先から待機を指示された分の借り)
+    tokens = Column(Float, nullable=False)
+
+    # トークンの数を最後に更新した時刻 (UNIX時間)
+    updated_time = Column(Float, nullable=False)
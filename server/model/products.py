@@ -2,7 +2,7 @@
 #    本登録済みの商品を表すテーブルの定義
 ###############################################################################
 from model import Base
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.schema import Column
 from sqlalchemy.sql.sqltypes import Integer, Text, Boolean, DateTime
@@ -12,7 +12,20 @@ from sqlalchemy.sql.sqltypes import Integer, Text, Boolean, DateTime
 """
 class Product(Base):
     __tablename__ = "products"
-    __table_args__ = {"extend_existing": True}
+    __table_args__ = (
+        # 期限前で未アクションの商品を賞味期限順に列挙するための部分インデックス (listup, remind)
+        # SQLite に使わせるには、クエリー側でも同じ条件をリテラルの 0 と比較する必要がある
+        Index(
+            "ix_products_active_expiration_date",
+            "expiration_date", "created_time",
+            sqlite_where=text("consumed = 0 AND added_shopping_list = 0")
+        ),
+        # 期限切れの商品を削除するためのインデックス (cleanup)
+        Index("ix_products_expiration_date", "expiration_date"),
+        # 同じ内容の商品イメージ画像を共有する商品を数えるためのインデックス (image_store)
+        Index("ix_products_image_path", "image_path"),
+        {"extend_existing": True},
+    )
 
     # 固有のID
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -2,7 +2,7 @@
 #    暫定登録済みの商品を表すテーブルの定義
 ###############################################################################
 from model import Base
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.schema import Column
 from sqlalchemy.sql.sqltypes import Integer, Text, Boolean, DateTime
@@ -12,7 +12,13 @@ from sqlalchemy.sql.sqltypes import Integer, Text, Boolean, DateTime
 """
 class TemporaryProduct(Base):
     __tablename__ = "temporary_products"
-    __table_args__ = {"extend_existing": True}
+    __table_args__ = (
+        # セッションIDから仮登録レコードを特定するためのインデックス (register, cancel)
+        Index("ix_temporary_products_session_id", "session_id", unique=True),
+        # 古い仮登録レコードを削除するためのインデックス (cleanup)
+        Index("ix_temporary_products_created_time", "created_time"),
+        {"extend_existing": True},
+    )
 
     # 固有のID
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -0,0 +1,4 @@
+###############################################################################
+#    運用時に手動で実行する保守用のスクリプト群
+#    いずれも /server/ 直下を起動ディレクトリーとして python -m tools.xxx の形式で実行して下さい。
+###############################################################################
@@ -0,0 +1,145 @@
+###############################################################################
+#    画像保管先の直下にセッションIDのファイル名で保管されている商品イメージ画像を、
+#    内容のハッシュ値で階層化した保管方式 (app/image_store.py) に移行します。
+#    同じ内容の画像は1つのファイルにまとめ、本登録テーブルの image_path を書き換えた後に元のファイルと縮小版を削除します。
+#    何度実行しても同じ結果になるため、中断した場合はそのまま再実行して下さい。
+#
+#    実行例: python -m tools.migrate_images --dry-run
+#            python -m tools.migrate_images
+#            python -m tools.migrate_images --gc
+###############################################################################
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from typing import Tuple
+sys.path.insert(0, ".")
+
+import app.common as common
+import app.image_store as image_store
+import app.thumbnails as thumbnails
+import app.contact_sheets as contact_sheets
+from model.products import Product
+
+# 1回のトランザクションで書き換える画像の数
+BATCH_SIZE = 200
+# --gc で削除対象から外す、書き込まれてからの秒数 (本登録のコミット待ちの画像を守る)
+GC_MIN_AGE_SECONDS = 3600
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dry-run", action="store_true", help="移行対象を数えるだけで、ファイルとDBを変更しない")
+    parser.add_argument("--gc", action="store_true", help="移行後に、どの商品からも参照されていない画像を削除する")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="1回のトランザクションで書き換える画像の数")
+    args = parser.parse_args()
+
+    migrated, missing = migrate(args.batch_size, args.dry_run)
+    print(f"移行した画像: {migrated} 件, 見つからなかった画像: {missing} 件")
+
+    if args.gc:
+        removed = collect_garbage(args.dry_run)
+        print(f"参照されていない画像: {removed} 件")
+
+
+def migrate(batch_size: int, dry_run: bool) -> Tuple[int, int]:
+    """移行前の画像を内容のハッシュ値で保管し直し、本登録テーブルの参照先を書き換えます。
+
+    Arguments:
+        batch_size {int} -- 1回のトランザクションで書き換える画像の数
+        dry_run {bool} -- ファイルとDBを変更しないかどうか
+
+    Returns:
+        Tuple[int, int] -- (移行した画像の数, ファイルが見つからないか読み取れなかった画像の数)
+    """
+    with common.create_session() as session:
+        legacy_paths = sorted(set([
+            image_path
+            for image_path, in session.query(Product.image_path).distinct().all()
+            if not image_store.CONTENT_ADDRESSED_NAME_PATTERN.match(image_store.get_name(image_path))
+        ]))
+
+    migrated = 0
+    missing = 0
+    for start in range(0, len(legacy_paths), batch_size):
+        # 古いパス -> 新しいパス
+        moves = {}
+        for legacy_path in legacy_paths[start:start + batch_size]:
+            try:
+                with open(legacy_path, "rb") as f:
+                    image = common.JpegImage(np.frombuffer(f.read(), dtype=np.uint8))
+            except FileNotFoundError:
+                print(f"画像が見つからないため移行できません: {legacy_path}", file=sys.stderr)
+                missing += 1
+                continue
+            except ValueError as e:
+                print(f"JPEG画像として読み取れないため移行できません: {legacy_path}: {e}", file=sys.stderr)
+                missing += 1
+                continue
+            if dry_run:
+                moves[legacy_path] = image_store.get_path(image_store.get_content_name(image.data.tobytes()))
+            else:
+                moves[legacy_path] = image_store.save(image)
+
+        migrated += len(moves)
+        if dry_run or len(moves) == 0:
+            continue
+
+        with common.create_session() as session:
+            for legacy_path, image_path in moves.items():
+                session \
+                    .query(Product) \
+                    .filter(Product.image_path == legacy_path) \
+                    .update({Product.image_path: image_path}, synchronize_session=False)
+            session.commit()
+
+        # 参照先を書き換えた後に、元のファイルと縮小版を削除
+        for legacy_path in moves.keys():
+            try:
+                os.remove(legacy_path)
+            except FileNotFoundError:
+                pass
+        thumbnails.remove_variants(list(moves.keys()))
+        print(f"{migrated} / {len(legacy_paths)} 件移行しました")
+
+    return migrated, missing
+
+
+def collect_garbage(dry_run: bool) -> int:
+    """画像保管先にあるファイルのうち、どの商品からも参照されていない画像とその縮小版を削除します。
+    書き込まれてから間もない画像は本登録のコミット待ちの可能性があるため残します。
+
+    Arguments:
+        dry_run {bool} -- ファイルを変更しないかどうか
+
+    Returns:
+        int -- 参照されていない画像の数
+    """
+    with common.create_session() as session:
+        referenced = set([os.path.abspath(image_path) for image_path, in session.query(Product.image_path).distinct().all()])
+
+    deadline = time.time() - GC_MIN_AGE_SECONDS
+    unreferenced = []
+    for directory_path, directory_names, file_names in os.walk(image_store.DESTINATION_DIRECTORY_PATH):
+        # 縮小版は元の画像と合わせて削除し、一覧画像は生成時に古いものから削除される
+        for excluded_name in (thumbnails.THUMBNAIL_DIRECTORY_NAME, contact_sheets.CONTACT_SHEET_DIRECTORY_NAME):
+            if excluded_name in directory_names:
+                directory_names.remove(excluded_name)
+        for file_name in file_names:
+            image_path = os.path.join(directory_path, file_name)
+            if not file_name.endswith(image_store.EXTENSION) or os.path.abspath(image_path) in referenced:
+                continue
+            if deadline < os.path.getmtime(image_path):
+                continue
+            unreferenced.append(image_path)
+
+    if not dry_run:
+        for image_path in unreferenced:
+            os.remove(image_path)
+        thumbnails.remove_variants(unreferenced)
+    return len(unreferenced)
+
+
+if __name__ == "__main__":
+    main()